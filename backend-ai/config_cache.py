@@ -0,0 +1,172 @@
+# backend-ai/config_cache.py
+# ==========================================
+# 設定快取 (/config/all) + 跨 worker 異動通知
+# ==========================================
+# 前端每次載入頁面都會打 /config/all，以前每次都查兩次 DB (含 tags ORDER BY usage_count)。
+# 分類 / 標籤很少變動，所以：
+# - 記憶體中保留一份快照 (已序列化好的 JSON + ETag)，命中時不碰 DB
+# - ETag 是內容的 hash，所有 worker 對相同內容算出相同的 ETag，瀏覽器帶 If-None-Match 就回 304
+# - 寫入路徑 (新增/刪除分類、標籤、文件標籤) 在同一個 transaction 中 pg_notify，
+#   commit 後每個 worker 的 ConfigChangeListener 收到通知就讓快取失效 (包含自己)
+# - 監聽連線斷掉時，重新連上後一律先失效一次 (可能漏掉通知)；另有 TTL 作為保險
+import asyncio
+import hashlib
+import json
+import os
+import select
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+
+CONFIG_CHANNEL = "config_changed"
+CONFIG_CACHE_TTL_SECONDS = float(os.getenv("CONFIG_CACHE_TTL_SECONDS", "300"))
+CONFIG_LISTEN = os.getenv("CONFIG_LISTEN", "1") != "0"
+LISTEN_RECONNECT_SECONDS = 5.0
+
+
+def notify_config_changed(conn, reason: str = ""):
+    """在寫入的 transaction 中呼叫；NOTIFY 會在 commit 時才送出，rollback 則不送"""
+    conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                 {"channel": CONFIG_CHANNEL, "payload": f"{os.getpid()}:{reason}"})
+
+
+class ConfigSnapshot:
+    __slots__ = ("payload", "body", "etag", "generation", "loaded_at")
+
+    def __init__(self, payload: dict, generation: int):
+        self.payload = payload
+        self.body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()[:20]}"'
+        self.generation = generation
+        self.loaded_at = time.monotonic()
+
+
+class ConfigCache:
+    def __init__(self, load: Callable[[], Awaitable[dict]], ttl_seconds: float = CONFIG_CACHE_TTL_SECONDS):
+        """load: async 函式，回傳 {"categories": [...], "tags": [...]}"""
+        self.load = load
+        self.ttl = ttl_seconds
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._generation = 0
+        self._gen_lock = threading.Lock()  # invalidate() 會從監聽執行緒呼叫
+        self._load_lock = asyncio.Lock()
+
+        self.version = 0  # 內容 (ETag) 每變一次 +1
+        self.hits = 0
+        self.reloads = 0
+        self.invalidations = 0
+
+    def invalidate(self):
+        with self._gen_lock:
+            self._generation += 1
+            self.invalidations += 1
+
+    def _fresh(self, snap: Optional[ConfigSnapshot]) -> bool:
+        return (snap is not None and snap.generation == self._generation
+                and time.monotonic() - snap.loaded_at <= self.ttl)
+
+    async def get(self) -> ConfigSnapshot:
+        snap = self._snapshot
+        if self._fresh(snap):
+            self.hits += 1
+            return snap
+
+        # 同時間只讓一個請求重新載入，其他人等同一份結果
+        async with self._load_lock:
+            snap = self._snapshot
+            if self._fresh(snap):
+                self.hits += 1
+                return snap
+            # 先記下 generation：載入期間若又被 invalidate，下次請求會再載入一次
+            generation = self._generation
+            new = ConfigSnapshot(await self.load(), generation)
+            if snap is None or new.etag != snap.etag:
+                self.version += 1
+            self._snapshot = new
+            self.reloads += 1
+            return new
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {
+            "version": self.version,
+            "etag": snap.etag if snap else None,
+            "age_seconds": round(time.monotonic() - snap.loaded_at, 1) if snap else None,
+            "hits": self.hits,
+            "reloads": self.reloads,
+            "invalidations": self.invalidations,
+        }
+
+
+class ConfigChangeListener:
+    """用一條獨立的 psycopg2 連線 LISTEN，收到通知就呼叫所有 callback"""
+
+    def __init__(self, db_url: str, callbacks: List[Callable[[], None]], channel: str = CONFIG_CHANNEL):
+        # psycopg2.connect 吃的是 libpq 的 URI (不含 +driver)
+        self.dsn = make_url(db_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.callbacks = list(callbacks)
+        self.channel = channel
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.notifications = 0
+        self.connections = 0
+        self.connected = False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="config-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 3.0):
+        self._stopping.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _fire(self):
+        for callback in self.callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ 設定異動 callback 失敗: {e}")
+
+    def _run(self):
+        import psycopg2
+
+        while not self._stopping.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                self.connected = True
+                if self.connections:
+                    self._fire()  # 斷線期間可能漏掉通知
+                self.connections += 1
+
+                while not self._stopping.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        self.notifications += len(conn.notifies)
+                        conn.notifies.clear()
+                        self._fire()  # 一次 poll 收到多筆通知只需失效一次
+            except Exception as e:
+                self.connected = False
+                print(f"⚠️ LISTEN {self.channel} 中斷，{LISTEN_RECONNECT_SECONDS:.0f}s 後重連: {e}")
+                self._stopping.wait(LISTEN_RECONNECT_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+        self.connected = False
+
+    def stats(self) -> dict:
+        return {"connected": self.connected, "notifications": self.notifications,
+                "connections": self.connections}
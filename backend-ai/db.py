@@ -0,0 +1,140 @@
+# backend-ai/db.py
+# ==========================================
+# 資料庫連線池 (同步 + 非同步)
+# ==========================================
+# - 同步 engine (psycopg2)：上傳、訓練、背景工作、COPY 等批次路徑
+# - 非同步 engine (asyncpg)：/search、/config/all 等高頻請求，
+#   不再佔用 FastAPI 的 threadpool 等 DB
+# - 連線池大小、溢出、逾時都可用環境變數調整 (不再用預設的 5 + 10)
+# - asyncpg 會快取 prepared statement，熱門查詢的 SQL 字串固定 (見 search_engine)，只需解析一次
+# - 記錄「等待取得連線」的時間分佈，/metrics/db 可以看到連線池是否不夠用
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", "20"))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+# 等待時間分桶 (毫秒)，大於最後一個值算在 +Inf
+WAIT_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class PoolWaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.timeouts = 0
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.buckets[bisect_left(WAIT_BUCKETS_MS, seconds * 1000)] += 1
+
+    def percentile_ms(self, q: float) -> float:
+        """以分桶上界估算百分位數"""
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= target:
+                return WAIT_BUCKETS_MS[i] if i < len(WAIT_BUCKETS_MS) else round(self.max_seconds * 1000, 2)
+        return 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": self.count,
+                "total_wait_seconds": self.total_seconds,  # 未四捨五入，給 /metrics 的 _sum 使用
+                "avg_wait_ms": round(self.total_seconds * 1000 / self.count, 3) if self.count else 0.0,
+                "p95_wait_ms": self.percentile_ms(0.95),
+                "p99_wait_ms": self.percentile_ms(0.99),
+                "max_wait_ms": round(self.max_seconds * 1000, 3),
+                "timeouts": self.timeouts,
+                "histogram": dict(zip(labels, self.buckets)),
+            }
+
+
+class _TimedPoolMixin:
+    """在取得連線 (_do_get) 前後計時；pool.recreate() 用的是同一個類別，所以統計會延續"""
+    wait_stats: PoolWaitStats = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.wait_stats.timeouts += 1
+            raise
+        finally:
+            self.wait_stats.record(time.perf_counter() - started)
+
+
+def _timed_pool_class(base):
+    stats = PoolWaitStats()
+    return type(f"Timed{base.__name__}", (_TimedPoolMixin, base), {"wait_stats": stats})
+
+
+def create_sync_engine(url: str):
+    return create_engine(
+        url,
+        poolclass=_timed_pool_class(QueuePool),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+    )
+
+
+def async_url(url: str) -> str:
+    """postgresql:// 或 postgresql+psycopg2:// -> postgresql+asyncpg://"""
+    u = make_url(url).set(drivername="postgresql+asyncpg")
+    return u.render_as_string(hide_password=False)
+
+
+def create_async_db_engine(url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    return create_async_engine(
+        async_url(url),
+        poolclass=_timed_pool_class(AsyncAdaptedQueuePool),
+        pool_size=DB_ASYNC_POOL_SIZE,
+        max_overflow=DB_ASYNC_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        # SQLAlchemy 方言層的 prepared statement 快取 + asyncpg 自己的 statement cache
+        connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+                      "statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    )
+
+
+def pool_stats(engine) -> dict:
+    """engine 可以是同步 Engine 或 AsyncEngine"""
+    pool = getattr(engine, "sync_engine", engine).pool
+    stats = {
+        "pool_size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "max_overflow": pool._max_overflow,
+    }
+    if isinstance(pool, _TimedPoolMixin):
+        stats.update(pool.wait_stats.snapshot())
+    return stats
@@ -0,0 +1,271 @@
+# backend-ai/embedding_backend.py
+# ==========================================
+# 可替換的 Embedding 後端 (torch / ONNX int8) + 延遲載入
+# ==========================================
+# 以前 main.py 在 import 時就 SentenceTransformer(...)，每個 worker 都要載入完整的 torch (~1 GB RSS)，
+# 連只服務 /sales/* 的 worker 也一樣，容器啟動很慢。
+#
+# EMBEDDING_BACKEND
+#   torch : sentence-transformers (預設，與資料庫內既有向量完全一致)
+#   onnx  : ONNX Runtime + tokenizers，不需要 torch。用 `python embedding_backend.py export` 匯出並量化成 int8；
+#           匯出時會與 torch 版比對，cosine 平均需 >= ONNX_MIN_MEAN_COSINE、最低需 >= ONNX_MIN_COSINE，
+#           否則匯出失敗 (所以可以直接與既有的 384 維向量混用，不必重建索引)。
+#           匯出先寫到暫存資料夾，驗證通過才換上；載入時也會檢查 meta.json，未通過驗證的模型拒絕使用
+# EMBEDDING_LOAD
+#   lazy  : 第一次 encode 時才載入 (預設；沒用到搜尋 / 文件功能的 worker 完全不載入)
+#   eager : import 時就載入。搭配 `gunicorn -k uvicorn.workers.UvicornWorker --preload main:app`
+#           可以在 fork 前只載入一次，所有 worker 共用同一份 (copy-on-write) 權重記憶體
+import argparse
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_LOAD = os.getenv("EMBEDDING_LOAD", "lazy")
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", os.path.join("models", "embedding-onnx"))
+EMBEDDING_ONNX_THREADS = int(os.getenv("EMBEDDING_ONNX_THREADS", "0"))  # 0 = onnxruntime 自行決定
+EMBEDDING_MAX_SEQ_LENGTH = 128  # 與 paraphrase-multilingual-MiniLM-L12-v2 相同
+
+ONNX_MIN_MEAN_COSINE = 0.99
+ONNX_MIN_COSINE = 0.97
+ONNX_MODEL_FILES = ("model_int8.onnx", "model.onnx")  # 有量化版就優先使用
+ONNX_META_FILE = "meta.json"
+
+# 匯出時用來驗證誤差的句子 (涵蓋中英混合與長句)
+CALIBRATION_SENTENCES = [
+    "掃碼點餐設定", "如何開立電子發票", "Uber Eats 訂單沒有同步到 POS", "會員點數怎麼折抵",
+    "印表機斷線無法列印出單", "信用卡刷卡失敗的處理方式", "外送平台菜單更新", "退款流程",
+    "How do I reset the kitchen display system?", "LINE Pay 付款後沒有跳出成功畫面",
+    "營業日結帳報表在哪裡下載？需要店長權限才能看到每日的銷售明細與支付方式統計。",
+    "商品售完後如何在線上菜單暫停販售，並在隔天自動恢復？",
+]
+
+
+class TorchBackend:
+    name = "torch"
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, sentences, **kwargs):
+        return self.model.encode(sentences, **kwargs)
+
+
+class OnnxBackend:
+    """ONNX Runtime 版：tokenizer -> transformer -> mean pooling (與 sentence-transformers 的 pooling 相同)"""
+    name = "onnx"
+
+    def __init__(self, model_dir: str = EMBEDDING_ONNX_DIR, threads: int = EMBEDDING_ONNX_THREADS,
+                 verify: bool = True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = next((os.path.join(model_dir, f) for f in ONNX_MODEL_FILES
+                     if os.path.exists(os.path.join(model_dir, f))), None)
+        if path is None:
+            raise FileNotFoundError(f"{model_dir} 沒有 ONNX 模型，請先執行: python embedding_backend.py export")
+        if verify:
+            check_onnx_meta(model_dir, os.path.basename(path))
+        options = ort.SessionOptions()
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.model_path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=EMBEDDING_MAX_SEQ_LENGTH)
+        pad_token = "<pad>" if self.tokenizer.token_to_id("<pad>") is not None else "[PAD]"
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, normalize_embeddings: bool = False,
+               convert_to_numpy: bool = True, show_progress_bar: bool = False, **_):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        outputs = []
+        for i in range(0, len(texts), max(1, batch_size)):
+            encoded = self.tokenizer.encode_batch(texts[i:i + batch_size])
+            ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feeds = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(ids)
+            hidden = self.session.run(None, feeds)[0]
+            weights = mask[..., None].astype(np.float32)
+            emb = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                emb = emb / np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+            outputs.append(emb.astype(np.float32))
+        result = np.vstack(outputs) if outputs else np.zeros((0, 384), dtype=np.float32)
+        return result[0] if single else result
+
+
+def check_onnx_meta(model_dir: str, model_file: str) -> dict:
+    """meta.json 必須存在、對應同一個模型檔，且 cosine 達到門檻，否則拒絕載入"""
+    try:
+        with open(os.path.join(model_dir, ONNX_META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        raise RuntimeError(f"{model_dir} 缺少有效的 {ONNX_META_FILE}，請重新執行: python embedding_backend.py export")
+    if meta.get("model_file", model_file) != model_file:
+        raise RuntimeError(f"{model_dir}/{model_file} 不是通過驗證的模型 ({meta.get('model_file')})")
+    if meta.get("mean_cosine", 0) < ONNX_MIN_MEAN_COSINE or meta.get("min_cosine", 0) < ONNX_MIN_COSINE:
+        raise RuntimeError(f"{model_dir} 的 ONNX 模型未通過驗證 (與 torch 差異過大): {meta}")
+    return meta
+
+
+BACKENDS = {"torch": lambda: TorchBackend(), "onnx": lambda: OnnxBackend()}
+
+
+class LazyEmbeddingModel:
+    """與 SentenceTransformer.encode 相同介面；第一次呼叫 (或 load()) 時才真正載入後端"""
+
+    def __init__(self, backend: str = EMBEDDING_BACKEND, factory: Optional[Callable[[], object]] = None):
+        if factory is None and backend not in BACKENDS:
+            raise ValueError(f"未知的 EMBEDDING_BACKEND: {backend} (可用: {', '.join(BACKENDS)})")
+        self.backend = backend
+        self._factory = factory or BACKENDS[backend]
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_seconds: Optional[float] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    print(f"正在載入 Embedding 模型 ({self.backend})...")
+                    started = time.perf_counter()
+                    self._model = self._factory()
+                    self.load_seconds = round(time.perf_counter() - started, 3)
+                    print(f"✅ Embedding 模型載入完成 ({self.load_seconds}s)")
+        return self._model
+
+    def encode(self, sentences, **kwargs):
+        return self.load().encode(sentences, **kwargs)
+
+    def stats(self) -> dict:
+        return {"backend": self.backend, "loaded": self.loaded, "load_seconds": self.load_seconds}
+
+
+def create_embedding_model(backend: str = EMBEDDING_BACKEND, load: str = EMBEDDING_LOAD) -> LazyEmbeddingModel:
+    model = LazyEmbeddingModel(backend)
+    if load == "eager":
+        model.load()
+    return model
+
+
+def batch_encoder(model, batch_size: int = 64) -> Callable[[List[str]], np.ndarray]:
+    """批次寫入 (bulk 匯入 / 區塊回填) 用的 encode：一律 normalize，與線上微批次服務寫入的向量一致
+    (ONNX 後端預設不 normalize，漏傳會讓存進資料庫的向量長度不一)"""
+    def encode_batch(texts):
+        return model.encode(texts, batch_size=batch_size, normalize_embeddings=True, show_progress_bar=False)
+    return encode_batch
+
+
+# ==========================================
+# 匯出 ONNX (需要 torch + sentence-transformers；只在建置時執行一次)
+# ==========================================
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def export_onnx(out_dir: str = EMBEDDING_ONNX_DIR, model_name: str = EMBEDDING_MODEL_NAME,
+                quantize: bool = True) -> dict:
+    # 先寫到暫存資料夾，驗證通過才換掉正式資料夾 (失敗時不會留下未通過驗證的模型)
+    out_dir = out_dir.rstrip("/\\")
+    work_dir = f"{out_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    try:
+        meta = _export_to(work_dir, model_name, quantize)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    old_dir = f"{out_dir}.old-{os.getpid()}"
+    if os.path.exists(out_dir):
+        os.replace(out_dir, old_dir)
+    os.replace(work_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return meta
+
+
+def _export_to(out_dir: str, model_name: str, quantize: bool) -> dict:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0].auto_model.eval()
+    st.tokenizer.save_pretrained(out_dir)  # 產生 tokenizer.json
+
+    class _Encoder(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    dummy = st.tokenizer(CALIBRATION_SENTENCES[:2], padding=True, return_tensors="pt")
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    torch.onnx.export(
+        _Encoder(transformer), (dummy["input_ids"], dummy["attention_mask"]), fp32_path,
+        input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+        dynamic_axes={"input_ids": {0: "batch", 1: "seq"}, "attention_mask": {0: "batch", 1: "seq"},
+                      "last_hidden_state": {0: "batch", 1: "seq"}},
+        opset_version=14,
+    )
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(fp32_path, os.path.join(out_dir, "model_int8.onnx"), weight_type=QuantType.QInt8)
+
+    # 與 torch 版比對誤差
+    reference = st.encode(CALIBRATION_SENTENCES, convert_to_numpy=True)
+    backend = OnnxBackend(out_dir, verify=False)
+    cos = cosine_rows(reference, backend.encode(CALIBRATION_SENTENCES))
+    meta = {
+        "model_name": model_name,
+        "model_file": os.path.basename(backend.model_path),
+        "quantized": quantize,
+        "max_seq_length": EMBEDDING_MAX_SEQ_LENGTH,
+        "mean_cosine": round(float(cos.mean()), 5),
+        "min_cosine": round(float(cos.min()), 5),
+        "exported_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if meta["mean_cosine"] < ONNX_MIN_MEAN_COSINE or meta["min_cosine"] < ONNX_MIN_COSINE:
+        raise RuntimeError(f"ONNX 向量與 torch 差異過大: {meta}")
+    with open(os.path.join(out_dir, ONNX_META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding 後端工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="匯出 ONNX (預設量化成 int8) 並驗證誤差")
+    export.add_argument("--out", default=EMBEDDING_ONNX_DIR)
+    export.add_argument("--no-quantize", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        meta = export_onnx(args.out, quantize=not args.no_quantize)
+        print(f"✅ 已匯出到 {args.out}: cosine 平均 {meta['mean_cosine']}，最低 {meta['min_cosine']}")
+
+
+if __name__ == "__main__":
+    main()
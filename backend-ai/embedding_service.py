@@ -0,0 +1,180 @@
+# backend-ai/embedding_service.py
+# ==========================================
+# 微批次 Embedding 服務 (Micro-batching Embedding Engine)
+# ==========================================
+# SentenceTransformer 是 CPU 密集的模型，多個請求各自呼叫 encode() 只會互相搶 CPU。
+# 這裡改由單一背景執行緒收集同時間進來的請求，湊成一個 batch 一次 encode，
+# 每個呼叫端透過自己的 Future 拿回屬於自己的向量。
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+
+DEFAULT_MAX_BATCH_SIZE = int(os.getenv("EMBED_MAX_BATCH_SIZE", "32"))
+DEFAULT_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+DEFAULT_MAX_QUEUE_SIZE = int(os.getenv("EMBED_MAX_QUEUE_SIZE", "4096"))
+# 佇列滿時同步呼叫端最多等多久 (毫秒)，超過就回報過載；async 呼叫端不等待
+DEFAULT_SUBMIT_TIMEOUT_MS = float(os.getenv("EMBED_SUBMIT_TIMEOUT_MS", "200"))
+
+_STOP = object()
+
+
+class EmbeddingOverloadedError(RuntimeError):
+    """佇列已滿：模型跟不上請求量，呼叫端應回 503 讓用戶端稍後重試"""
+
+
+class EmbeddingBatcher:
+    """把並發的 encode 請求合併成微批次，由背景執行緒統一送進模型"""
+
+    def __init__(self, model, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE,
+                 max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 submit_timeout_ms: float = DEFAULT_SUBMIT_TIMEOUT_MS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.submit_timeout = max(0.0, submit_timeout_ms) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        # 統計數據
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._rejected = 0
+        self._encode_seconds = 0.0
+        self._max_queue_depth = 0
+        self._batch_size_hist: Counter = Counter()
+
+    # ---------- 生命週期 ----------
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    # ---------- 呼叫端 API ----------
+    def submit(self, text: str, timeout: Optional[float] = None) -> Future:
+        """送出一段文字，回傳之後會拿到 np.float32 向量的 Future；
+        佇列滿時最多等 timeout 秒 (預設 submit_timeout，0 = 不等)，仍滿則丟出 EmbeddingOverloadedError"""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            self.start()  # 尚未啟動，或執行緒意外結束時重新啟動
+        fut: Future = Future()
+        timeout = self.submit_timeout if timeout is None else timeout
+        try:
+            if timeout > 0:
+                self._queue.put((text, fut), timeout=timeout)
+            else:
+                self._queue.put_nowait((text, fut))
+        except queue.Full:
+            self._rejected += 1
+            raise EmbeddingOverloadedError(f"embedding 佇列已滿 ({self._queue.maxsize})，請稍後再試") from None
+        depth = self._queue.qsize()
+        if depth > self._max_queue_depth:
+            self._max_queue_depth = depth
+        return fut
+
+    def encode(self, text: str, timeout: Optional[float] = None) -> np.ndarray:
+        """同步版本：給 FastAPI 的 sync handler (threadpool) 使用"""
+        return self.submit(text).result(timeout)
+
+    async def aencode(self, text: str) -> np.ndarray:
+        """非同步版本：給 async handler 使用，不會卡住 event loop (佇列滿時立即回報過載，不等待)"""
+        return await asyncio.wrap_future(self.submit(text, timeout=0))
+
+    def encode_many(self, texts: List[str], timeout: Optional[float] = None) -> List[np.ndarray]:
+        futures = []
+        try:
+            for t in texts:
+                futures.append(self.submit(t))
+        except EmbeddingOverloadedError:
+            # 已排入的部分不必再 encode
+            for f in futures:
+                f.cancel()
+            raise
+        return [f.result(timeout) for f in futures]
+
+    # ---------- 背景執行緒 ----------
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # 先把手上的 batch 做完，再讓主迴圈結束
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            # 標記為執行中：之後呼叫端 cancel() 會失敗，set_result 不會因競態丟出 InvalidStateError；
+            # 已取消的 (例如用戶端斷線) 直接略過，不必 encode
+            batch = [(text, fut) for text, fut in self._collect_batch(first) if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            texts = [text for text, _ in batch]
+            started = time.perf_counter()
+            try:
+                vectors = self.model.encode(
+                    texts,
+                    batch_size=len(texts),
+                    normalize_embeddings=True,
+                    convert_to_numpy=True,
+                    show_progress_bar=False,
+                )
+            except Exception as e:  # 模型錯誤要回傳給每個呼叫端，不能讓執行緒掛掉
+                self._errors += 1
+                for _, fut in batch:
+                    fut.set_exception(e)
+                continue
+            self._encode_seconds += time.perf_counter() - started
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_size_hist[len(batch)] += 1
+            for (_, fut), vec in zip(batch, vectors):
+                fut.set_result(np.asarray(vec, dtype=np.float32))
+
+    # ---------- 監控 ----------
+    def stats(self) -> dict:
+        batches = self._batches
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self._max_queue_depth,
+            "batches": batches,
+            "items": self._items,
+            "errors": self._errors,
+            "rejected": self._rejected,
+            "avg_batch_size": round(self._items / batches, 3) if batches else 0.0,
+            "avg_encode_ms": round(self._encode_seconds * 1000.0 / batches, 3) if batches else 0.0,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_size_hist.items())},
+        }
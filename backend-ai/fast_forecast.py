@@ -0,0 +1,254 @@
+# backend-ai/fast_forecast.py
+# ==========================================
+# 輕量預測引擎 (Fast-path Forecaster)
+# ==========================================
+# Prophet.predict 每次都要建 DataFrame、重算假日特徵、做不確定區間抽樣，
+# 對長尾商品來說太重。這裡把訓練好的 Prophet 模型拆成純 NumPy 參數：
+#   - 趨勢：k, m, 變點 (changepoints) 與 delta
+#   - 季節性：每個 seasonality 的 period / fourier_order / beta
+#   - 台灣假日：預先算好每個假日日期的效果 (additive 或 multiplicative)
+# 之後可以一次對多個商品、多個日期做向量化計算：
+#   yhat = trend * (1 + multiplicative) + additive
+# 不確定區間預設不計算；需要時優先使用模型檔裡預先算好的 Prophet 區間寬度 (model_format.py)，
+# 沒有或超出範圍才只用觀測雜訊 sigma_obs 做近似 (不含趨勢不確定性)。
+import os
+import threading
+from collections import defaultdict
+from statistics import NormalDist
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+HOLIDAY_WINDOW_DAYS = int(os.getenv("FAST_FORECAST_HOLIDAY_WINDOW_DAYS", "1095"))
+_NS_PER_DAY = 86400 * 10 ** 9
+
+
+class UnsupportedModelError(Exception):
+    """模型用到 fast path 不支援的功能 (logistic 趨勢、額外迴歸變數、條件季節性)"""
+
+
+def day_float(dates) -> np.ndarray:
+    """與 Prophet fourier_series 相同的時間軸 (自 epoch 起的天數)"""
+    ns = pd.DatetimeIndex(dates).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return ns // 10 ** 9 / 86400.0
+
+
+def day_int(dates) -> np.ndarray:
+    ns = pd.DatetimeIndex(dates).to_numpy(dtype="datetime64[ns]").astype(np.int64)
+    return ns // _NS_PER_DAY
+
+
+def fourier_features(t_days: np.ndarray, period: float, order: int) -> np.ndarray:
+    x = 2 * np.pi * t_days[:, None] * np.arange(1, order + 1)[None, :] / period
+    out = np.empty((len(t_days), 2 * order))
+    out[:, 0::2] = np.sin(x)
+    out[:, 1::2] = np.cos(x)
+    return out
+
+
+class CompactModel:
+    """從 Prophet 模型抽出的最小參數集合 (全部是 NumPy 陣列 / 純量)"""
+
+    __slots__ = ("growth", "start_day", "t_scale_days", "y_scale", "trend_offset", "k", "m",
+                 "changepoints_t", "deltas", "seasonalities", "holiday_days", "holiday_effect",
+                 "holiday_mode", "sigma_obs", "interval_width", "last_day", "upper_offset", "lower_offset")
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.get(name))
+
+
+def _piecewise_linear(t, k, m, changepoints_t, deltas):
+    deltas_t = (changepoints_t[None, :] <= t[:, None]) * deltas[None, :]
+    return (k + deltas_t.sum(axis=1)) * t + (m + (deltas_t * -changepoints_t[None, :]).sum(axis=1))
+
+
+def extract(model, holiday_window_days: int = HOLIDAY_WINDOW_DAYS) -> CompactModel:
+    if isinstance(model, CompactModel):
+        return model  # 已經是精簡模型檔 (model_format.load_compact)
+    if model.growth not in ("linear", "flat"):
+        raise UnsupportedModelError(f"不支援 growth={model.growth}")
+    if model.extra_regressors:
+        raise UnsupportedModelError("不支援額外迴歸變數")
+    if any(props.get("condition_name") for props in model.seasonalities.values()):
+        raise UnsupportedModelError("不支援條件季節性")
+
+    history = model.history['ds']
+    last_date = history.max()
+    dates = pd.date_range(history.min(), last_date + pd.Timedelta(days=holiday_window_days), freq="D")
+    df = model.setup_dataframe(pd.DataFrame({"ds": dates}))
+    features, _, component_cols, _ = model.make_all_seasonality_features(df)
+    columns = list(features.columns)
+    beta = np.nanmean(model.params['beta'], axis=0)
+    multiplicative = set(model.component_modes['multiplicative'])
+
+    # 季節性：additive 的 beta 先乘上 y_scale，multiplicative 維持比例
+    seasonalities = []
+    for name, props in model.seasonalities.items():
+        idx = [i for i, c in enumerate(columns) if c.startswith(f"{name}_delim_")]
+        mode = "multiplicative" if name in multiplicative else "additive"
+        b = beta[idx] * (model.y_scale if mode == "additive" else 1.0)
+        seasonalities.append((float(props['period']), int(props['fourier_order']), mode, b))
+
+    # 假日：直接算好視窗內每一天的效果，只保留非 0 的日子
+    holiday_days = np.empty(0, dtype=np.int64)
+    holiday_effect = np.empty(0)
+    holiday_mode = "additive"
+    if "holidays" in component_cols.columns:
+        mask = component_cols["holidays"].to_numpy().astype(bool)
+        holiday_mode = "multiplicative" if "holidays" in multiplicative else "additive"
+        effect = features.to_numpy()[:, mask] @ beta[mask]
+        if holiday_mode == "additive":
+            effect = effect * model.y_scale
+        nz = np.nonzero(effect)[0]
+        holiday_days = day_int(dates[nz])
+        holiday_effect = effect[nz]
+
+    k = float(np.nanmean(model.params['k'])) if model.growth == "linear" else 0.0
+    m = float(np.nanmean(model.params['m']))
+    deltas = np.nanmean(model.params['delta'], axis=0) if model.growth == "linear" else np.zeros(0)
+    changepoints_t = np.asarray(model.changepoints_t, dtype=float) if model.growth == "linear" else np.zeros(0)
+    if len(changepoints_t) != len(deltas):
+        changepoints_t, deltas = np.zeros(0), np.zeros(0)
+
+    # 趨勢的常數項 (floor / minmax 縮放的 y_min) 依 Prophet 版本不同，直接跟 Prophet 對齊
+    t = df['t'].to_numpy()
+    ours = _piecewise_linear(t, k, m, changepoints_t, deltas) * model.y_scale
+    trend_offset = float(np.mean(model.predict_trend(df).to_numpy() - ours))
+
+    return CompactModel(
+        growth=model.growth,
+        start_day=float(day_float([model.start])[0]),
+        t_scale_days=model.t_scale / pd.Timedelta(days=1),
+        y_scale=float(model.y_scale),
+        trend_offset=trend_offset,
+        k=k, m=m, changepoints_t=changepoints_t, deltas=deltas,
+        seasonalities=seasonalities,
+        holiday_days=holiday_days, holiday_effect=holiday_effect, holiday_mode=holiday_mode,
+        sigma_obs=float(np.nanmean(model.params['sigma_obs'])),
+        interval_width=float(model.interval_width),
+        last_day=int(day_int([last_date])[0]),
+    )
+
+
+def predict_many(models: List[CompactModel], dates, include_intervals: bool = False) -> Dict[str, np.ndarray]:
+    """一次計算 K 個模型在 T 個日期的預測，回傳 shape (T, K) 的陣列"""
+    t_days = day_float(dates)
+    days = day_int(dates)
+    n_t, n_k = len(t_days), len(models)
+
+    # ---- 趨勢 (T, K)：變點數不同的模型用 +inf 補齊，mask 永遠為 False ----
+    n_cp = max((len(cm.changepoints_t) for cm in models), default=0)
+    cp = np.full((n_k, n_cp), np.inf)
+    deltas = np.zeros((n_k, n_cp))
+    for j, cm in enumerate(models):
+        cp[j, :len(cm.changepoints_t)] = cm.changepoints_t
+        deltas[j, :len(cm.deltas)] = cm.deltas
+    start = np.array([cm.start_day for cm in models])
+    t_scale = np.array([cm.t_scale_days for cm in models])
+    t = (t_days[:, None] - start[None, :]) / t_scale[None, :]
+
+    deltas_t = (cp[None, :, :] <= t[:, :, None]) * deltas[None, :, :]
+    cp_finite = np.where(np.isfinite(cp), cp, 0.0)
+    k_t = np.array([cm.k for cm in models])[None, :] + deltas_t.sum(axis=2)
+    m_t = np.array([cm.m for cm in models])[None, :] + (deltas_t * -cp_finite[None, :, :]).sum(axis=2)
+    trend = (k_t * t + m_t) * np.array([cm.y_scale for cm in models])[None, :] \
+        + np.array([cm.trend_offset for cm in models])[None, :]
+
+    # ---- 季節性：相同 (period, order) 的 Fourier 特徵只算一次，再乘上所有模型的 beta ----
+    additive = np.zeros((n_t, n_k))
+    multiplicative = np.zeros((n_t, n_k))
+    groups: Dict[Tuple[float, int], List[Tuple[int, str, np.ndarray]]] = defaultdict(list)
+    for j, cm in enumerate(models):
+        for period, order, mode, beta in cm.seasonalities:
+            groups[(period, order)].append((j, mode, beta))
+    for (period, order), members in groups.items():
+        feats = fourier_features(t_days, period, order)
+        for mode, target in (("additive", additive), ("multiplicative", multiplicative)):
+            cols = [(j, beta) for j, m, beta in members if m == mode]
+            if cols:
+                betas = np.stack([beta for _, beta in cols], axis=1)
+                target[:, [j for j, _ in cols]] += feats @ betas
+
+    # ---- 假日：查表 ----
+    for j, cm in enumerate(models):
+        if len(cm.holiday_days) == 0:
+            continue
+        idx = np.searchsorted(cm.holiday_days, days)
+        idx = np.clip(idx, 0, len(cm.holiday_days) - 1)
+        hit = cm.holiday_days[idx] == days
+        target = multiplicative if cm.holiday_mode == "multiplicative" else additive
+        target[hit, j] += cm.holiday_effect[idx[hit]]
+
+    yhat = trend * (1 + multiplicative) + additive
+    out = {"yhat": yhat}
+    if include_intervals:
+        # 近似區間：只考慮觀測雜訊 (Prophet 的區間另外包含趨勢變點的不確定性，會更寬)
+        z = np.array([NormalDist().inv_cdf((1 + cm.interval_width) / 2) for cm in models])
+        half = z[None, :] * np.array([cm.sigma_obs * cm.y_scale for cm in models])[None, :]
+        lower, upper = yhat - half, yhat + half
+        # 模型檔附帶訓練時 Prophet 算好的區間寬度 (從 last_day + 1 起逐日)，範圍內直接使用
+        for j, cm in enumerate(models):
+            if cm.upper_offset is None:
+                continue
+            idx = days - (cm.last_day + 1)
+            hit = (idx >= 0) & (idx < len(cm.upper_offset))
+            upper[hit, j] = yhat[hit, j] + cm.upper_offset[idx[hit]]
+            lower[hit, j] = yhat[hit, j] - cm.lower_offset[idx[hit]]
+        out["yhat_lower"] = lower
+        out["yhat_upper"] = upper
+    return out
+
+
+def forecast_frames(items: Iterable[Tuple[str, CompactModel]], days: int, include_intervals: bool = False,
+                    today: Optional[pd.Timestamp] = None) -> Dict[str, pd.DataFrame]:
+    """
+    items: [(product_id, CompactModel)]
+    與 Prophet 路徑相同：從 max(今天, 訓練資料最後一天 + 1) 開始預測 days 天。
+    起始日相同的商品會被放在同一批向量化計算。
+    """
+    today = today if today is not None else pd.Timestamp.now().normalize()
+    today_day = int(day_int([today])[0])
+    by_start: Dict[int, List[Tuple[str, CompactModel]]] = defaultdict(list)
+    for pid, cm in items:
+        by_start[max(today_day, cm.last_day + 1)].append((pid, cm))
+
+    results = {}
+    for start_day, group in by_start.items():
+        dates = pd.date_range(pd.Timestamp(start_day * _NS_PER_DAY), periods=days, freq="D")
+        pred = predict_many([cm for _, cm in group], dates, include_intervals)
+        for j, (pid, _) in enumerate(group):
+            frame = {"ds": dates, "yhat": pred["yhat"][:, j]}
+            if include_intervals:
+                frame["yhat_lower"] = pred["yhat_lower"][:, j]
+                frame["yhat_upper"] = pred["yhat_upper"][:, j]
+            results[pid] = pd.DataFrame(frame)
+    return results
+
+
+class FastForecaster:
+    """快取每個商品 (模型版本) 的 CompactModel，並提供與 /sales/predict 相同格式的輸出"""
+
+    def __init__(self):
+        self._compact: Dict[str, Tuple[object, CompactModel]] = {}
+        self._lock = threading.Lock()
+        self.extractions = 0
+
+    def compact(self, product_id: str, model, version) -> CompactModel:
+        with self._lock:
+            cached = self._compact.get(product_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        cm = extract(model)
+        self.extractions += 1
+        with self._lock:
+            self._compact[product_id] = (version, cm)
+        return cm
+
+    def forecast(self, items: Iterable[Tuple[str, CompactModel]], days: int,
+                 include_intervals: bool = False, today: Optional[pd.Timestamp] = None) -> Dict[str, pd.DataFrame]:
+        return forecast_frames(items, days, include_intervals, today)
+
+    def stats(self) -> dict:
+        return {"compact_models": len(self._compact), "extractions": self.extractions}
@@ -0,0 +1,247 @@
+# backend-ai/feedback_buffer.py
+# ==========================================
+# 評價計數寫回緩衝 (Write-behind Feedback Aggregator)
+# ==========================================
+# 以前每次點「有幫助/沒幫助」都開一個 transaction 做 UPDATE documents ... + 1，
+# 熱門文章會搶同一列的 row lock，而且 documents 正是搜尋要掃的表。
+# 這裡先在記憶體中累加 (doc_id -> helpful/unhelpful 次數)，由背景執行緒定期：
+#   1. 一條 UPDATE ... FROM unnest(...) 批次加上所有文件的計數
+#   2. 一條 INSERT ... SELECT unnest(...) 寫入 feedback_logs (含使用者填的原因)
+# - 寫入失敗時把這批資料放回緩衝區，下一輪重試
+# - 緩衝區有上限；滿了 add() 回傳 False，由呼叫端直接寫入 (不丟資料、記憶體也不會無限長)
+# - 關機時 stop() 會做最後一次 flush
+# - 同一批連續失敗 FEEDBACK_MAX_RETRIES 次後改為逐筆寫入，資料本身有問題的那幾筆記錄後丟棄，
+#   不會讓一筆壞資料卡住所有文件的評價
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+
+FEEDBACK_FLUSH_SECONDS = float(os.getenv("FEEDBACK_FLUSH_SECONDS", "2"))
+FEEDBACK_MAX_PENDING = int(os.getenv("FEEDBACK_MAX_PENDING", "10000"))
+FEEDBACK_MAX_RETRIES = int(os.getenv("FEEDBACK_MAX_RETRIES", "3"))
+DOC_ID_MAX = 2 ** 31 - 1  # documents.id SERIAL (INT)
+ACTIONS = ("helpful", "unhelpful")
+
+# 依 id 排序後更新，多個 worker 同時 flush 也不會互相 deadlock
+UPDATE_COUNTS_SQL = text("""
+    UPDATE documents d
+    SET helpful_count = COALESCE(d.helpful_count, 0) + v.helpful,
+        unhelpful_count = COALESCE(d.unhelpful_count, 0) + v.unhelpful
+    FROM (
+        SELECT * FROM unnest(CAST(:ids AS INT[]), CAST(:helpful AS INT[]), CAST(:unhelpful AS INT[]))
+            AS t(id, helpful, unhelpful)
+        ORDER BY id
+    ) v
+    WHERE d.id = v.id
+""")
+
+# 只寫入仍存在的文件 (上面的 UPDATE 已鎖住這些列，期間不會被刪除)
+INSERT_LOGS_SQL = text("""
+    INSERT INTO feedback_logs (document_id, action_type, reason, created_at)
+    SELECT v.document_id, v.action_type, v.reason, v.created_at
+    FROM unnest(CAST(:ids AS INT[]), CAST(:actions AS TEXT[]), CAST(:reasons AS TEXT[]),
+                CAST(:created_at AS TIMESTAMP[]))
+        AS v(document_id, action_type, reason, created_at)
+    JOIN documents d ON d.id = v.document_id
+""")
+
+LogRow = Tuple[int, str, Optional[str], datetime]
+
+
+class InvalidFeedbackError(ValueError):
+    pass
+
+
+def validate_doc_id(doc_id: int):
+    if not 1 <= doc_id <= DOC_ID_MAX:
+        raise InvalidFeedbackError(f"文件 id 超出範圍: {doc_id}")
+
+
+def normalize_action(action: str) -> str:
+    # 與舊版相同：不是 helpful 的一律算 unhelpful
+    return "helpful" if action == "helpful" else "unhelpful"
+
+
+def write_feedback(conn, counts: Dict[int, List[int]], logs: List[LogRow]):
+    ids = sorted(counts)
+    conn.execute(UPDATE_COUNTS_SQL, {
+        "ids": ids,
+        "helpful": [counts[i][0] for i in ids],
+        "unhelpful": [counts[i][1] for i in ids],
+    })
+    if logs:
+        conn.execute(INSERT_LOGS_SQL, {
+            "ids": [r[0] for r in logs],
+            "actions": [r[1] for r in logs],
+            "reasons": [r[2] for r in logs],
+            "created_at": [r[3] for r in logs],
+        })
+
+
+class FeedbackAggregator:
+    def __init__(self, engine, flush_interval: float = FEEDBACK_FLUSH_SECONDS,
+                 max_pending: int = FEEDBACK_MAX_PENDING, max_retries: int = FEEDBACK_MAX_RETRIES):
+        self.engine = engine
+        self.flush_interval = max(0.1, flush_interval)
+        self.max_pending = max(1, max_pending)
+        self.max_retries = max(1, max_retries)
+        self._counts: Dict[int, List[int]] = defaultdict(lambda: [0, 0])
+        self._logs: List[LogRow] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        # 統計數據
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flushed_events = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self.last_flush_ms = 0.0
+
+    # ---------- 生命週期 ----------
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="feedback-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            thread.join(timeout)
+        # 最後一次 flush (thread 沒啟動或已結束都要做)
+        self.flush()
+        if self.pending():
+            print(f"⚠️ 關機時仍有 {self.pending()} 筆評價未寫入: {self.last_error}")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    # ---------- 呼叫端 API ----------
+    def pending(self) -> int:
+        return len(self._logs)
+
+    def add(self, doc_id: int, action: str, reason: Optional[str] = None) -> bool:
+        """累加一次評價；緩衝區已滿時回傳 False (呼叫端應改用 write_now)；id 超出範圍丟出 InvalidFeedbackError"""
+        validate_doc_id(doc_id)
+        action = normalize_action(action)
+        with self._lock:
+            if len(self._logs) >= self.max_pending:
+                self.rejected += 1
+                self._wake.set()
+                return False
+            self._counts[doc_id][ACTIONS.index(action)] += 1
+            self._logs.append((doc_id, action, reason, datetime.now()))
+            self.accepted += 1
+            if len(self._logs) >= self.max_pending // 2:
+                self._wake.set()  # 提早 flush，避免碰到上限
+        return True
+
+    def write_now(self, doc_id: int, action: str, reason: Optional[str] = None):
+        """不經緩衝直接寫入 (緩衝區已滿時使用)"""
+        validate_doc_id(doc_id)
+        action = normalize_action(action)
+        counts = {doc_id: [1, 0] if action == "helpful" else [0, 1]}
+        with self.engine.begin() as conn:
+            write_feedback(conn, counts, [(doc_id, action, reason, datetime.now())])
+
+    def flush(self) -> int:
+        """把目前累積的計數寫進資料庫，回傳寫入的評價筆數"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._logs:
+                    return 0
+                counts, logs = self._counts, self._logs
+                self._counts, self._logs = defaultdict(lambda: [0, 0]), []
+
+            started = time.perf_counter()
+            if self.consecutive_failures >= self.max_retries:
+                # 整批已連續失敗多次：逐筆寫入，找出有問題的那幾筆
+                return self._flush_one_by_one(logs, started)
+            try:
+                with self.engine.begin() as conn:
+                    write_feedback(conn, counts, logs)
+            except Exception as e:
+                self._requeue(logs)
+                self.failures += 1
+                self.consecutive_failures += 1
+                self.last_error = str(e)
+                print(f"⚠️ 評價寫入失敗，{len(logs)} 筆稍後重試: {e}")
+                return 0
+
+            self.consecutive_failures = 0
+            return self._record_flush(len(logs), started)
+
+    def _requeue(self, logs: List[LogRow]):
+        """放回緩衝區 (排在新資料前面)，下一輪重試；計數由 logs 重建"""
+        with self._lock:
+            for doc_id, action, _, _ in logs:
+                self._counts[doc_id][ACTIONS.index(action)] += 1
+            self._logs = logs + self._logs
+
+    def _flush_one_by_one(self, logs: List[LogRow], started: float) -> int:
+        written = 0
+        for i, row in enumerate(logs):
+            doc_id, action = row[0], row[1]
+            counts = {doc_id: [1, 0] if action == "helpful" else [0, 1]}
+            try:
+                with self.engine.begin() as conn:
+                    write_feedback(conn, counts, [row])
+                written += 1
+            except (DataError, IntegrityError) as e:
+                # 資料本身寫不進去，重試也不會成功：記錄後丟棄
+                self.dropped += 1
+                self.last_error = str(e)
+                print(f"❌ 丟棄無法寫入的評價 (doc_id={doc_id}, {action}): {e}")
+            except Exception as e:
+                # 連線等暫時性錯誤：剩下的放回緩衝區，下一輪繼續逐筆寫
+                self._requeue(logs[i:])
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"⚠️ 評價逐筆寫入失敗，{len(logs) - i} 筆稍後重試: {e}")
+                return self._record_flush(written, started) if written else 0
+        self.consecutive_failures = 0
+        return self._record_flush(written, started)
+
+    def _record_flush(self, events: int, started: float) -> int:
+        self.flushes += 1
+        self.flushed_events += events
+        self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+        return events
+
+    # ---------- 監控 ----------
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "pending_documents": len(self._counts),
+            "max_pending": self.max_pending,
+            "flush_interval_seconds": self.flush_interval,
+            "accepted": self.accepted,
+            "rejected_to_direct_write": self.rejected,
+            "flushes": self.flushes,
+            "flushed_events": self.flushed_events,
+            "avg_events_per_flush": round(self.flushed_events / self.flushes, 2) if self.flushes else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,130 @@
+# backend-ai/forecast_cache.py
+# ==========================================
+# 預測結果快取 (Forecast Cache)
+# ==========================================
+# 同一個模型版本在同一天的預測結果是固定的，但儀表板會一直重複呼叫 /sales/predict。
+# - 每個 (商品, 模型版本, 日期) 只跑一次 Prophet，而且直接算最長的 horizon
+# - 較短的 days 直接從結果切片
+# - 模型重新訓練 (版本改變) 或換日時自動失效
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List
+
+import pandas as pd
+
+from fast_forecast import CompactModel, forecast_frames
+from telemetry import stage
+
+FORECAST_MAX_HORIZON = int(os.getenv("FORECAST_MAX_HORIZON", "90"))
+FORECAST_CACHE_MAX_PRODUCTS = int(os.getenv("FORECAST_CACHE_MAX_PRODUCTS", "1024"))
+FORECAST_COLUMNS = ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+
+
+def compute_forecast(m, horizon: int, today: pd.Timestamp) -> pd.DataFrame:
+    """從今天起預測 horizon 天 (只取未來的資料)；m 可以是 Prophet 物件或精簡模型檔 (CompactModel)"""
+    if isinstance(m, CompactModel):
+        # 精簡模型沒有 history，也不必跑 Prophet；區間使用模型檔內預先算好的寬度
+        with stage("predict", "compact_predict"):
+            return forecast_frames([("", m)], horizon, include_intervals=True, today=today)[""][FORECAST_COLUMNS]
+
+    # 計算日期落差，確保未來日期包含今天到預測天數的範圍
+    last_date = m.history['ds'].max()
+    if today > last_date:
+        total_periods = (today - last_date).days + horizon
+    else:
+        total_periods = horizon
+
+    with stage("predict", "make_future_dataframe"):
+        future = m.make_future_dataframe(periods=total_periods)
+    with stage("predict", "prophet_predict"):
+        forecast = m.predict(future)
+
+    result = forecast[forecast['ds'] > last_date]  # 先排除歷史訓練區間
+    result = result[result['ds'] >= today].head(horizon)
+    return result[FORECAST_COLUMNS].reset_index(drop=True)
+
+
+def forecast_to_records(df: pd.DataFrame, include_intervals: bool = False) -> List[dict]:
+    """向量化轉換欄位，不再逐列 iterrows()"""
+    dates = df['ds'].dt.strftime('%Y-%m-%d').tolist()
+    sales = df['yhat'].astype(int).tolist()  # 轉整數比較好看
+    if not include_intervals or 'yhat_lower' not in df:
+        return [{"date": d, "predicted_sales": q} for d, q in zip(dates, sales)]
+    lower = df['yhat_lower'].astype(int).tolist()
+    upper = df['yhat_upper'].astype(int).tolist()
+    return [{"date": d, "predicted_sales": q, "lower": lo, "upper": hi}
+            for d, q, lo, hi in zip(dates, sales, lower, upper)]
+
+
+class ForecastCache:
+    def __init__(self, max_products: int = FORECAST_CACHE_MAX_PRODUCTS,
+                 max_horizon: int = FORECAST_MAX_HORIZON):
+        self.max_products = max(1, max_products)
+        self.max_horizon = max_horizon
+        # product_id -> (model_version, day, horizon, DataFrame)，每個商品只留最新一份
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._compute_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        self.computes = 0
+
+    def _lookup(self, product_id, version, day, days):
+        with self._lock:
+            entry = self._entries.get(product_id)
+            if entry is not None and entry[0] == version and entry[1] == day and entry[2] >= days:
+                self._entries.move_to_end(product_id)
+                return entry[3]
+        return None
+
+    def peek(self, product_id: str, version, days: int):
+        """只查快取，不計算；沒有時回傳 None (不計入 misses，之後的 get 會計入)"""
+        frame = self._lookup(product_id, version, pd.to_datetime(datetime.now().date()), days)
+        if frame is None:
+            return None
+        self.hits += 1
+        return frame.head(days)
+
+    def get(self, product_id: str, model, version, days: int) -> pd.DataFrame:
+        today = pd.to_datetime(datetime.now().date())
+        frame = self._lookup(product_id, version, today, days)
+        if frame is not None:
+            self.hits += 1
+            return frame.head(days)
+
+        self.misses += 1
+        with self._lock:
+            compute_lock = self._compute_locks.setdefault(product_id, threading.Lock())
+        with compute_lock:
+            frame = self._lookup(product_id, version, today, days)
+            if frame is None:
+                horizon = max(days, self.max_horizon)
+                frame = compute_forecast(model, horizon, today)
+                self.computes += 1
+                with self._lock:
+                    # 覆蓋掉同商品的舊版本 / 舊日期
+                    self._entries[product_id] = (version, today, horizon, frame)
+                    self._entries.move_to_end(product_id)
+                    while len(self._entries) > self.max_products:
+                        self._entries.popitem(last=False)
+        return frame.head(days)
+
+    def invalidate(self, product_id: str = None):
+        with self._lock:
+            if product_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(product_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached_products": len(self._entries),
+            "max_horizon": self.max_horizon,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "computes": self.computes,
+        }
@@ -0,0 +1,255 @@
+# backend-ai/image_store.py
+# ==========================================
+# 知識庫圖片上傳 (Content-addressed Image Store)
+# ==========================================
+# 以前 /upload/image 在 event loop 上用 shutil.copyfileobj 同步寫檔、相信使用者給的副檔名，
+# 而且同一張截圖貼到幾篇文章就存幾份 UUID 檔案。現在改成：
+# - 分塊讀取上傳內容，用 aiofiles 非同步寫入暫存檔，同時計算 sha256；超過 IMAGE_MAX_BYTES 立即中止 (413)
+# - 依檔頭 (magic bytes) 判斷格式，只接受 PNG / JPEG / GIF / WebP，副檔名由伺服器決定
+# - 檔名 = 內容雜湊：static/uploads/{sha256}.{ext}，相同圖片只存一份
+# - 背景執行緒用 Pillow 產生 WebP 版本與縮圖 ({sha256}.webp、{sha256}.w{寬度}.webp)
+# - ImageStaticFiles：雜湊檔名的圖片回應 Cache-Control: immutable (一年) 與以雜湊為準的 ETag；
+#   瀏覽器 Accept 含 image/webp 時自動改送 WebP，?w=320 送最接近的縮圖 (Vary: Accept)
+# 舊的 UUID 檔名仍照原本方式提供。
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+from hashlib import sha256
+from typing import List, Optional, Tuple
+
+import aiofiles
+import aiofiles.os
+import anyio
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # 沒有 Pillow 時只是不產生 WebP / 縮圖
+    Image = None
+
+UPLOAD_DIR = "static/uploads"
+UPLOAD_URL = "/static/uploads"
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_CHUNK_BYTES = int(os.getenv("IMAGE_CHUNK_BYTES", str(256 * 1024)))
+IMAGE_VARIANTS = os.getenv("IMAGE_VARIANTS", "1") != "0"
+IMAGE_VARIANT_WIDTHS = [int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "320,960").split(",") if w.strip()]
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))  # 避免解壓縮炸彈
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# (magic bytes 判斷函式, 副檔名)
+IMAGE_SIGNATURES = (
+    (lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"), "png"),
+    (lambda head: head.startswith(b"\xff\xd8\xff"), "jpg"),
+    (lambda head: head[:6] in (b"GIF87a", b"GIF89a"), "gif"),
+    (lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP", "webp"),
+)
+HASHED_NAME = re.compile(r"(?P<digest>[0-9a-f]{64})(?:\.w(?P<width>\d+))?\.(?P<ext>png|jpg|gif|webp)")
+
+
+class ImageUploadError(ValueError):
+    pass
+
+
+class ImageTooLargeError(ImageUploadError):
+    pass
+
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    for matches, ext in IMAGE_SIGNATURES:
+        if matches(head):
+            return ext
+    return None
+
+
+def variant_names(digest: str, ext: str) -> List[str]:
+    names = [] if ext == "webp" else [f"{digest}.webp"]
+    return names + [f"{digest}.w{w}.webp" for w in sorted(IMAGE_VARIANT_WIDTHS)]
+
+
+# ==========================================
+# 1. 上傳：串流寫入 + 雜湊去重
+# ==========================================
+async def save_upload(file: UploadFile, upload_dir: str = UPLOAD_DIR,
+                      max_bytes: int = IMAGE_MAX_BYTES) -> Tuple[str, str, int, bool]:
+    """回傳 (雜湊, 檔名, 大小, 是否已存在)"""
+    if file.size is not None and file.size > max_bytes:
+        raise ImageTooLargeError(f"圖片超過 {max_bytes // (1024 * 1024)} MB 上限")
+
+    digest, size, head = sha256(), 0, b""
+    tmp_path = os.path.join(upload_dir, f".upload-{uuid.uuid4().hex}.tmp")
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await file.read(IMAGE_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLargeError(f"圖片超過 {max_bytes // (1024 * 1024)} MB 上限")
+                if len(head) < 16:
+                    head += chunk[:16]
+                digest.update(chunk)
+                await out.write(chunk)
+
+        ext = sniff_extension(head)
+        if ext is None:
+            raise ImageUploadError("只接受 PNG、JPEG、GIF、WebP 圖片")
+        name = f"{digest.hexdigest()}.{ext}"
+        path = os.path.join(upload_dir, name)
+        if await aiofiles.os.path.exists(path):
+            return digest.hexdigest(), name, size, True  # 相同內容已存過，暫存檔在 finally 刪除
+        await aiofiles.os.replace(tmp_path, path)
+        return digest.hexdigest(), name, size, False
+    finally:
+        if await aiofiles.os.path.exists(tmp_path):
+            await aiofiles.os.remove(tmp_path)
+
+
+# ==========================================
+# 2. 背景產生 WebP / 縮圖
+# ==========================================
+def make_variants(path: str, digest: str, ext: str, upload_dir: str = UPLOAD_DIR) -> int:
+    """產生缺少的版本，回傳新產生的數量；不會比原圖大的寬度略過"""
+    missing = [n for n in variant_names(digest, ext) if not os.path.exists(os.path.join(upload_dir, n))]
+    if not missing:
+        return 0
+    with Image.open(path) as img:
+        if getattr(img, "is_animated", False):
+            return 0  # 動畫 GIF / WebP 維持原檔
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+
+        created = 0
+        for name in missing:
+            width = HASHED_NAME.fullmatch(name).group("width")
+            out = img
+            if width is not None:
+                width = int(width)
+                if width >= img.width:
+                    continue
+                out = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+            target = os.path.join(upload_dir, name)
+            tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+            out.save(tmp_path, "WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+            os.replace(tmp_path, target)
+            created += 1
+        return created
+
+
+class VariantWorker:
+    """單一背景執行緒處理佇列，上傳請求不必等待 Pillow"""
+
+    def __init__(self, upload_dir: str = UPLOAD_DIR, enabled: bool = IMAGE_VARIANTS):
+        self.upload_dir = upload_dir
+        self.enabled = enabled and Image is not None
+        self._queue: "queue.Queue[Optional[Tuple[str, str]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+        self.generated = 0
+        self.processed = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_ms = 0.0
+
+    def start(self):
+        if not self.enabled:
+            if IMAGE_VARIANTS and Image is None:
+                print("⚠️ 未安裝 Pillow，不產生 WebP / 縮圖")
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+        self._thread = threading.Thread(target=self._run, name="image-variants", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, digest: str, ext: str):
+        if self.enabled:
+            self._queue.put((digest, ext))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            digest, ext = item
+            started = time.perf_counter()
+            try:
+                self.generated += make_variants(os.path.join(self.upload_dir, f"{digest}.{ext}"),
+                                                digest, ext, self.upload_dir)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"⚠️ 圖片 {digest[:12]} 產生縮圖失敗: {e}")
+            self.processed += 1
+            self.last_ms = round((time.perf_counter() - started) * 1000, 2)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "processed": self.processed,
+            "generated": self.generated,
+            "failures": self.failures,
+            "last_ms": self.last_ms,
+            "last_error": self.last_error,
+        }
+
+
+# ==========================================
+# 3. 靜態檔案：長效快取 + 以雜湊為準的 ETag + WebP / 縮圖協商
+# ==========================================
+def accepts_webp(scope: Scope) -> bool:
+    return "image/webp" in Headers(scope=scope).get("accept", "")
+
+
+def requested_width(scope: Scope) -> Optional[int]:
+    match = re.search(rb"(?:^|&)w=(\d{1,5})(?:&|$)", scope.get("query_string", b""))
+    return int(match.group(1)) if match else None
+
+
+class ImageStaticFiles(StaticFiles):
+    """掛在 /static/uploads；非雜湊檔名 (舊的 UUID 檔) 行為與 StaticFiles 相同"""
+
+    def candidates(self, path: str, scope: Scope) -> List[str]:
+        match = HASHED_NAME.fullmatch(path)
+        if match is None or match.group("width") or not accepts_webp(scope):
+            return []
+        digest, width = match.group("digest"), requested_width(scope)
+        names = []
+        if width is not None:
+            names += [f"{digest}.w{w}.webp" for w in sorted(IMAGE_VARIANT_WIDTHS) if w >= width]
+        if match.group("ext") != "webp":
+            names.append(f"{digest}.webp")
+        return names
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            for name in self.candidates(path, scope):
+                full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, name)
+                if stat_result is not None:
+                    return self.file_response(full_path, stat_result, scope)
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        name = os.path.basename(full_path)
+        if HASHED_NAME.fullmatch(name):
+            # 內容永遠不變：ETag 直接用 (雜湊 + 版本)，不必依賴 mtime
+            response.headers["etag"] = f'"{name.rsplit(".", 1)[0]}-{name.rsplit(".", 1)[1]}"'
+            response.headers["cache-control"] = IMAGE_CACHE_CONTROL
+            response.headers["vary"] = "Accept"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
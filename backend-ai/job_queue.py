@@ -0,0 +1,249 @@
+# backend-ai/job_queue.py
+# ==========================================
+# 非同步訓練工作佇列 (Training Job Queue)
+# ==========================================
+# /sales/train 只負責把工作寫進 training_jobs 資料表並立即回傳 job id，
+# 真正的訓練由專屬的背景執行緒領取 (FOR UPDATE SKIP LOCKED)，
+# 而 Prophet.fit 本身在子行程中跑 (見 training.py)，不會佔用處理請求的 threadpool 與 GIL。
+# - 佇列有上限 (queued + running)，超過就拒絕
+# - 同時執行的工作數有上限 (每個 API 行程的 worker 執行緒數)
+# - 工作狀態存在 Postgres：API 重啟後，心跳逾時的 running 工作會被重新排入佇列
+# - worker 執行緒不會因為單一工作 / 資料庫暫時錯誤而結束；意外結束時 enqueue 會重新啟動
+import json
+import os
+import socket
+import threading
+import time
+from typing import Callable, List, Optional
+
+from sqlalchemy import text
+
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "20"))
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "1"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "15"))
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_STATUS_RETRIES = 3  # 寫入最終狀態失敗時的重試次數
+
+_JOB_COLUMNS = """
+    id, kind, status, params, progress_done, progress_total, result, error, attempts,
+    created_at, started_at, finished_at, heartbeat_at, worker
+"""
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _seconds_between(start, end) -> Optional[float]:
+    if start is None or end is None:
+        return None
+    return round((end - start).total_seconds(), 3)
+
+
+def job_to_dict(row) -> dict:
+    now = getattr(row, "now", None)
+    return {
+        "id": row.id,
+        "kind": row.kind,
+        "status": row.status,
+        "params": row.params,
+        "progress": {"done": row.progress_done, "total": row.progress_total},
+        "result": row.result,
+        "error": row.error,
+        "attempts": row.attempts,
+        "created_at": row.created_at.isoformat() if row.created_at else None,
+        "started_at": row.started_at.isoformat() if row.started_at else None,
+        "finished_at": row.finished_at.isoformat() if row.finished_at else None,
+        "queued_seconds": _seconds_between(row.created_at, row.started_at or now),
+        "run_seconds": _seconds_between(row.started_at, row.finished_at or now),
+        "worker": row.worker,
+    }
+
+
+class JobQueue:
+    def __init__(self, engine, kind: str, run_fn: Callable[[dict, Callable[[int, int], None]], dict],
+                 max_queued: int = JOB_MAX_QUEUED, concurrency: int = JOB_CONCURRENCY):
+        self.engine = engine
+        self.kind = kind
+        self.run_fn = run_fn
+        self.max_queued = max(1, max_queued)
+        self.concurrency = max(0, concurrency)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._threads_lock = threading.Lock()
+        self.restarts = 0
+
+    # ---------- 生命週期 ----------
+    def start(self):
+        with self._threads_lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            for i in range(self.concurrency):
+                self._threads.append(self._spawn(i))
+
+    def _spawn(self, i: int) -> threading.Thread:
+        t = threading.Thread(target=self._worker_loop, name=f"{self.kind}-job-{i}", daemon=True)
+        t.start()
+        return t
+
+    def ensure_workers(self) -> int:
+        """重新啟動意外結束的 worker 執行緒 (只在 start() 之後、stop() 之前)，回傳重新啟動的數量"""
+        restarted = 0
+        with self._threads_lock:
+            if self._stop.is_set():
+                return 0
+            for i, t in enumerate(self._threads):
+                if not t.is_alive():
+                    print(f"⚠️ {self.kind} worker #{i} 已結束，重新啟動")
+                    self._threads[i] = self._spawn(i)
+                    restarted += 1
+        self.restarts += restarted
+        return restarted
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._threads),
+            "alive_workers": sum(t.is_alive() for t in self._threads),
+            "restarts": self.restarts,
+        }
+
+    def stop(self, timeout: float = 5.0):
+        # 執行中的工作不會被中斷；重啟後由心跳逾時機制重新排入
+        self._stop.set()
+        self._wake.set()
+        with self._threads_lock:
+            threads, self._threads = self._threads, []
+        for t in threads:
+            t.join(timeout)
+
+    # ---------- API 端 ----------
+    def enqueue(self, params: dict) -> int:
+        self.ensure_workers()
+        with self.engine.begin() as conn:
+            # 用 advisory lock 讓「檢查上限 + 新增」在多個 API 行程間也是原子的
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:kind))"), {"kind": self.kind})
+            pending = conn.execute(text("""
+                SELECT COUNT(*) FROM training_jobs
+                WHERE kind = :kind AND status IN ('queued', 'running')
+            """), {"kind": self.kind}).scalar()
+            if pending >= self.max_queued:
+                raise QueueFullError(f"佇列已滿 ({pending}/{self.max_queued})，請稍後再試")
+            job_id = conn.execute(text("""
+                INSERT INTO training_jobs (kind, status, params)
+                VALUES (:kind, 'queued', CAST(:params AS JSONB))
+                RETURNING id
+            """), {"kind": self.kind, "params": json.dumps(params, ensure_ascii=False)}).scalar()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self.engine.connect() as conn:
+            row = conn.execute(text(f"SELECT {_JOB_COLUMNS}, NOW()::timestamp AS now FROM training_jobs WHERE id = :id"),
+                               {"id": job_id}).fetchone()
+        return job_to_dict(row) if row else None
+
+    def recent(self, limit: int = 20) -> List[dict]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT {_JOB_COLUMNS}, NOW()::timestamp AS now FROM training_jobs
+                WHERE kind = :kind ORDER BY id DESC LIMIT :limit
+            """), {"kind": self.kind, "limit": limit}).fetchall()
+        return [job_to_dict(r) for r in rows]
+
+    # ---------- Worker 端 ----------
+    def _requeue_stale(self, conn):
+        """心跳逾時的 running 工作 = 原本的行程已經掛了，重新排入或標記失敗"""
+        conn.execute(text("""
+            UPDATE training_jobs
+            SET status = CASE WHEN attempts >= :max_attempts THEN 'failed' ELSE 'queued' END,
+                error = CASE WHEN attempts >= :max_attempts THEN '工作中斷次數過多' ELSE error END,
+                finished_at = CASE WHEN attempts >= :max_attempts THEN NOW() ELSE NULL END,
+                worker = NULL
+            WHERE kind = :kind AND status = 'running'
+              AND heartbeat_at < NOW() - make_interval(secs => :stale)
+        """), {"kind": self.kind, "stale": JOB_STALE_SECONDS, "max_attempts": JOB_MAX_ATTEMPTS})
+
+    def _claim(self):
+        with self.engine.begin() as conn:
+            self._requeue_stale(conn)
+            return conn.execute(text("""
+                UPDATE training_jobs
+                SET status = 'running', started_at = NOW(), heartbeat_at = NOW(),
+                    attempts = attempts + 1, worker = :worker
+                WHERE id = (
+                    SELECT id FROM training_jobs
+                    WHERE kind = :kind AND status = 'queued'
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING id, params
+            """), {"kind": self.kind, "worker": self.worker_id}).fetchone()
+
+    def _update(self, job_id: int, sql: str, params: dict):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"UPDATE training_jobs SET {sql} WHERE id = :id"), {"id": job_id, **params})
+
+    def _heartbeat(self, job_id: int, done: threading.Event):
+        while not done.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                self._update(job_id, "heartbeat_at = NOW()", {})
+            except Exception as e:
+                print(f"⚠️ 工作 {job_id} 心跳更新失敗: {e}")
+
+    def _finish(self, job_id: int, sql: str, params: dict):
+        """寫入最終狀態；連續失敗時放棄 (心跳已停止，逾時後會由 _requeue_stale 重新排入)"""
+        for attempt in range(1, JOB_STATUS_RETRIES + 1):
+            try:
+                self._update(job_id, sql, params)
+                return
+            except Exception as e:
+                print(f"⚠️ 工作 {job_id} 狀態寫入失敗 ({attempt}/{JOB_STATUS_RETRIES}): {e}")
+                if attempt < JOB_STATUS_RETRIES:
+                    time.sleep(attempt)
+
+    def _run_job(self, job_id: int, params: dict):
+        def on_progress(done_count: int, total: int):
+            try:
+                self._update(job_id, "progress_done = :done, progress_total = :total, heartbeat_at = NOW()",
+                             {"done": done_count, "total": total})
+            except Exception as e:
+                print(f"⚠️ 工作 {job_id} 進度更新失敗: {e}")  # 進度只是顯示用，不影響工作本身
+
+        finished = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(job_id, finished), daemon=True)
+        beat.start()
+        try:
+            try:
+                result = self.run_fn(params, on_progress)
+            except Exception as e:
+                self._finish(job_id, "status = 'failed', finished_at = NOW(), error = :error", {"error": str(e)})
+                return
+            self._finish(job_id, """
+                status = 'succeeded', finished_at = NOW(), result = CAST(:result AS JSONB)
+            """, {"result": json.dumps(result, ensure_ascii=False, default=str)})
+        finally:
+            finished.set()
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception as e:
+                print(f"⚠️ 領取工作失敗: {e}")
+                job = None
+            if job is None:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            print(f"🔄 開始執行工作 #{job.id} ({self.kind})")
+            try:
+                self._run_job(job.id, job.params or {})
+            except Exception as e:
+                # 不能讓 worker 執行緒結束，否則佇列中的工作永遠停在 queued
+                print(f"❌ 工作 #{job.id} 執行時發生未預期的錯誤: {e}")
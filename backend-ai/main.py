@@ -1,19 +1,45 @@
-from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
 import os
-import shutil
-import uuid
-import joblib
+import threading
+import time
 import pandas as pd
 
-from prophet import Prophet
 from typing import List, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
-from sqlalchemy import create_engine, text
-from sentence_transformers import SentenceTransformer
+from sqlalchemy import text
 from fastapi.middleware.cors import CORSMiddleware
 
+import search_engine
+import telemetry
+from bulk_ingest import BulkIngestor, iter_upload, link_tags, upsert_tags
+from chunking import chunk_document, encode_missing, existing_hashes, sync_document_chunks
+from config_cache import CONFIG_LISTEN, ConfigCache, ConfigChangeListener, notify_config_changed
+from db import create_async_db_engine, create_sync_engine, pool_stats
+from embedding_backend import EMBEDDING_BACKEND, EMBEDDING_MODEL_NAME, batch_encoder, create_embedding_model
+from embedding_service import EmbeddingBatcher, EmbeddingOverloadedError
+from fast_forecast import FastForecaster, UnsupportedModelError
+from feedback_buffer import FeedbackAggregator, InvalidFeedbackError
+from forecast_cache import ForecastCache, forecast_to_records
+from forecast_store import FORECAST_MATERIALIZE_AT, FORECAST_STORE, DailyTrigger, ForecastStore, materialize
+from image_store import (UPLOAD_DIR, UPLOAD_URL, ImageStaticFiles, ImageTooLargeError, ImageUploadError,
+                         VariantWorker, save_upload)
+from job_queue import JobQueue, QueueFullError
+from ann_index import ANN_INDEX, AnnMirror
+from lexical import document_lexical
+from query_cache import QueryEmbeddingCache, build_store, normalize_query
+from sales_upload import SalesUploadError, load_sales_csv
+from tag_matcher import TagMatcher
+from model_format import load_model
+from model_registry import ModelNotFoundError, ModelRegistry
+from telemetry import observe_stage, stage, timed
+from training import GLOBAL_MODEL_ID, InvalidProductIdError, TrainingScheduler, validate_product_id
+
 app = FastAPI(title="AI Smart Retail Service")
 
 app.add_middleware(
@@ -25,17 +51,75 @@ app.add_middleware(
 )
 app.router.redirect_slashes = False
 
-UPLOAD_DIR = "static/uploads"
+# 各路由請求耗時；PROFILE_SLOW_MS > 0 時另外對慢請求輸出取樣 (見 telemetry.py)
+profiler = telemetry.create_profiler()
+telemetry.install(app, profiler)
+
+@app.on_event("startup")
+def start_profiler():
+    if profiler is not None:
+        profiler.start()
+
+@app.on_event("shutdown")
+def stop_profiler():
+    if profiler is not None:
+        profiler.stop()
+
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+# 上傳圖片：雜湊檔名長效快取 + WebP / 縮圖協商 (必須比 /static 先掛載)
+app.mount(UPLOAD_URL, ImageStaticFiles(directory=UPLOAD_DIR), name="uploads")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# 背景產生 WebP / 縮圖
+image_variants = VariantWorker()
+
+@app.on_event("startup")
+def start_image_variants():
+    image_variants.start()
+
+@app.on_event("shutdown")
+def stop_image_variants():
+    image_variants.stop()
+
 os.makedirs("models", exist_ok=True)
 
 DB_URL = os.getenv('DATABASE_URL', 'postgresql://admin:000@db:5432/retail_ops')
-engine = create_engine(DB_URL)
+# 同步 engine：寫入 / 批次 / 背景工作；非同步 engine：高頻讀取 (/search、/config/all)
+engine = create_sync_engine(DB_URL)
+async_engine = create_async_db_engine(DB_URL)
+
+# Embedding 模型預設延遲載入 (EMBEDDING_LOAD=lazy)，第一次 encode 才載入；後端見 embedding_backend.py
+embedding_model = create_embedding_model()
+
+# 所有 encode 都走同一個微批次服務，避免並發請求各自搶模型
+embedder = EmbeddingBatcher(embedding_model)
+
+# 查詢向量快取 (QUERY_CACHE_BACKEND=sqlite/postgres 時多 worker 共用)
+# 不同後端的向量有些微差異，快取 key 分開
+query_cache = QueryEmbeddingCache(
+    EMBEDDING_MODEL_NAME if EMBEDDING_BACKEND == "torch" else f"{EMBEDDING_MODEL_NAME}+{EMBEDDING_BACKEND}",
+    store=build_store(engine),
+)
 
-print("正在載入 Embedding 模型...")
-embedding_model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+# 標籤比對器：每個查詢只掃一次，找出查詢字串包含哪些標籤
+tag_matcher = TagMatcher(engine)
+
+# Embedding 佇列已滿 (模型跟不上)：所有會 encode 的路由一律回 503，讓用戶端稍後重試
+@app.exception_handler(EmbeddingOverloadedError)
+async def embedding_overloaded(request: Request, exc: EmbeddingOverloadedError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+@app.on_event("startup")
+def start_embedder():
+    embedder.start()
+
+@app.on_event("shutdown")
+def stop_embedder():
+    embedder.stop()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    await async_engine.dispose()
 
 # ==========================================
 # DTO
@@ -52,9 +136,12 @@ class SearchRequest(BaseModel):
     top_k: int = 5
     search_type: str = "smart"
     category_filter: Optional[str] = None
+    candidate_k: Optional[int] = None   # 智能模式候選數 (預設 SEARCH_CANDIDATE_K)
+    ef_search: Optional[int] = None     # HNSW 搜尋寬度 (預設 HNSW_EF_SEARCH)
 
 class FeedbackRequest(BaseModel):
     action: str # "helpful" or "unhelpful"
+    reason: Optional[str] = None  # 使用者填寫的原因 (選填)，寫入 feedback_logs
 
 class StringItem(BaseModel):
     name: str
@@ -66,55 +153,101 @@ class StringItem(BaseModel):
 @app.post("/upload/image")
 async def upload_image(file: UploadFile = File(...)):
     try:
-        file_ext = file.filename.split(".")[-1]
-        unique_filename = f"{uuid.uuid4()}.{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, unique_filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"url": f"/static/uploads/{unique_filename}"}
+        digest, filename, size, existed = await save_upload(file)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ImageUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # 相同圖片再次上傳時也補做缺少的版本 (例如上次產生到一半就關機)
+    image_variants.submit(digest, filename.rsplit(".", 1)[1])
+    return {
+        "url": f"{UPLOAD_URL}/{filename}",
+        "sha256": digest,
+        "size": size,
+        "deduplicated": existed,
+    }
+
+@app.get("/metrics/images")
+def image_metrics():
+    return image_variants.stats()
 
 # [Create] 新增文件
 @app.post("/documents/create")
 def create_document(doc: DocumentInput):
     text_to_embed = f"{doc.title} {doc.category} {doc.outline}".lower()
-    embedding_vector = embedding_model.encode(text_to_embed, normalize_embeddings=True).tolist()
+    embedding_vector = embedder.encode(text_to_embed).tolist()
+    # 內文區塊向量在 transaction 外先算好
+    chunks = chunk_document(doc.title, doc.content)
+    chunk_vectors = encode_missing(chunks, set(), embedder.encode_many)
 
-    with engine.begin() as conn:
+    with config_transaction() as conn:
         # A. 寫入文件
         insert_sql = text("""
-            INSERT INTO documents (title, category, outline, content, embedding)
-            VALUES (:title, :category, :outline, :content, :embedding)
+            INSERT INTO documents (title, category, outline, content, embedding, lexical)
+            VALUES (:title, :category, :outline, :content, :embedding, CAST(:lexical AS tsvector))
             RETURNING id
         """)
         result = conn.execute(insert_sql, {
             "title": doc.title, "category": doc.category, "outline": doc.outline, 
-            "content": doc.content, "embedding": str(embedding_vector)
+            "content": doc.content, "embedding": str(embedding_vector), "lexical": document_lexical(doc)
         })
         new_doc_id = result.fetchone()[0]
 
         # B. 處理標籤
         update_tags(conn, new_doc_id, doc.tags)
 
+        # C. 內文區塊
+        sync_document_chunks(conn, new_doc_id, chunks, embedder.encode_many, chunk_vectors)
+
     return {"status": "success", "doc_id": new_doc_id}
 
+# [Bulk] 批次匯入 (JSONL / CSV / Markdown / Markdown 資料夾 .zip)
+@app.post("/documents/bulk")
+def bulk_create_documents(file: UploadFile = File(...), create_categories: bool = False,
+                          default_category: Optional[str] = None):
+    # 大批次直接送模型，不經過給線上請求用的微批次佇列
+    encode_batch = batch_encoder(embedding_model)
+
+    try:
+        records = iter_upload(file.filename, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    ingestor = BulkIngestor(engine, encode_batch, create_categories=create_categories,
+                            default_category=default_category)
+    try:
+        report = ingestor.ingest(records)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    with config_transaction() as conn:
+        config_changed(conn, "bulk")
+    return report
+
 # [Update] 更新文件
 @app.put("/documents/{doc_id}")
 def update_document(doc_id: int, doc: DocumentInput):
     text_to_embed = f"{doc.title} {doc.category} {doc.outline}".lower()
-    embedding_vector = embedding_model.encode(text_to_embed, normalize_embeddings=True).tolist()
+    embedding_vector = embedder.encode(text_to_embed).tolist()
+    # 只 encode 內容有變的區塊 (text_hash 比對)
+    chunks = chunk_document(doc.title, doc.content)
+    with engine.connect() as conn:
+        known = existing_hashes(conn, doc_id)
+    chunk_vectors = encode_missing(chunks, known, embedder.encode_many)
 
-    with engine.begin() as conn:
+    with config_transaction() as conn:
         # 1. 更新主表
         update_sql = text("""
             UPDATE documents 
-            SET title=:title, category=:category, outline=:outline, content=:content, embedding=:embedding
+            SET title=:title, category=:category, outline=:outline, content=:content, embedding=:embedding,
+                lexical=CAST(:lexical AS tsvector)
             WHERE id=:id
         """)
         result = conn.execute(update_sql, {
             "title": doc.title, "category": doc.category, "outline": doc.outline, 
-            "content": doc.content, "embedding": str(embedding_vector), "id": doc_id
+            "content": doc.content, "embedding": str(embedding_vector), "lexical": document_lexical(doc),
+            "id": doc_id
         })
         
         if result.rowcount == 0:
@@ -124,7 +257,10 @@ def update_document(doc_id: int, doc: DocumentInput):
         conn.execute(text("DELETE FROM document_tags WHERE document_id = :id"), {"id": doc_id})
         update_tags(conn, doc_id, doc.tags)
 
-    return {"status": "success", "message": "已更新"}
+        # 3. 內文區塊 (沿用 hash 沒變的區塊)
+        chunk_stats = sync_document_chunks(conn, doc_id, chunks, embedder.encode_many, chunk_vectors)
+
+    return {"status": "success", "message": "已更新", "chunks": chunk_stats}
 
 # [Delete] 刪除文件
 @app.delete("/documents/{doc_id}")
@@ -136,157 +272,214 @@ def delete_document(doc_id: int):
     return {"status": "success", "message": "已刪除"}
 
 # [Feedback] 評價 (有幫助/沒幫助)
+# 先累加在記憶體，背景每 FEEDBACK_FLUSH_SECONDS 秒批次寫回 documents 計數 + feedback_logs
+feedback_buffer = FeedbackAggregator(engine)
+
+@app.on_event("startup")
+def start_feedback_buffer():
+    feedback_buffer.start()
+
+@app.on_event("shutdown")
+def flush_feedback_buffer():
+    feedback_buffer.stop()
+
 @app.post("/documents/{doc_id}/feedback")
-def feedback_document(doc_id: int, req: FeedbackRequest):
-    col = "helpful_count" if req.action == "helpful" else "unhelpful_count"
-    sql = text(f"UPDATE documents SET {col} = {col} + 1 WHERE id = :id")
-    
-    with engine.begin() as conn:
-        conn.execute(sql, {"id": doc_id})
+async def feedback_document(doc_id: int, req: FeedbackRequest):
+    try:
+        buffered = feedback_buffer.add(doc_id, req.action, req.reason)
+    except InvalidFeedbackError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not buffered:
+        # 緩衝區已滿 (資料庫暫時寫不進去)：改為直接寫入，不丟計數
+        await run_in_threadpool(feedback_buffer.write_now, doc_id, req.action, req.reason)
     return {"status": "success"}
 
+@app.get("/metrics/feedback")
+def feedback_metrics():
+    return feedback_buffer.stats()
+
 # [Helper] 標籤處理函式
 def update_tags(conn, doc_id, tags_list):
-    for tag_name in tags_list:
-        # 確保 Tag 存在
-        conn.execute(text("""
-            INSERT INTO tags (name, usage_count) VALUES (:name, 1)
-            ON CONFLICT (name) DO UPDATE SET usage_count = tags.usage_count + 1
-        """), {"name": tag_name})
-        
-        tag_id = conn.execute(text("SELECT id FROM tags WHERE name = :name"), {"name": tag_name}).scalar()
-        
-        # 建立關聯
-        conn.execute(text("""
-            INSERT INTO document_tags (document_id, tag_id) VALUES (:doc_id, :tag_id)
-            ON CONFLICT DO NOTHING
-        """), {"doc_id": doc_id, "tag_id": tag_id})
+    # 確保 Tag 存在 (一條 SQL 處理全部標籤)
+    tag_ids = upsert_tags(conn, Counter(tags_list))
+
+    # 建立關聯
+    link_tags(conn, [(doc_id, tag_ids[name]) for name in dict.fromkeys(tags_list)])
+
+    # 同步反正規化的小寫標籤陣列 (搜尋加分用)
+    search_engine.refresh_tag_names(conn, [doc_id])
+    if tags_list:
+        # 新標籤 / usage_count 改變 (/config/all 依使用次數排序)
+        config_changed(conn, "tag")
+
+# [ANN] 行程內向量索引 (選用)：mmap 快照 + 異動紀錄增量更新，過期時搜尋自動退回 SQL
+ann_mirror = AnnMirror(engine, DB_URL) if ANN_INDEX else None
+
+@app.on_event("startup")
+def start_ann_mirror():
+    if ann_mirror is not None:
+        ann_mirror.start()
+
+@app.on_event("shutdown")
+def stop_ann_mirror():
+    if ann_mirror is not None:
+        ann_mirror.stop()
+
+@app.get("/metrics/ann")
+def ann_metrics():
+    if ann_mirror is None:
+        return {"enabled": False}
+    return {"enabled": True, **ann_mirror.stats(), "listener": ann_mirror.listener.stats()}
+
+# [Helper] 智能模式的查詢向量 + 命中標籤 (同步，於 threadpool 執行)
+def prepare_smart_query(clean_query: str):
+    with stage("search", "encode"):
+        query_vec = query_cache.get_or_compute(clean_query, embedder.encode).tolist()
+    with stage("search", "tag_match"):
+        return query_vec, tag_matcher.match(clean_query)
 
 # [Search] 搜尋 (更新：需回傳 tags 和 unhelpful_count)
 @app.post("/search")
-def search_documents(req: SearchRequest):
-    results = []
-    
+async def search_documents(req: SearchRequest):
     # [關鍵修正 1] 預處理查詢字串：去空白 + 轉小寫
     # 解決搜尋 "Uber Eats" 但標籤是 "UberEats" 對不上的問題
-    clean_query = req.query.replace(" ", "").lower()
-    
-    params = {
-        "query": req.query, 
-        "exact_query": f"%{req.query}%", 
-        "clean_query": clean_query,             # 用於精準比對標籤 (例如 ubereats)
-        "wildcard_clean": f"%{clean_query}%",   # 用於模糊比對
-        "top_k": req.top_k
-    }
-
-    # 1. 基礎條件與過濾
-    cat_filter_clause = ""
-    if req.category_filter and req.category_filter != "全部":
-        cat_filter_clause = "AND d.category = :cat_filter"
-        params["cat_filter"] = req.category_filter
+    with stage("search", "normalize"):
+        clean_query = normalize_query(req.query)
 
-    # 2. 根據 search_type 決定 SQL
     if req.search_type == "exact":
         # === [精準模式] (維持不變) ===
-        sql = text(f"""
-            SELECT d.id, d.title, d.category, d.outline, d.content, d.helpful_count, d.unhelpful_count,
-                   1.0 AS score,
-                   COALESCE(ARRAY_AGG(t.name) FILTER (WHERE t.name IS NOT NULL), '{{}}') as tags
-            FROM documents d
-            LEFT JOIN document_tags dt ON d.id = dt.document_id
-            LEFT JOIN tags t ON dt.tag_id = t.id
-            WHERE d.title ILIKE :exact_query {cat_filter_clause}
-            GROUP BY d.id
-            ORDER BY d.id DESC
-            LIMIT :top_k
-        """)
+        with stage("search", "sql"):
+            async with async_engine.connect() as conn:
+                rows = await search_engine.aexact_search(conn, req.query, req.top_k, req.category_filter)
     else:
-        # === [智能模式] 向量 + 混合加權 (已修復標籤加分) ===
+        # === [智能模式] 兩階段：HNSW 取候選 -> 候選內混合加權重排 ===
+        # 同時跑關鍵字檢索 (bigram tsvector)，兩邊排名以 RRF 融合 (SEARCH_LEXICAL=0 可關閉)
         # 這裡用 clean_query 轉向量，效果通常比含空白的好
-        query_vec = embedding_model.encode(clean_query, normalize_embeddings=True).tolist()
-        params["query_vec"] = str(query_vec)
-        
-        sql = text(f"""
-            SELECT d.id, d.title, d.category, d.outline, d.content, d.helpful_count, d.unhelpful_count,
-                   LEAST(
-                        (
-                            -- 1. 基礎向量分數
-                            (1 - (d.embedding <=> :query_vec)) + 
-                            
-                            -- 2. 分類加分 (0.3)
-                            (CASE WHEN d.category ILIKE :query THEN 0.3 ELSE 0 END) + 
-                            
-                            -- 3. 標題加分 (0.1)
-                            (CASE WHEN d.title ILIKE :exact_query THEN 0.1 ELSE 0 END) +
-                            
-                            -- 4. [關鍵修正] 標籤加分 (0.4)
-                            -- 使用 EXISTS 檢查該文章是否有任何標籤符合查詢
-                            (CASE WHEN EXISTS (
-                                SELECT 1 FROM tags t2 
-                                JOIN document_tags dt2 ON t2.id = dt2.tag_id 
-                                WHERE dt2.document_id = d.id 
-                                -- 邏輯：標籤轉小寫後 = 查詢 OR 標籤包含查詢
-                                AND (LOWER(t2.name) = :clean_query OR :clean_query ILIKE '%' || LOWER(t2.name) || '%')
-                            ) THEN 0.4 ELSE 0 END)
-                        ),
-                        1.0
-                   ) AS score,
-                   COALESCE(ARRAY_AGG(t.name) FILTER (WHERE t.name IS NOT NULL), '{{}}') as tags
-            FROM documents d
-            LEFT JOIN document_tags dt ON d.id = dt.document_id
-            LEFT JOIN tags t ON dt.tag_id = t.id
-            WHERE 1=1 {cat_filter_clause}
-            GROUP BY d.id, d.title, d.category, d.outline, d.content, d.helpful_count, d.unhelpful_count, d.embedding
-            ORDER BY score DESC
-            LIMIT :top_k
-        """)
+        # 快取 / 標籤比對可能碰到同步的 DB 或等待模型，丟到 threadpool 避免卡住 event loop
+        # 「sql」= 查詢向量準備好之後到取得結果的時間 (關鍵字檢索與 encode 重疊的部分不重複計算)
+        prepared = {}
+
+        async def prepare():
+            query_vec, matched_tags = await run_in_threadpool(prepare_smart_query, clean_query)
+            prepared["at"] = time.perf_counter()
+            return str(query_vec), matched_tags
+
+        rows = await search_engine.ahybrid_search(
+            async_engine, req.query, prepare, req.top_k, req.category_filter,
+            candidate_k=req.candidate_k, ef_search=req.ef_search, ann=ann_mirror,
+        )
+        if "at" in prepared:
+            observe_stage("search", "sql", time.perf_counter() - prepared["at"])
+
+    with stage("search", "serialize"):
+        results = [search_engine.row_to_result(row) for row in rows]
+    return {"query": req.query, "results": results}
 
-    with engine.connect() as conn:
-        rows = conn.execute(sql, params).fetchall()
-        for row in rows:
-            results.append({
-                "id": row.id,
-                "title": row.title,
-                "category": row.category,
-                "outline": row.outline,
-                "content": row.content,
-                "score": round(row.score, 4),
-                "helpful_count": row.helpful_count,
-                "unhelpful_count": row.unhelpful_count or 0,
-                "tags": row.tags
-            })
+# [Metrics] 微批次 Embedding 服務狀態 (batch 大小分佈、佇列深度、模型後端與載入時間)
+@app.get("/metrics/embedding")
+def embedding_metrics():
+    return {**embedder.stats(), "model": embedding_model.stats()}
+
+@app.get("/metrics/query-cache")
+def query_cache_metrics():
+    return query_cache.stats()
+
+# [Metrics] 連線池狀態 (使用中連線數、溢出、等待取得連線的時間分佈)
+@app.get("/metrics/db")
+def db_metrics():
+    return {"sync": pool_stats(engine), "async": pool_stats(async_engine)}
+
+# [Metrics] Prometheus 文字格式：各階段 / 各路由耗時直方圖 + 連線池
+@app.get("/metrics")
+def prometheus_metrics():
+    pools = telemetry.render_pool_stats({"sync": pool_stats(engine), "async": pool_stats(async_engine)})
+    return PlainTextResponse(telemetry.render(pools), media_type="text/plain; version=0.0.4")
+
+# [Config] 分類 / 標籤：記憶體快照 + ETag，異動時透過 LISTEN/NOTIFY 讓所有 worker 失效
+async def load_config() -> dict:
+    async with async_engine.connect() as conn:
+        cats = (await conn.execute(text("SELECT name FROM categories ORDER BY name"))).fetchall()
+        tags = (await conn.execute(text("SELECT name FROM tags ORDER BY usage_count DESC"))).fetchall()
+    return {"categories": [r[0] for r in cats], "tags": [r[0] for r in tags]}
 
-    return {"query": req.query, "results": results}
+config_cache = ConfigCache(load_config)
+
+def invalidate_config_caches():
+    config_cache.invalidate()
+    tag_matcher.invalidate()
+
+config_listener = ConfigChangeListener(DB_URL, [invalidate_config_caches])
+
+@app.on_event("startup")
+def start_config_listener():
+    if CONFIG_LISTEN:
+        config_listener.start()
+
+@app.on_event("shutdown")
+def stop_config_listener():
+    config_listener.stop()
+
+def config_changed(conn, reason: str):
+    """在 config_transaction() 內呼叫：commit 後本 worker 的快取失效，並以 NOTIFY 通知其他 worker"""
+    notify_config_changed(conn, reason)
+    conn.info["config_changed"] = True
+
+@contextmanager
+def config_transaction():
+    """engine.begin() 的包裝：commit 之後才讓快取失效 (在 transaction 內失效，並行請求會重新載入 commit 前的舊資料)"""
+    changed = False
+    with engine.begin() as conn:
+        try:
+            yield conn
+        finally:
+            # conn.info 跟著連線池裡的連線走，不論成功與否都要清掉
+            changed = conn.info.pop("config_changed", False)
+    if changed:
+        invalidate_config_caches()
 
 @app.get("/config/all")
-def get_config():
-    with engine.connect() as conn:
-        cats = conn.execute(text("SELECT name FROM categories ORDER BY name")).fetchall()
-        tags = conn.execute(text("SELECT name FROM tags ORDER BY usage_count DESC")).fetchall()
-    return {"categories": [r[0] for r in cats], "tags": [r[0] for r in tags]}
+async def get_config(request: Request):
+    snap = await config_cache.get()
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == snap.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snap.body, media_type="application/json", headers=headers)
+
+@app.get("/metrics/config")
+def config_metrics():
+    return {"cache": config_cache.stats(), "listener": config_listener.stats()}
 
 @app.post("/config/categories")
 def add_category(item: StringItem):
-    with engine.begin() as conn:
+    with config_transaction() as conn:
         conn.execute(text("INSERT INTO categories (name) VALUES (:name)"), {"name": item.name})
+        config_changed(conn, "category")
     return {"status": "success"}
 
 @app.delete("/config/categories/{name}")
 def delete_category(name: str):
-    with engine.begin() as conn:
+    with config_transaction() as conn:
         conn.execute(text("DELETE FROM categories WHERE name = :name"), {"name": name})
+        config_changed(conn, "category")
     return {"status": "success"}
 
 @app.post("/config/tags")
 def add_tag(item: StringItem):
-    with engine.begin() as conn:
+    with config_transaction() as conn:
         conn.execute(text("INSERT INTO tags (name, usage_count) VALUES (:name, 0)"), {"name": item.name})
+        config_changed(conn, "tag")
     return {"status": "success"}
 
 @app.delete("/config/tags/{name}")
 def delete_tag(name: str):
-    with engine.begin() as conn:
+    with config_transaction() as conn:
+        doc_ids = conn.execute(text("""
+            SELECT dt.document_id FROM document_tags dt JOIN tags t ON dt.tag_id = t.id
+            WHERE t.name = :name
+        """), {"name": name}).scalars().all()
         conn.execute(text("DELETE FROM tags WHERE name = :name"), {"name": name})
+        search_engine.refresh_tag_names(conn, doc_ids)
+        config_changed(conn, "tag")
     return {"status": "success"}
 
 # 定義請求格式 (這就是 DTO)
@@ -300,100 +493,269 @@ class PredictionRequest(BaseModel):
 
 # 步驟 1: 上傳 CSV 並寫入資料庫
 @app.post("/sales/upload")
-async def upload_sales_data(file: UploadFile = File(...)):
+def upload_sales_data(file: UploadFile = File(...), mode: str = "replace"):
+    # mode: replace (清空後重新匯入) / append (附加) / upsert (同商品同日以新資料為準)
+    # 分塊讀取 + COPY，大檔案也不會整份載入記憶體
     try:
-        # 讀取 CSV
-        df = pd.read_csv(file.file)
-        
-        # 簡單驗證欄位
-        required_cols = {'product_id', 'transaction_date', 'quantity'}
-        if not required_cols.issubset(df.columns):
-            raise HTTPException(status_code=400, detail=f"CSV 格式錯誤，需包含: {required_cols}")
-
-        # 寫入資料庫 (使用 pandas 的 to_sql 雖然慢一點但最方便，這裡改用 SQL 確保與 SQLAlchemy 相容)
-        # 為了效能，我們用 Transaction 批量插入
-        with engine.begin() as conn:
-            # 先清空舊資料 (看你的需求，這裡假設是重新匯入)
-            conn.execute(text("TRUNCATE TABLE sales_data RESTART IDENTITY"))
-            
-            # 轉換為 dict list 插入
-            data_to_insert = df.to_dict(orient='records')
-            conn.execute(
-                text("""
-                    INSERT INTO sales_data (product_id, transaction_date, quantity)
-                    VALUES (:product_id, :transaction_date, :quantity)
-                """),
-                data_to_insert
-            )
-            
-        return {"status": "success", "count": len(df)}
+        return load_sales_csv(engine, file.file, mode=mode)
+    except SalesUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except pd.errors.EmptyDataError:
+        raise HTTPException(status_code=400, detail="CSV 沒有任何資料")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 步驟 2: 訓練模型
-@app.post("/sales/train")
-def train_model():
+# 步驟 2: 訓練模型 (非同步：排入工作佇列，立即回傳 job id)
+class TrainRequest(BaseModel):
+    product_id: Optional[str] = None   # 指定商品；未指定時訓練全商品合併模型
+    all_products: bool = False         # 訓練所有商品 (每個商品一個模型，平行處理)
+    force: bool = False                # 忽略資料 hash，強制重新訓練
+
+def run_training(params: dict, on_progress=None) -> dict:
+    req = TrainRequest(**params)
+    # isolate=True：fit 一律在子行程執行，預測請求的延遲不受訓練影響
+    scheduler = TrainingScheduler(engine, force=req.force, isolate=True)
+    if req.all_products:
+        summary = scheduler.run(None, include_global=True, on_progress=on_progress)
+    elif req.product_id:
+        summary = scheduler.run([req.product_id], on_progress=on_progress)
+    else:
+        summary = scheduler.run([], include_global=True, on_progress=on_progress)
+
+    if summary["trained"] and FORECAST_STORE:
+        # 重新訓練的商品，預先算好的預測已過期 (版本不同)；排入一次只重算這些商品
+        try:
+            summary["materialize_job_id"] = materialize_jobs.enqueue({"product_ids": list(summary["trained"])})
+        except QueueFullError as e:
+            # 已在排隊 / 執行中的物化工作不一定涵蓋這次的新模型 (版本不符的列不會被使用，改由模型即時預測)
+            summary["materialize_error"] = f"無法排入預測物化工作，重新訓練的商品在下次物化前改走即時預測: {e}"
+            print(f"⚠️ {summary['materialize_error']}")
+
+    if not summary["trained"]:
+        if summary["failed"]:
+            raise RuntimeError(f"訓練失敗: {summary['failed']}")
+        if any(r != "資料未變更" for r in summary["skipped"].values()):
+            raise RuntimeError(f"資料庫無足夠數據，請先上傳 CSV: {summary['skipped']}")
+    return summary
+
+train_jobs = JobQueue(engine, "train", run_training)
+
+@app.on_event("startup")
+def start_train_jobs():
+    train_jobs.start()
+
+@app.on_event("shutdown")
+def stop_train_jobs():
+    train_jobs.stop()
+
+@app.post("/sales/train", status_code=202)
+def train_model(req: Optional[TrainRequest] = None):
+    req = req or TrainRequest()
+    if req.product_id:
+        try:
+            validate_product_id(req.product_id)
+        except InvalidProductIdError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
-        # 1. 從 DB 撈資料
-        sql = "SELECT transaction_date as ds, quantity as y FROM sales_data ORDER BY transaction_date"
-        df = pd.read_sql(sql, engine)
-        
-        if df.empty:
-            raise HTTPException(status_code=400, detail="資料庫無數據，請先上傳 CSV")
-
-        # 2. 初始化 Prophet 模型
-        m = Prophet()
-        m.add_country_holidays(country_name='TW')
-        m.fit(df)
-        
-        # 3. 儲存模型
-        model_path = "models/sales_model.pkl"
-        joblib.dump(m, model_path)
-        
-        return {"status": "success", "message": "模型訓練完成並已儲存"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        job_id = train_jobs.enqueue(jsonable_encoder(req))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"status": "queued", "job_id": job_id, "message": "已排入訓練佇列"}
+
+# 查詢訓練進度 (狀態、進度、耗時、錯誤)
+@app.get("/sales/jobs/{job_id}")
+def get_train_job(job_id: int):
+    job = train_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/sales/jobs")
+def list_train_jobs(limit: int = 20):
+    return {"jobs": train_jobs.recent(limit)}
 
 # 步驟 3 & 4: 預測
 class PredictRequest(BaseModel):
     days: int
+    product_id: Optional[str] = None  # 未指定時使用全商品合併模型
+    engine: Optional[str] = None      # "prophet" (完整) / "fast" (NumPy 向量化)，預設 FORECAST_ENGINE
+    include_intervals: bool = False   # 是否回傳區間 (fast 引擎為近似值)
+
+class BatchPredictRequest(BaseModel):
+    product_ids: List[str]
+    days: int = 7
+    engine: Optional[str] = None
+    include_intervals: bool = False
+
+FORECAST_ENGINE = os.getenv("FORECAST_ENGINE", "prophet")
+
+# 模型常駐記憶體 (LRU + 檔案更新時自動重新載入)
+model_registry = ModelRegistry(loader=timed("predict", "model_load")(load_model))
+forecast_cache = ForecastCache()
+fast_forecaster = FastForecaster()
+
+@app.on_event("startup")
+def warm_up_models():
+    # 背景預熱，不拖慢 API 啟動
+    threading.Thread(target=model_registry.warm_up, kwargs={"default_ids": [GLOBAL_MODEL_ID]},
+                     name="model-warmup", daemon=True).start()
+
+@app.on_event("shutdown")
+def save_model_stats():
+    model_registry.save_request_counts()
+
+# 預先算好的預測 (sales_forecasts)：每晚 / 訓練後物化，預測時直接查表
+forecast_store = ForecastStore(engine)
+
+class MaterializeRequest(BaseModel):
+    days: Optional[int] = None                 # 預設 FORECAST_MATERIALIZE_DAYS
+    product_ids: Optional[List[str]] = None    # 未指定時處理所有模型
+    force: bool = False
+
+def run_materialize(params: dict, on_progress=None) -> dict:
+    req = MaterializeRequest(**params)
+    kwargs = {"days": req.days} if req.days else {}
+    report = materialize(engine, product_ids=req.product_ids, force=req.force, on_progress=on_progress, **kwargs)
+    forecast_store.invalidate()
+    return report
+
+# 同一時間只需要一個物化工作 (max_queued=1，重複排入會被拒絕)
+materialize_jobs = JobQueue(engine, "materialize", run_materialize, max_queued=1)
+
+def enqueue_nightly_materialize():
+    try:
+        materialize_jobs.enqueue({})
+    except QueueFullError:
+        pass
+
+nightly_materialize = DailyTrigger(FORECAST_MATERIALIZE_AT, enqueue_nightly_materialize) \
+    if FORECAST_STORE and FORECAST_MATERIALIZE_AT else None
+
+@app.on_event("startup")
+def start_materialize_jobs():
+    materialize_jobs.start()
+    if nightly_materialize is not None:
+        nightly_materialize.start()
+
+@app.on_event("shutdown")
+def stop_materialize_jobs():
+    if nightly_materialize is not None:
+        nightly_materialize.stop()
+    materialize_jobs.stop()
+
+@app.post("/sales/forecasts/materialize", status_code=202)
+def materialize_forecasts(req: Optional[MaterializeRequest] = None):
+    req = req or MaterializeRequest()
+    try:
+        job_id = materialize_jobs.enqueue(jsonable_encoder(req))
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return {"status": "queued", "job_id": job_id, "message": "已排入預測物化佇列"}
+
+@app.get("/metrics/models")
+def model_metrics():
+    return model_registry.stats()
+
+@app.get("/metrics/jobs")
+def job_metrics():
+    # worker 執行緒若意外結束，這裡先嘗試重新啟動
+    train_jobs.ensure_workers()
+    materialize_jobs.ensure_workers()
+    return {"train": train_jobs.stats(), "materialize": materialize_jobs.stats()}
+
+@app.get("/metrics/forecast")
+def forecast_metrics():
+    return {**forecast_cache.stats(), "fast_path": fast_forecaster.stats(), "store": forecast_store.stats()}
+
+def validate_product_ids(product_ids: List[str], allow_global: bool = False):
+    for product_id in product_ids:
+        try:
+            validate_product_id(product_id, allow_global=allow_global)
+        except InvalidProductIdError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+def forecast_products(model_ids: List[str], days: int, engine: Optional[str], include_intervals: bool):
+    """回傳 ({model_id: DataFrame}, [找不到模型的 id])"""
+    engine = engine or FORECAST_ENGINE
+    if engine not in ("prophet", "fast"):
+        raise HTTPException(status_code=400, detail=f"未知的預測引擎: {engine}")
+    validate_product_ids(model_ids, allow_global=True)
+
+    pending = list(dict.fromkeys(model_ids))
+    results, loaded, missing = {}, {}, []
+    if engine == "prophet":
+        # 1. 模型已常駐且今天算過：行程內快取，不碰資料庫
+        for model_id in pending:
+            if model_registry.is_resident(model_id):
+                try:
+                    loaded[model_id] = model_registry.get(model_id)
+                except ModelNotFoundError:
+                    continue  # 檔案剛被刪除，下面會回報
+                frame = forecast_cache.peek(model_id, loaded[model_id][1], days)
+                if frame is not None:
+                    results[model_id] = frame
+        # 2. 今天已物化且模型版本沒變的商品直接查表，不必載入模型
+        rest = [model_id for model_id in pending if model_id not in results]
+        if FORECAST_STORE and rest:
+            with stage("predict", "store_lookup"):
+                results.update(forecast_store.lookup(rest, days))
+
+    for model_id in pending:
+        if model_id in results or model_id in loaded:
+            continue
+        try:
+            loaded[model_id] = model_registry.get(model_id)
+        except ModelNotFoundError:
+            missing.append(model_id)
+
+    compact = []
+    for model_id, (m, version) in loaded.items():
+        if model_id in results:
+            continue
+        if engine == "fast":
+            try:
+                compact.append((model_id, fast_forecaster.compact(model_id, m, version)))
+                continue
+            except UnsupportedModelError:
+                pass  # 不支援的模型退回完整 Prophet
+        # 同一模型版本同一天只跑一次 Prophet (算最長 horizon，較短的直接切片)
+        results[model_id] = forecast_cache.get(model_id, m, version, days)
+
+    if compact:
+        with stage("predict", "fast_forecast"):
+            results.update(fast_forecaster.forecast(compact, days, include_intervals))
+    return results, missing
 
 @app.post("/sales/predict")
 def predict_sales(req: PredictRequest):
-    model_path = "models/sales_model.pkl"
-    if not os.path.exists(model_path):
+    if req.product_id:
+        validate_product_ids([req.product_id])
+    model_id = req.product_id or GLOBAL_MODEL_ID
+    try:
+        results, missing = forecast_products([model_id], req.days, req.engine, req.include_intervals)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if missing:
         raise HTTPException(status_code=400, detail="模型尚未訓練，請先執行訓練步驟")
-        
+
+    # 格式化回傳
+    return {"results": forecast_to_records(results[model_id], req.include_intervals)}
+
+# 一次預測多個商品 (fast 引擎會把所有商品放在同一個向量化批次)
+@app.post("/sales/predict/batch")
+def predict_sales_batch(req: BatchPredictRequest):
+    validate_product_ids(req.product_ids)
     try:
-        # 1. 載入模型
-        m = joblib.load(model_path)
-        
-        # 2. 計算日期落差，確保未來日期包含今天到預測天數的範圍
-        last_date = m.history['ds'].max()
-        today = pd.to_datetime(datetime.now().date())
-        if today > last_date:
-            gap_days = (today - last_date).days
-            total_periods = gap_days + req.days
-        else:
-            total_periods = req.days
-
-        future = m.make_future_dataframe(periods=total_periods)
-        
-        # 3. 預測
-        forecast = m.predict(future)
-        
-        # 4. 取出結果 (只取未來的資料)
-        result = forecast[forecast['ds'] > last_date] # 先排除歷史訓練區間
-        result = result[result['ds'] >= today].head(req.days)
-        
-        # 格式化回傳
-        data = []
-        for _, row in result.iterrows():
-            data.append({
-                "date": row['ds'].strftime('%Y-%m-%d'),
-                "predicted_sales": int(row['yhat']) # 轉整數比較好看
-            })
-            
-        return {"results": data}
+        results, missing = forecast_products(req.product_ids, req.days, req.engine, req.include_intervals)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "results": {pid: forecast_to_records(df, req.include_intervals) for pid, df in results.items()},
+        "missing": missing,
+    }
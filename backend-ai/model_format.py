@@ -0,0 +1,258 @@
+# backend-ai/model_format.py
+# ==========================================
+# 精簡模型檔 (Compact Model Artifact)
+# ==========================================
+# joblib.dump(Prophet) 會把整個物件 (含完整 history DataFrame 與 Stan backend) 存下來，
+# 檔案隨歷史長度成長、載入要整份 unpickle。這裡改存 fast_forecast.CompactModel 的參數：
+#   - 趨勢 (k, m, 變點, delta)、季節性 beta、假日效果表、觀測雜訊
+#   - 訓練時另外用 Prophet 算好未來 MODEL_INTERVAL_DAYS 天的區間寬度 (yhat_upper - yhat / yhat - yhat_lower)，
+#     預測時區間與 Prophet 一致 (超出範圍才退回 sigma_obs 近似)
+# 不需要訓練資料即可預測，yhat 與 Prophet.predict 相同。
+#
+# 檔案格式 (.cmodel)：MAGIC + 標頭長度 (uint32) + JSON 標頭 + 對齊 64 bytes 的原始陣列資料
+#   - 標頭含 format / format_version、純量參數、各陣列的 (offset, 長度, dtype)、訓練資訊
+#   - content_sha256 = sha256(不含雜湊欄位的標頭 + 陣列資料)；寫入時 (訓練 / convert) 先驗證暫存檔再換上，
+#     `python model_format.py info` 可重新驗證。預測端載入不驗證 (否則要讀遍整個檔案，失去 memmap 的意義)
+#   - 陣列以 np.memmap 唯讀映射，不必複製 / 反序列化
+# 舊的 .pkl 仍可載入 (MODEL_FORMAT=pickle 時訓練也會繼續寫 .pkl)；
+# `python model_format.py convert` 轉換既有 .pkl，`python model_format.py compare` 比較大小與載入時間。
+import argparse
+import glob
+import hashlib
+import json
+import os
+import struct
+import time
+from typing import Optional
+
+import numpy as np
+
+from fast_forecast import CompactModel, extract
+
+FORMAT_NAME = "compact-prophet"
+FORMAT_VERSION = 1
+MAGIC = b"CPM1"
+ALIGN = 64
+MODEL_INTERVAL_DAYS = int(os.getenv("MODEL_INTERVAL_DAYS", "455"))  # 預測上限 90 天 + 約一年的緩衝
+EXTENSIONS = {"compact": ".cmodel", "pickle": ".pkl"}
+
+_SCALARS = ("growth", "start_day", "t_scale_days", "y_scale", "trend_offset", "k", "m",
+            "holiday_mode", "sigma_obs", "interval_width", "last_day")
+_ARRAYS = {"changepoints_t": "<f8", "deltas": "<f8", "holiday_days": "<i8", "holiday_effect": "<f8",
+           "upper_offset": "<f8", "lower_offset": "<f8"}
+
+
+class ModelFormatError(ValueError):
+    pass
+
+
+# ==========================================
+# 1. Prophet -> CompactModel
+# ==========================================
+def to_compact(model, interval_days: int = MODEL_INTERVAL_DAYS) -> CompactModel:
+    """在訓練 / 轉換時執行 (需要 Prophet)；區間寬度從訓練資料最後一天的隔天開始"""
+    cm = extract(model)
+    if interval_days > 0 and model.uncertainty_samples:
+        future = model.make_future_dataframe(periods=interval_days, include_history=False)
+        forecast = model.predict(future)
+        cm.upper_offset = (forecast['yhat_upper'] - forecast['yhat']).to_numpy(dtype=float)
+        cm.lower_offset = (forecast['yhat'] - forecast['yhat_lower']).to_numpy(dtype=float)
+    return cm
+
+
+# ==========================================
+# 2. 寫入 / 讀取
+# ==========================================
+def _content_hash(header: dict, data: bytes) -> str:
+    h = hashlib.sha256(json.dumps({k: v for k, v in header.items() if k != "content_sha256"},
+                                  sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    h.update(data)
+    return h.hexdigest()
+
+
+def save_compact(cm: CompactModel, path: str, meta: Optional[dict] = None) -> dict:
+    arrays = {name: getattr(cm, name) for name in _ARRAYS}
+    for i, (_, _, _, beta) in enumerate(cm.seasonalities):
+        arrays[f"seasonality_{i}"] = beta
+
+    data = bytearray()
+    layout = {}
+    for name, value in arrays.items():
+        if value is None:
+            continue
+        arr = np.ascontiguousarray(value, dtype=_ARRAYS.get(name, "<f8"))
+        layout[name] = [len(data), int(arr.size), arr.dtype.str]
+        data += arr.tobytes()
+        data += b"\0" * (-len(data) % 8)
+
+    header = {
+        "format": FORMAT_NAME,
+        "format_version": FORMAT_VERSION,
+        "scalars": {name: getattr(cm, name) for name in _SCALARS},
+        "seasonalities": [{"period": p, "fourier_order": o, "mode": mode} for p, o, mode, _ in cm.seasonalities],
+        "arrays": layout,
+        "meta": meta or {},
+    }
+    header["content_sha256"] = _content_hash(header, bytes(data))
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    prefix = MAGIC + struct.pack("<I", len(raw)) + raw
+    prefix += b"\0" * (-len(prefix) % ALIGN)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(prefix)
+        f.write(data)
+    try:
+        load_compact(tmp_path, verify=True)  # 讀回來驗證雜湊，預測端載入時就不必再驗證
+    except Exception:
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)  # 原子替換，預測端不會讀到寫一半的檔案
+    return header
+
+
+def read_header(path: str):
+    """回傳 (標頭, 陣列資料起點)"""
+    with open(path, "rb") as f:
+        if f.read(4) != MAGIC:
+            raise ModelFormatError(f"{path} 不是精簡模型檔")
+        (size,) = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(size).decode("utf-8"))
+    if header.get("format") != FORMAT_NAME or header.get("format_version", 0) > FORMAT_VERSION:
+        raise ModelFormatError(f"不支援的模型格式: {header.get('format')} v{header.get('format_version')}")
+    offset = 8 + size
+    return header, offset + (-offset % ALIGN)
+
+
+def load_compact(path: str, verify: bool = False) -> CompactModel:
+    """verify=True 時計算整個陣列區的 sha256 (會讀遍檔案)；預測端預設不驗證，只映射需要的頁面"""
+    header, offset = read_header(path)
+    if os.path.getsize(path) > offset:
+        data = np.memmap(path, dtype=np.uint8, mode="r", offset=offset)
+    else:
+        data = np.zeros(0, dtype=np.uint8)
+    if verify and _content_hash(header, data.tobytes()) != header["content_sha256"]:
+        raise ModelFormatError(f"{path} 內容雜湊不符 (檔案損毀或被修改)")
+
+    def array(name):
+        if name not in header["arrays"]:
+            return None
+        start, count, dtype = header["arrays"][name]
+        return np.frombuffer(data, dtype=dtype, count=count, offset=start)
+
+    values = dict(header["scalars"])
+    values.update({name: array(name) for name in _ARRAYS})
+    values["seasonalities"] = [(s["period"], s["fourier_order"], s["mode"], array(f"seasonality_{i}"))
+                               for i, s in enumerate(header["seasonalities"])]
+    return CompactModel(**values)
+
+
+def load_model(path: str):
+    """依副檔名載入：.cmodel -> CompactModel (不驗證雜湊)，.pkl -> Prophet 物件"""
+    if path.endswith(EXTENSIONS["compact"]):
+        return load_compact(path, verify=False)
+    import joblib
+
+    return joblib.load(path)
+
+
+# ==========================================
+# 3. CLI：轉換既有 .pkl / 比較
+# ==========================================
+def convert(pkl_path: str, delete_pickle: bool = False) -> dict:
+    import joblib
+
+    model = joblib.load(pkl_path)
+    path = pkl_path[:-len(EXTENSIONS["pickle"])] + EXTENSIONS["compact"]
+    header = save_compact(to_compact(model), path, meta={
+        "product_id": os.path.basename(pkl_path)[:-len(EXTENSIONS["pickle"])],
+        "converted_from": os.path.basename(pkl_path),
+        "history_rows": int(len(model.history)),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    if delete_pickle:
+        os.remove(pkl_path)
+    return header
+
+
+def _timed_load(fn, path, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(path)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def compare(model_dir: str, repeat: int = 3, days: int = 30):
+    """同時存在 .pkl 與 .cmodel 的模型：檔案大小、載入時間 (取最佳)、預測差異"""
+    import joblib
+    import pandas as pd
+
+    from forecast_cache import compute_forecast
+
+    today = pd.Timestamp.now().normalize()
+    rows = []
+    for pkl_path in sorted(glob.glob(os.path.join(model_dir, "*" + EXTENSIONS["pickle"]))):
+        compact_path = pkl_path[:-len(EXTENSIONS["pickle"])] + EXTENSIONS["compact"]
+        if not os.path.exists(compact_path):
+            continue
+        prophet_fc = compute_forecast(joblib.load(pkl_path), days, today)
+        compact_fc = compute_forecast(load_compact(compact_path), days, today)
+        rows.append({
+            "model": os.path.basename(pkl_path)[:-len(EXTENSIONS["pickle"])],
+            "pkl_kb": os.path.getsize(pkl_path) / 1024,
+            "compact_kb": os.path.getsize(compact_path) / 1024,
+            "pkl_load_ms": _timed_load(joblib.load, pkl_path, repeat) * 1000,
+            "compact_load_ms": _timed_load(load_model, compact_path, repeat) * 1000,
+            "verify_ms": _timed_load(lambda p: load_compact(p, verify=True), compact_path, repeat) * 1000,
+            "max_yhat_diff": float(np.max(np.abs(prophet_fc['yhat'].to_numpy() - compact_fc['yhat'].to_numpy()))),
+        })
+
+    print(f"{'model':<24} {'pkl':>10} {'compact':>10} {'pkl load':>10} {'compact load':>13} {'+verify':>10} "
+          f"{'max |Δyhat|':>12}")
+    for r in rows:
+        print(f"{r['model']:<24} {r['pkl_kb']:>8.1f}KB {r['compact_kb']:>8.1f}KB {r['pkl_load_ms']:>8.2f}ms "
+              f"{r['compact_load_ms']:>11.3f}ms {r['verify_ms']:>8.3f}ms {r['max_yhat_diff']:>12.2e}")
+    if rows:
+        total = lambda key: sum(r[key] for r in rows)  # noqa: E731
+        print(f"合計: 檔案 {total('pkl_kb'):.0f}KB -> {total('compact_kb'):.0f}KB "
+              f"(x{total('pkl_kb') / total('compact_kb'):.1f})，載入 {total('pkl_load_ms'):.1f}ms -> "
+              f"{total('compact_load_ms'):.2f}ms (x{total('pkl_load_ms') / total('compact_load_ms'):.0f})")
+    return rows
+
+
+def main():
+    from training import MODEL_DIR
+
+    parser = argparse.ArgumentParser(description="精簡模型檔：轉換 / 比較 / 檢視")
+    sub = parser.add_subparsers(dest="command", required=True)
+    conv = sub.add_parser("convert", help="把 models/*.pkl 轉成 .cmodel")
+    conv.add_argument("--model-dir", default=MODEL_DIR)
+    conv.add_argument("--delete-pickle", action="store_true", help="轉換成功後刪除 .pkl")
+    cmp_ = sub.add_parser("compare", help="比較 .pkl 與 .cmodel 的大小、載入時間與預測差異")
+    cmp_.add_argument("--model-dir", default=MODEL_DIR)
+    cmp_.add_argument("--repeat", type=int, default=3)
+    info = sub.add_parser("info", help="顯示 .cmodel 標頭並驗證內容雜湊")
+    info.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        paths = sorted(glob.glob(os.path.join(args.model_dir, "*" + EXTENSIONS["pickle"])))
+        for path in paths:
+            try:
+                header = convert(path, args.delete_pickle)
+                print(f"✅ {os.path.basename(path)} -> {header['content_sha256'][:12]}")
+            except Exception as e:
+                print(f"❌ {os.path.basename(path)}: {e}")
+    elif args.command == "compare":
+        compare(args.model_dir, args.repeat)
+    else:
+        header, _ = read_header(args.path)
+        load_compact(args.path, verify=True)
+        print(json.dumps({k: v for k, v in header.items() if k != "arrays"}, ensure_ascii=False, indent=2))
+        print("✅ 內容雜湊驗證通過")
+
+
+if __name__ == "__main__":
+    main()
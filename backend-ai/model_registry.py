@@ -0,0 +1,236 @@
+# backend-ai/model_registry.py
+# ==========================================
+# 模型註冊表 (Model Registry)
+# ==========================================
+# /sales/predict 以前每次都 joblib.load 整個 Prophet 物件 (含 Stan 狀態與訓練資料)。
+# 這裡把模型留在記憶體中：
+# - 以商品 id 為 key，對應 models/{product_id}.cmodel (精簡模型檔，舊的 .pkl 仍可讀；見 model_format.py)
+# - 依記憶體預算做 LRU 淘汰
+# - 檔案 mtime/大小 改變時自動重新載入 (重新訓練後不必重啟 API)
+# - 啟動時預先載入最常被查詢的 N 個商品
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from model_format import load_model
+from training import MODEL_DIR, PRODUCT_ID_PATTERN, find_model, validate_product_id
+
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "1024"))
+# 解開 pickle 後的物件通常比檔案大，用倍數估算佔用記憶體
+MODEL_MEMORY_FACTOR = float(os.getenv("MODEL_MEMORY_FACTOR", "3"))
+MODEL_STAT_INTERVAL_SECONDS = float(os.getenv("MODEL_STAT_INTERVAL_SECONDS", "2"))
+MODEL_WARMUP_COUNT = int(os.getenv("MODEL_WARMUP_COUNT", "20"))
+REQUEST_COUNTS_FILE = "model_requests.json"
+REQUEST_COUNTS_SAVE_SECONDS = 300
+REQUEST_COUNTS_MAX = int(os.getenv("MODEL_REQUEST_COUNTS_MAX", "10000"))  # 存檔時只保留查詢次數最多的 N 個
+
+
+class ModelNotFoundError(Exception):
+    pass
+
+
+class _Entry:
+    __slots__ = ("model", "version", "size", "checked_at")
+
+    def __init__(self, model, version, size):
+        self.model = model
+        self.version = version
+        self.size = size
+        self.checked_at = time.monotonic()
+
+
+class ModelRegistry:
+    def __init__(self, model_dir: str = MODEL_DIR, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB,
+                 loader: Callable[[str], object] = load_model,
+                 path_for: Callable[[str, str], str] = find_model):
+        self.model_dir = model_dir
+        self.budget = int(memory_budget_mb * 1024 * 1024)
+        self.loader = loader
+        self.path_for = path_for
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._resident = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        self.load_counts: Counter = Counter()
+        self.request_counts: Counter = Counter(self._load_request_counts())
+        self._counts_saved_at = time.monotonic()
+
+    # ---------- 查詢 ----------
+    @staticmethod
+    def _file_version(path: str) -> Tuple[int, int]:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, product_id: str):
+        """回傳 (model, version)；檔案不存在時丟出 ModelNotFoundError，id 不合法時丟出 InvalidProductIdError"""
+        validate_product_id(product_id, allow_global=True)
+        entry = self._lookup(product_id)
+        if entry is None:
+            entry = self._load_once(product_id)
+
+        # 只統計確實存在的模型，任意 id 不會讓統計無限成長、也不會擠進預熱名單
+        self.request_counts[product_id] += 1
+        self._maybe_save_request_counts()
+        return entry.model, entry.version
+
+    def is_resident(self, product_id: str) -> bool:
+        """模型是否已在記憶體中 (不讀檔、不載入)"""
+        with self._lock:
+            return product_id in self._entries
+
+    def _lookup(self, product_id: str, count: bool = True) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(product_id)
+        if entry is not None and time.monotonic() - entry.checked_at > MODEL_STAT_INTERVAL_SECONDS:
+            # 定期檢查檔案是否被重新訓練覆蓋
+            try:
+                version = self._file_version(self.path_for(product_id, self.model_dir))
+            except FileNotFoundError:
+                version = None
+            if version != entry.version:
+                self._drop(product_id)
+                if count:
+                    self.reloads += 1
+                entry = None
+            else:
+                entry.checked_at = time.monotonic()
+
+        with self._lock:
+            if entry is not None:
+                self._entries.move_to_end(product_id)
+                if count:
+                    self.hits += 1
+            elif count:
+                self.misses += 1
+        return entry
+
+    def _load_once(self, product_id: str) -> _Entry:
+        """同一個商品只讓一個執行緒載入，其他人等結果 (get 與預熱共用)"""
+        with self._lock:
+            load_lock = self._load_locks.setdefault(product_id, threading.Lock())
+        with load_lock:
+            entry = self._lookup(product_id, count=False)
+            if entry is None:
+                try:
+                    entry = self._load(product_id)
+                except ModelNotFoundError:
+                    with self._lock:
+                        self._load_locks.pop(product_id, None)
+                    raise
+        return entry
+
+    def _load(self, product_id: str) -> _Entry:
+        path = self.path_for(product_id, self.model_dir)
+        try:
+            version = self._file_version(path)
+        except FileNotFoundError:
+            raise ModelNotFoundError(product_id)
+
+        started = time.perf_counter()
+        model = self.loader(path)
+        self.load_seconds += time.perf_counter() - started
+        self.load_counts[product_id] += 1
+
+        entry = _Entry(model, version, int(version[1] * MODEL_MEMORY_FACTOR))
+        with self._lock:
+            replaced = self._entries.pop(product_id, None)
+            if replaced is not None:
+                self._resident -= replaced.size
+            self._entries[product_id] = entry
+            self._resident += entry.size
+            # 至少保留剛載入的這一個
+            while self._resident > self.budget and len(self._entries) > 1:
+                old_id, old = self._entries.popitem(last=False)
+                self._resident -= old.size
+                self.evictions += 1
+        return entry
+
+    def _drop(self, product_id: str):
+        with self._lock:
+            entry = self._entries.pop(product_id, None)
+            if entry is not None:
+                self._resident -= entry.size
+
+    def invalidate(self, product_id: Optional[str] = None):
+        if product_id is None:
+            with self._lock:
+                self._entries.clear()
+                self._resident = 0
+        else:
+            self._drop(product_id)
+
+    # ---------- 預熱 ----------
+    def _counts_path(self) -> str:
+        return os.path.join(self.model_dir, REQUEST_COUNTS_FILE)
+
+    def _load_request_counts(self) -> Dict[str, int]:
+        try:
+            with open(self._counts_path(), encoding="utf-8") as f:
+                counts = json.load(f)
+            # 舊版會記錄任意 id；不合法的 id 不可能有模型檔
+            return {pid: n for pid, n in counts.items() if PRODUCT_ID_PATTERN.fullmatch(pid)}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def save_request_counts(self):
+        os.makedirs(self.model_dir, exist_ok=True)
+        tmp_path = f"{self._counts_path()}.{os.getpid()}.tmp"
+        if len(self.request_counts) > REQUEST_COUNTS_MAX:
+            self.request_counts = Counter(dict(self.request_counts.most_common(REQUEST_COUNTS_MAX)))
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.request_counts), f, ensure_ascii=False)
+        os.replace(tmp_path, self._counts_path())
+        self._counts_saved_at = time.monotonic()
+
+    def _maybe_save_request_counts(self):
+        if time.monotonic() - self._counts_saved_at > REQUEST_COUNTS_SAVE_SECONDS:
+            self._counts_saved_at = time.monotonic()
+            try:
+                self.save_request_counts()
+            except OSError as e:
+                print(f"⚠️ 無法儲存模型查詢次數: {e}")
+
+    def warm_up(self, n: int = MODEL_WARMUP_COUNT, default_ids=()):
+        """載入最常被查詢的 n 個模型 (沒有統計資料時載入 default_ids)"""
+        ranked = [pid for pid, _ in self.request_counts.most_common(n)] or list(default_ids)
+        loaded = 0
+        for pid in ranked:
+            if self.is_resident(pid):
+                continue
+            try:
+                self._load_once(pid)
+                loaded += 1
+            except ModelNotFoundError:
+                continue
+            except Exception as e:
+                print(f"⚠️ 預熱模型 {pid} 失敗: {e}")
+        print(f"🔥 已預熱 {loaded} 個模型")
+        return loaded
+
+    # ---------- 監控 ----------
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        loads = sum(self.load_counts.values())
+        return {
+            "resident_models": len(self._entries),
+            "resident_mb_estimate": round(self._resident / 1024 / 1024, 2),
+            "memory_budget_mb": round(self.budget / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "loads": loads,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+            "avg_load_ms": round(self.load_seconds * 1000.0 / loads, 2) if loads else 0.0,
+            "load_counts": dict(self.load_counts.most_common(50)),
+            "top_requested": dict(self.request_counts.most_common(20)),
+        }
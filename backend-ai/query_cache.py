@@ -0,0 +1,216 @@
+# backend-ai/query_cache.py
+# ==========================================
+# 查詢向量快取 (Query Embedding Cache)
+# ==========================================
+# 客服機器人的查詢高度重複 ("ubereats", "linepay", "出單機"...)，
+# 同一個字串不需要每次都重新 encode。
+# - 第一層：行程內 LRU + TTL，向量以 np.float32 存放 (384 維只佔 1.5 KB)
+# - 第二層 (選用)：SQLite 檔案或 Postgres 資料表，讓多個 uvicorn worker 與重啟後共用
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import numpy as np
+from sqlalchemy import text
+
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "10000"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "86400"))
+# none | sqlite | postgres
+QUERY_CACHE_BACKEND = os.getenv("QUERY_CACHE_BACKEND", "none").lower()
+QUERY_CACHE_SQLITE_PATH = os.getenv("QUERY_CACHE_SQLITE_PATH", "models/query_cache.sqlite3")
+
+
+def normalize_query(query: str) -> str:
+    """去空白 + 轉小寫 (搜尋 "Uber Eats" 要能對上標籤 "UberEats")"""
+    return query.replace(" ", "").lower()
+
+
+def _to_blob(vec: np.ndarray) -> bytes:
+    return np.ascontiguousarray(vec, dtype=np.float32).tobytes()
+
+
+def _from_blob(blob) -> np.ndarray:
+    vec = np.frombuffer(bytes(blob), dtype=np.float32)
+    vec.setflags(write=False)
+    return vec
+
+
+# ==========================================
+# 第二層：共享儲存
+# ==========================================
+class SQLiteEmbeddingStore:
+    """單機多 worker 共用的檔案快取 (WAL 模式，可同時讀)"""
+
+    def __init__(self, path: str = QUERY_CACHE_SQLITE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS query_embedding_cache (
+                model_name TEXT NOT NULL,
+                query TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (model_name, query)
+            )
+        """)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1.0)
+            self._local.conn = conn
+        return conn
+
+    def get(self, model_name: str, query: str, ttl: float) -> Optional[bytes]:
+        row = self._conn().execute(
+            "SELECT embedding FROM query_embedding_cache WHERE model_name = ? AND query = ? AND created_at > ?",
+            (model_name, query, time.time() - ttl),
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model_name: str, query: str, blob: bytes):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO query_embedding_cache (model_name, query, embedding, created_at) VALUES (?, ?, ?, ?)",
+            (model_name, query, blob, time.time()),
+        )
+        conn.commit()
+
+
+class PostgresEmbeddingStore:
+    """跨機器共用：存在 query_embedding_cache 資料表 (見 database/init.sql)"""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def get(self, model_name: str, query: str, ttl: float) -> Optional[bytes]:
+        with self.engine.connect() as conn:
+            return conn.execute(text("""
+                SELECT embedding FROM query_embedding_cache
+                WHERE model_name = :model_name AND query = :query
+                  AND created_at > NOW() - make_interval(secs => :ttl)
+            """), {"model_name": model_name, "query": query, "ttl": ttl}).scalar()
+
+    def put(self, model_name: str, query: str, blob: bytes):
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO query_embedding_cache (model_name, query, embedding, created_at)
+                VALUES (:model_name, :query, :embedding, NOW())
+                ON CONFLICT (model_name, query)
+                DO UPDATE SET embedding = EXCLUDED.embedding, created_at = EXCLUDED.created_at
+            """), {"model_name": model_name, "query": query, "embedding": blob})
+
+
+def build_store(engine=None, backend: str = QUERY_CACHE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteEmbeddingStore()
+    if backend == "postgres" and engine is not None:
+        return PostgresEmbeddingStore(engine)
+    return None
+
+
+# ==========================================
+# 第一層：行程內 LRU + TTL
+# ==========================================
+class QueryEmbeddingCache:
+    def __init__(self, model_name: str, max_entries: int = QUERY_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = QUERY_CACHE_TTL_SECONDS, store=None):
+        self.model_name = model_name
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self.store = store
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.store_hits = 0
+        self.store_errors = 0
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                vec, expires_at = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return vec
+                del self._data[key]
+                self.expirations += 1
+
+        # 本地沒有 -> 問共享儲存
+        if self.store is not None:
+            try:
+                blob = self.store.get(self.model_name, key, self.ttl)
+            except Exception as e:
+                self.store_errors += 1
+                print(f"⚠️ 查詢快取後端讀取失敗: {e}")
+                blob = None
+            if blob is not None:
+                vec = _from_blob(blob)
+                self._put_local(key, vec)
+                with self._lock:
+                    self.hits += 1
+                    self.store_hits += 1
+                return vec
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, vec: np.ndarray):
+        vec = np.array(vec, dtype=np.float32)
+        vec.setflags(write=False)
+        self._put_local(key, vec)
+        if self.store is not None:
+            try:
+                self.store.put(self.model_name, key, _to_blob(vec))
+            except Exception as e:
+                self.store_errors += 1
+                print(f"⚠️ 查詢快取後端寫入失敗: {e}")
+
+    def get_or_compute(self, key: str, compute: Callable[[str], np.ndarray]) -> np.ndarray:
+        vec = self.get(key)
+        if vec is None:
+            vec = compute(key)
+            self.put(key, vec)
+        return vec
+
+    def _put_local(self, key: str, vec: np.ndarray):
+        with self._lock:
+            self._data[key] = (vec, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.store).__name__ if self.store is not None else None,
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "store_hits": self.store_hits,
+            "store_errors": self.store_errors,
+        }
@@ -0,0 +1,205 @@
+# backend-ai/sales_upload.py
+# ==========================================
+# 銷售 CSV 串流匯入 (Streaming Sales Upload)
+# ==========================================
+# 以前是 pd.read_csv 整份讀進記憶體 -> to_dict -> executemany，而且一律先 TRUNCATE。
+# 現在改成：
+# - pd.read_csv(chunksize=...) 分塊讀取，記憶體用量與檔案大小無關
+# - 每一塊做欄位驗證與型別轉換，不合法的列記錄下來後略過
+# - 用 COPY 直接寫進 Postgres
+# - 三種模式：replace (清空後匯入，預設，與舊版相同) / append (附加) /
+#   upsert (同一個 product_id + transaction_date 以新檔案為準)
+# 全部在同一個 transaction 中，中途失敗不會留下一半的資料。
+# 匯入後同步更新每日彙總表 sales_daily (只重算這次檔案涵蓋的 商品+日期)。
+import io
+import os
+import time
+from typing import List
+
+import pandas as pd
+from sqlalchemy import text
+
+from telemetry import observe_stage
+from training import GLOBAL_MODEL_ID
+
+SALES_UPLOAD_CHUNK_ROWS = int(os.getenv("SALES_UPLOAD_CHUNK_ROWS", "100000"))
+REQUIRED_COLUMNS = ['product_id', 'transaction_date', 'quantity']
+UPLOAD_MODES = ("replace", "append", "upsert")
+MAX_REPORTED_ERRORS = 100
+PRODUCT_ID_MAX_LEN = 50  # sales_data.product_id VARCHAR(50)
+QUANTITY_MAX = 2**31 - 1  # sales_data.quantity INT
+
+
+class SalesUploadError(ValueError):
+    pass
+
+
+def parse_dates(values: pd.Series) -> pd.Series:
+    # 先用 ISO 格式快速解析，剩下的 (例如 2024/01/05) 再逐筆推斷格式
+    dates = pd.to_datetime(values, format='%Y-%m-%d', errors='coerce')
+    retry = dates.isna() & values.notna()
+    if retry.any():
+        dates[retry] = pd.to_datetime(values[retry], format='mixed', errors='coerce')
+    return dates
+
+
+def coerce_chunk(chunk: pd.DataFrame, first_row: int, errors: List[dict]):
+    """型別轉換 + 驗證，回傳 (合法的 DataFrame, 不合法列數)"""
+    df = pd.DataFrame({
+        'product_id': chunk['product_id'].astype('string').str.strip(),
+        'transaction_date': parse_dates(chunk['transaction_date'].str.strip()),
+        'quantity': pd.to_numeric(chunk['quantity'], errors='coerce'),
+    })
+    reasons = pd.Series(pd.NA, index=df.index, dtype='object')
+    reasons[df['quantity'].notna() & (df['quantity'] % 1 != 0)] = "quantity 必須是整數"
+    reasons[df['quantity'].abs() > QUANTITY_MAX] = f"quantity 超出範圍 (±{QUANTITY_MAX})"
+    reasons[df['quantity'].isna()] = "quantity 不是數字"
+    reasons[df['transaction_date'].isna()] = "transaction_date 無法解析"
+    reasons[df['product_id'].str.len() > PRODUCT_ID_MAX_LEN] = f"product_id 超過 {PRODUCT_ID_MAX_LEN} 字"
+    reasons[df['product_id'] == GLOBAL_MODEL_ID] = f"product_id {GLOBAL_MODEL_ID} 保留給全商品合併模型"
+    reasons[df['product_id'].isna() | (df['product_id'] == "")] = "缺少 product_id"
+
+    bad = reasons.notna()
+    if bad.any():
+        for idx, reason in reasons[bad].head(MAX_REPORTED_ERRORS - len(errors)).items():
+            # +2：CSV 第 1 列是標題，資料列從 1 開始編號
+            errors.append({"row": first_row + int(idx) + 2, "error": reason})
+
+    good = df[~bad]
+    good = good.assign(
+        transaction_date=good['transaction_date'].dt.strftime('%Y-%m-%d'),
+        quantity=good['quantity'].astype('int64'),
+    )
+    return good, int(bad.sum())
+
+
+def _copy(cursor, table: str, df: pd.DataFrame):
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cursor.copy_expert(f"COPY {table} (product_id, transaction_date, quantity) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def refresh_daily_rollup(conn, keys_table: str = None) -> int:
+    """
+    重新彙總 sales_daily。
+    keys_table=None：整張表重建；否則只重算 keys_table 中出現過的 (product_id, transaction_date)
+    """
+    if keys_table is None:
+        conn.execute(text("TRUNCATE TABLE sales_daily"))
+        return conn.execute(text("""
+            INSERT INTO sales_daily (product_id, transaction_date, quantity, txn_count)
+            SELECT product_id, transaction_date, SUM(quantity), COUNT(*)
+            FROM sales_data
+            GROUP BY product_id, transaction_date
+        """)).rowcount
+
+    # 這次匯入的 key 在 sales_data 中一定還有資料 (upsert 是刪除後重新寫入)，不會有要刪掉的彙總
+    return conn.execute(text(f"""
+        INSERT INTO sales_daily (product_id, transaction_date, quantity, txn_count)
+        SELECT s.product_id, s.transaction_date, SUM(s.quantity), COUNT(*)
+        FROM sales_data s
+        JOIN (SELECT DISTINCT product_id, transaction_date FROM {keys_table}) k
+          ON s.product_id = k.product_id AND s.transaction_date = k.transaction_date
+        GROUP BY s.product_id, s.transaction_date
+        ON CONFLICT (product_id, transaction_date) DO UPDATE
+        SET quantity = EXCLUDED.quantity,
+            txn_count = EXCLUDED.txn_count,
+            updated_at = CURRENT_TIMESTAMP
+    """)).rowcount
+
+
+def load_sales_csv(engine, fileobj, mode: str = "replace",
+                   chunk_rows: int = SALES_UPLOAD_CHUNK_ROWS) -> dict:
+    if mode not in UPLOAD_MODES:
+        raise SalesUploadError(f"未知的匯入模式: {mode} (可用: {', '.join(UPLOAD_MODES)})")
+
+    started = time.perf_counter()
+    reader = pd.read_csv(fileobj, chunksize=chunk_rows, dtype=str, keep_default_na=False,
+                         na_values=[""], skipinitialspace=True)
+    inserted, rejected, chunks = 0, 0, 0
+    parse_seconds, insert_seconds = 0.0, 0.0
+    errors: List[dict] = []
+
+    with engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        try:
+            target = "sales_data"
+            if mode == "replace":
+                conn.execute(text("TRUNCATE TABLE sales_data RESTART IDENTITY"))
+            else:
+                # append / upsert 先全部寫進暫存表，最後一次合併：
+                # - upsert 避免同一個 key 分散在不同 chunk 時互相刪除
+                # - 暫存表同時記錄了這次涵蓋哪些 key，更新 sales_daily 只需重算這些
+                conn.execute(text("""
+                    CREATE TEMP TABLE sales_upload_staging (
+                        product_id VARCHAR(50) NOT NULL,
+                        transaction_date DATE NOT NULL,
+                        quantity INT NOT NULL
+                    ) ON COMMIT DROP
+                """))
+                target = "sales_upload_staging"
+
+            first_row = 0
+            mark = time.perf_counter()
+            for chunk in reader:
+                if chunks == 0:
+                    # 簡單驗證欄位 (第一塊就能知道標題列)
+                    missing = [c for c in REQUIRED_COLUMNS if c not in chunk.columns]
+                    if missing:
+                        raise SalesUploadError(f"CSV 格式錯誤，需包含: {REQUIRED_COLUMNS}，缺少: {missing}")
+                chunks += 1
+                good, bad = coerce_chunk(chunk.reset_index(drop=True), first_row, errors)
+                first_row += len(chunk)
+                rejected += bad
+                parsed = time.perf_counter()
+                parse_seconds += parsed - mark  # read_csv 讀下一塊 + 驗證轉型
+                if not good.empty:
+                    _copy(cursor, target, good)
+                    inserted += len(good)
+                mark = time.perf_counter()
+                insert_seconds += mark - parsed
+
+            if chunks == 0:
+                raise SalesUploadError("CSV 沒有任何資料")
+
+            replaced = 0
+            if mode != "replace":
+                # 暫存表不會被 autovacuum 分析，手動更新統計資料讓下面的 JOIN 有合理的計畫
+                conn.execute(text("ANALYZE sales_upload_staging"))
+            if mode == "upsert":
+                replaced = conn.execute(text("""
+                    DELETE FROM sales_data s
+                    USING (SELECT DISTINCT product_id, transaction_date FROM sales_upload_staging) k
+                    WHERE s.product_id = k.product_id AND s.transaction_date = k.transaction_date
+                """)).rowcount
+            if mode != "replace":
+                conn.execute(text("""
+                    INSERT INTO sales_data (product_id, transaction_date, quantity)
+                    SELECT product_id, transaction_date, quantity FROM sales_upload_staging
+                """))
+
+            daily_rows = refresh_daily_rollup(conn, None if mode == "replace" else "sales_upload_staging")
+            insert_seconds += time.perf_counter() - mark  # 合併暫存表 + 更新每日彙總
+        finally:
+            cursor.close()
+
+    elapsed = time.perf_counter() - started
+    observe_stage("sales_upload", "parse", parse_seconds)
+    observe_stage("sales_upload", "insert", insert_seconds)
+    report = {
+        "status": "success",
+        "mode": mode,
+        "count": inserted,
+        "rejected": rejected,
+        "errors": errors,
+        "chunks": chunks,
+        "daily_rows_refreshed": daily_rows,
+        "elapsed_seconds": round(elapsed, 3),
+        "parse_seconds": round(parse_seconds, 3),
+        "insert_seconds": round(insert_seconds, 3),
+        "rows_per_sec": round(inserted / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+    if mode == "upsert":
+        report["replaced"] = replaced
+    return report
@@ -0,0 +1,442 @@
+# backend-ai/search_engine.py
+# ==========================================
+# RAG 搜尋 SQL (精準模式 / 智能模式)
+# ==========================================
+# 智能模式拆成兩階段：
+#   1. 候選階段：只用 ORDER BY embedding <=> :query_vec LIMIT N，讓 pgvector 走 HNSW 索引
+#   2. 重排階段：只對這 N 筆候選計算分類/標題/標籤加分，並只撈這些文件的標籤
+# 分數公式與舊版單一 SQL 完全相同，差別只在於不再對全表計算。
+#
+# 內文區塊 (document_chunks)：候選階段另外從區塊的 HNSW 索引取前 N 個區塊，依文件做 pooling
+# (max：最相近的區塊；sum：最相近的區塊 + 其餘命中區塊 x CHUNK_SUM_WEIGHT)，
+# 文件的向量分數取「文件向量」與「區塊 pooling」兩者較高者。SEARCH_USE_CHUNKS=0 可關閉。
+#
+# 壓縮索引 (VECTOR_STORAGE=halfvec/binary，見 vector_storage.py)：候選階段先在壓縮索引上多取
+# VECTOR_RERANK_FACTOR 倍的粗略候選，再以 float32 向量精確重排，文件與區塊都一樣。
+#
+# 混合檢索 (SEARCH_LEXICAL=1)：關鍵字檢索 (lexical.py 的 bigram tsvector + GIN 索引) 與
+# 「查詢向量 -> 向量檢索」兩條路同時執行，再以 Reciprocal Rank Fusion 合併排名；
+# 只出現在關鍵字結果的文件，再用一條依 id 查詢補上與向量檢索相同公式的 score。
+#
+# 行程內向量索引 (ANN_INDEX=1，見 ann_index.py)：索引可用時候選階段 (含區塊 pooling) 改在記憶體內完成，
+# Postgres 只對傳入的 (id, distance) 計算加權分數與撈標籤；索引過期時自動退回上面的 SQL。
+#
+# SQL 只依「是否有分類篩選」等少數開關產生固定字串並快取，asyncpg 的 prepared statement 快取才會命中。
+# 同步 (engine.connect()) 與非同步 (AsyncConnection) 版本共用同一份 SQL。
+import asyncio
+import json
+import os
+from collections import defaultdict
+from functools import lru_cache
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from lexical import tsquery_literal
+from vector_storage import VECTOR_RERANK_FACTOR, coarse_order_by, resolve_storage
+
+SEARCH_CANDIDATE_K = int(os.getenv("SEARCH_CANDIDATE_K", "100"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "100"))
+HNSW_EF_SEARCH_MAX = 1000  # pgvector 允許的上限
+SEARCH_USE_CHUNKS = os.getenv("SEARCH_USE_CHUNKS", "1") != "0"
+SEARCH_CHUNK_K = int(os.getenv("SEARCH_CHUNK_K", "200"))
+CHUNK_POOLING = os.getenv("CHUNK_POOLING", "max")  # max / sum
+CHUNK_SUM_WEIGHT = float(os.getenv("CHUNK_SUM_WEIGHT", "0.1"))
+SEARCH_LEXICAL = os.getenv("SEARCH_LEXICAL", "1") != "0"
+SEARCH_LEXICAL_K = int(os.getenv("SEARCH_LEXICAL_K", "50"))
+SEARCH_FUSION_DEPTH = int(os.getenv("SEARCH_FUSION_DEPTH", "20"))  # 兩條路各取前幾名參與融合
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+
+def resolve_candidate_params(top_k: int, candidate_k: Optional[int] = None,
+                             ef_search: Optional[int] = None):
+    """候選數至少要 >= top_k，ef_search 至少要 >= 候選數 HNSW 才能回傳足夠的結果"""
+    candidate_k = max(candidate_k or SEARCH_CANDIDATE_K, top_k)
+    ef_search = min(max(ef_search or HNSW_EF_SEARCH, candidate_k), HNSW_EF_SEARCH_MAX)
+    return candidate_k, ef_search
+
+
+def _with_category(params: dict, category_filter: Optional[str]) -> bool:
+    if category_filter and category_filter != "全部":
+        params["cat_filter"] = category_filter
+        return True
+    return False
+
+
+def _category_clause(with_category: bool) -> str:
+    return "AND d.category = :cat_filter" if with_category else ""
+
+
+@lru_cache(maxsize=None)
+def _exact_sql(with_category: bool):
+    cat_filter_clause = _category_clause(with_category)
+    return text(f"""
+        SELECT d.id, d.title, d.category, d.outline, d.content, d.helpful_count, d.unhelpful_count,
+               1.0 AS score,
+               COALESCE(ARRAY_AGG(t.name) FILTER (WHERE t.name IS NOT NULL), '{{}}') as tags
+        FROM documents d
+        LEFT JOIN document_tags dt ON d.id = dt.document_id
+        LEFT JOIN tags t ON dt.tag_id = t.id
+        WHERE d.title ILIKE :exact_query {cat_filter_clause}
+        GROUP BY d.id
+        ORDER BY d.id DESC
+        LIMIT :top_k
+    """)
+
+
+def exact_search_query(query: str, top_k: int, category_filter: Optional[str] = None):
+    params = {"exact_query": f"%{query}%", "top_k": top_k}
+    return _exact_sql(_with_category(params, category_filter)), params
+
+
+def exact_search(conn, query: str, top_k: int, category_filter: Optional[str] = None):
+    sql, params = exact_search_query(query, top_k, category_filter)
+    return conn.execute(sql, params).fetchall()
+
+
+async def aexact_search(conn, query: str, top_k: int, category_filter: Optional[str] = None):
+    sql, params = exact_search_query(query, top_k, category_filter)
+    return (await conn.execute(sql, params)).fetchall()
+
+
+SET_EF_SEARCH_SQL = text("SELECT set_config('hnsw.ef_search', :ef, true)")
+
+
+_POOLING_SQL = {
+    "max": "MAX(sim)",
+    "sum": "MAX(sim) + :chunk_sum_weight * (SUM(sim) - MAX(sim))",
+}
+
+
+def _doc_hits_sql(cat_filter_clause: str, storage: str) -> str:
+    if storage == "full":
+        return f"""
+            -- 1. 候選階段：純向量距離排序，可走 HNSW 索引
+            SELECT d.id, d.embedding <=> CAST(:query_vec AS vector) AS distance
+            FROM documents d
+            WHERE d.embedding IS NOT NULL {cat_filter_clause}
+            ORDER BY d.embedding <=> CAST(:query_vec AS vector)
+            LIMIT :candidate_k"""
+    return f"""
+            -- 1. 候選階段：壓縮索引取粗略候選，再用 float32 向量精確重排
+            SELECT coarse.id, coarse.embedding <=> CAST(:query_vec AS vector) AS distance
+            FROM (
+                SELECT d.id, d.embedding
+                FROM documents d
+                WHERE d.embedding IS NOT NULL {cat_filter_clause}
+                ORDER BY {coarse_order_by("d", storage)}
+                LIMIT :coarse_k
+            ) coarse
+            ORDER BY distance
+            LIMIT :candidate_k"""
+
+
+def _chunk_hits_sql(storage: str) -> str:
+    if storage == "full":
+        return """
+            -- 1b. 內文區塊候選 (區塊自己的 HNSW 索引)
+            SELECT c.document_id, 1 - (c.embedding <=> CAST(:query_vec AS vector)) AS sim
+            FROM document_chunks c
+            ORDER BY c.embedding <=> CAST(:query_vec AS vector)
+            LIMIT :chunk_k"""
+    return f"""
+            -- 1b. 內文區塊候選 (壓縮索引粗選 + 精確重排)
+            SELECT coarse.document_id, 1 - (coarse.embedding <=> CAST(:query_vec AS vector)) AS sim
+            FROM (
+                SELECT c.document_id, c.embedding
+                FROM document_chunks c
+                ORDER BY {coarse_order_by("c", storage)}
+                LIMIT :chunk_coarse_k
+            ) coarse
+            ORDER BY sim DESC
+            LIMIT :chunk_k"""
+
+
+@lru_cache(maxsize=None)
+def _smart_sql(with_category: bool, with_chunks: bool = False, pooling: str = "max", storage: str = "full"):
+    cat_filter_clause = _category_clause(with_category)
+    doc_hits = _doc_hits_sql(cat_filter_clause, storage)
+    if with_chunks:
+        # 區塊候選不在這裡過濾分類 (會讓 HNSW 用不上)，分類在 scored 階段再篩
+        candidates = f"""doc_hits AS MATERIALIZED ({doc_hits}
+        ),
+        chunk_hits AS MATERIALIZED ({_chunk_hits_sql(storage)}
+        ),
+        chunk_docs AS (
+            SELECT document_id AS id, {_POOLING_SQL[pooling]} AS sim
+            FROM chunk_hits
+            GROUP BY document_id
+        ),
+        candidates AS (
+            -- 文件向量與區塊 pooling 取較相近者 (以距離表示，沿用下方公式；GREATEST 會忽略 NULL)
+            SELECT COALESCE(h.id, cd.id) AS id,
+                   1 - GREATEST(1 - h.distance, cd.sim) AS distance
+            FROM doc_hits h
+            FULL OUTER JOIN chunk_docs cd ON cd.id = h.id
+        ),"""
+    else:
+        candidates = f"""candidates AS MATERIALIZED ({doc_hits}
+        ),"""
+    return _scored_sql(candidates, "WHERE d.category = :cat_filter" if with_chunks and with_category else "")
+
+
+def _scored_sql(candidates: str, where_clause: str = ""):
+    """候選 (id, distance) -> 混合加權分數 -> 取 top_k -> 撈標籤"""
+    return text(f"""
+        WITH {candidates}
+        scored AS (
+            SELECT d.id, d.title, d.category, d.outline, d.content, d.helpful_count, d.unhelpful_count,
+                   c.distance,
+                   LEAST(
+                        (
+                            -- 1. 基礎向量分數
+                            (1 - c.distance) +
+
+                            -- 2. 分類加分 (0.3)
+                            (CASE WHEN d.category ILIKE :query THEN 0.3 ELSE 0 END) +
+
+                            -- 3. 標題加分 (0.1)
+                            (CASE WHEN d.title ILIKE :exact_query THEN 0.1 ELSE 0 END) +
+
+                            -- 4. 標籤加分 (0.4)：文件標籤 (小寫) 與「查詢包含的標籤」有交集
+                            (CASE WHEN d.tag_names && CAST(:matched_tags AS TEXT[]) THEN 0.4 ELSE 0 END)
+                        ),
+                        1.0
+                   ) AS score
+            FROM candidates c
+            JOIN documents d ON d.id = c.id
+            {where_clause}
+            ORDER BY score DESC, c.distance
+            LIMIT :top_k
+        )
+        -- 2. 重排階段：只替最後回傳的文件撈標籤
+        SELECT s.*,
+               COALESCE((
+                    SELECT ARRAY_AGG(t.name)
+                    FROM document_tags dt JOIN tags t ON dt.tag_id = t.id
+                    WHERE dt.document_id = s.id
+               ), '{{}}') AS tags
+        FROM scored s
+        ORDER BY s.score DESC, s.distance
+    """)
+
+
+def smart_search_query(query: str, query_vec: str, matched_tags: List[str], top_k: int,
+                       category_filter: Optional[str] = None,
+                       candidate_k: Optional[int] = None, ef_search: Optional[int] = None,
+                       use_chunks: bool = SEARCH_USE_CHUNKS, storage: Optional[str] = None):
+    """回傳 (ef_search 參數, SQL, 參數)"""
+    storage = resolve_storage(storage)
+    candidate_k, ef_search = resolve_candidate_params(top_k, candidate_k, ef_search)
+    params = {
+        "query": query,
+        "exact_query": f"%{query}%",
+        "matched_tags": list(matched_tags),
+        "query_vec": query_vec,
+        "candidate_k": candidate_k,
+        "top_k": top_k,
+    }
+    pooling = CHUNK_POOLING if CHUNK_POOLING in _POOLING_SQL else "max"
+    if use_chunks:
+        params["chunk_k"] = max(SEARCH_CHUNK_K, candidate_k)
+        ef_search = max(ef_search, params["chunk_k"])
+        if pooling == "sum":
+            params["chunk_sum_weight"] = CHUNK_SUM_WEIGHT
+    if storage != "full":
+        # 粗略候選數同樣受限於 ef_search 上限 (HNSW 一次最多回傳 ef_search 筆)
+        params["coarse_k"] = min(candidate_k * VECTOR_RERANK_FACTOR, HNSW_EF_SEARCH_MAX)
+        ef_search = max(ef_search, params["coarse_k"])
+        if use_chunks:
+            params["chunk_coarse_k"] = min(params["chunk_k"] * VECTOR_RERANK_FACTOR, HNSW_EF_SEARCH_MAX)
+            ef_search = max(ef_search, params["chunk_coarse_k"])
+    ef_search = min(ef_search, HNSW_EF_SEARCH_MAX)
+    sql = _smart_sql(_with_category(params, category_filter), use_chunks,
+                     pooling if use_chunks else "max", storage)
+    return {"ef": str(ef_search)}, sql, params
+
+
+def smart_search(conn, query: str, query_vec: str, matched_tags: List[str], top_k: int,
+                 category_filter: Optional[str] = None,
+                 candidate_k: Optional[int] = None, ef_search: Optional[int] = None,
+                 use_chunks: bool = SEARCH_USE_CHUNKS, storage: Optional[str] = None):
+    """
+    matched_tags: 被查詢字串包含的標籤 (小寫)，由 TagMatcher 事先算好。
+    conn 必須在 transaction 內 (engine.begin())，SET LOCAL 才會只影響這次查詢。
+    """
+    ef_params, sql, params = smart_search_query(query, query_vec, matched_tags, top_k,
+                                                category_filter, candidate_k, ef_search,
+                                                use_chunks, storage)
+    conn.execute(SET_EF_SEARCH_SQL, ef_params)
+    return conn.execute(sql, params).fetchall()
+
+
+async def asmart_search(conn, query: str, query_vec: str, matched_tags: List[str], top_k: int,
+                        category_filter: Optional[str] = None,
+                        candidate_k: Optional[int] = None, ef_search: Optional[int] = None,
+                        use_chunks: bool = SEARCH_USE_CHUNKS, storage: Optional[str] = None):
+    """非同步版本：conn 為 AsyncConnection，同樣必須在 transaction 內 (async_engine.begin())"""
+    ef_params, sql, params = smart_search_query(query, query_vec, matched_tags, top_k,
+                                                category_filter, candidate_k, ef_search,
+                                                use_chunks, storage)
+    await conn.execute(SET_EF_SEARCH_SQL, ef_params)
+    return (await conn.execute(sql, params)).fetchall()
+
+
+# ==========================================
+# 混合檢索 (關鍵字 + 向量，RRF 融合)
+# ==========================================
+@lru_cache(maxsize=None)
+def _lexical_sql(with_category: bool):
+    # ts_rank 正規化 1：除以 1 + log(文件長度)，長文不會因為字多就佔優勢
+    return text(f"""
+        SELECT d.id
+        FROM documents d
+        WHERE d.lexical @@ CAST(:lex_query AS tsquery) {_category_clause(with_category)}
+        ORDER BY ts_rank(d.lexical, CAST(:lex_query AS tsquery), 1) DESC, d.id DESC
+        LIMIT :lexical_k
+    """)
+
+
+def lexical_search_query(query: str, category_filter: Optional[str] = None,
+                         lexical_k: int = SEARCH_LEXICAL_K):
+    """查詢沒有可用的 token 時回傳 None"""
+    lex_query = tsquery_literal(query)
+    if lex_query is None:
+        return None
+    params = {"lex_query": lex_query, "lexical_k": lexical_k}
+    return _lexical_sql(_with_category(params, category_filter)), params
+
+
+@lru_cache(maxsize=None)
+def _by_ids_sql():
+    return _scored_sql("""candidates AS (
+            SELECT d.id, COALESCE(d.embedding <=> CAST(:query_vec AS vector), 1) AS distance
+            FROM documents d
+            WHERE d.id = ANY(CAST(:ids AS INT[]))
+        ),""")
+
+
+def by_ids_query(query: str, query_vec: str, matched_tags: List[str], ids: List[int]):
+    """指定文件的 score (與智能模式相同公式) + 標籤"""
+    params = {"query": query, "exact_query": f"%{query}%", "matched_tags": list(matched_tags),
+              "query_vec": query_vec, "ids": list(ids), "top_k": len(ids)}
+    return _by_ids_sql(), params
+
+
+@lru_cache(maxsize=None)
+def _candidates_sql(with_category: bool):
+    return _scored_sql("""candidates AS (
+            SELECT * FROM unnest(CAST(:cand_ids AS INT[]), CAST(:cand_distances AS FLOAT8[])) AS c(id, distance)
+        ),""", "WHERE d.category = :cat_filter" if with_category else "")
+
+
+def candidates_query(query: str, matched_tags: List[str], top_k: int,
+                     candidates: List[Tuple[int, float]], category_filter: Optional[str] = None):
+    """外部算好的候選 (doc_id, cosine 距離) -> 與智能模式相同的加權分數 + 標籤"""
+    params = {"query": query, "exact_query": f"%{query}%", "matched_tags": list(matched_tags),
+              "cand_ids": [c[0] for c in candidates], "cand_distances": [c[1] for c in candidates],
+              "top_k": top_k}
+    return _candidates_sql(_with_category(params, category_filter)), params
+
+
+async def _aann_search(async_engine, ann, query: str, query_vec: str, matched_tags: List[str], top_k: int,
+                       category_filter: Optional[str], candidate_k: Optional[int], use_chunks: bool):
+    """索引在這段期間變得不可用時回傳 None"""
+    candidate_k, _ = resolve_candidate_params(top_k, candidate_k)
+    category = category_filter if category_filter and category_filter != "全部" else None
+    pooling = CHUNK_POOLING if CHUNK_POOLING in _POOLING_SQL else "max"
+    # numpy 的矩陣運算會釋放 GIL，丟到 thread 執行不會卡住 event loop
+    candidates = await asyncio.to_thread(ann.candidates, json.loads(query_vec), candidate_k, category,
+                                         use_chunks, max(SEARCH_CHUNK_K, candidate_k), pooling, CHUNK_SUM_WEIGHT)
+    if candidates is None:
+        return None
+    if not candidates:
+        return []
+    async with async_engine.connect() as conn:
+        return (await conn.execute(*candidates_query(query, matched_tags, top_k, candidates,
+                                                      category_filter))).fetchall()
+
+
+def rrf_fuse(rankings: List[List[int]], k: int = RRF_K) -> List[int]:
+    """Reciprocal Rank Fusion：每條路的第 r 名得 1 / (k + r)，加總後排序 (同分依先出現者)"""
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, 1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return sorted(scores, key=lambda doc_id: -scores[doc_id])
+
+
+async def ahybrid_search(async_engine, query: str, prepare: Callable[[], Awaitable[Tuple[str, List[str]]]],
+                         top_k: int, category_filter: Optional[str] = None,
+                         candidate_k: Optional[int] = None, ef_search: Optional[int] = None,
+                         use_lexical: bool = SEARCH_LEXICAL, use_chunks: bool = SEARCH_USE_CHUNKS,
+                         ann=None):
+    """
+    prepare: async 函式，回傳 (query_vec, matched_tags)；在向量那條路裡等待，
+    關鍵字檢索不需要查詢向量，所以不必等 embedding 就先送出。
+    兩條路各用一條連線同時執行；use_lexical=False 時等同單純的智能模式。
+    ann: ann_index.AnnMirror，可用時向量候選改由行程內索引提供。
+    """
+    lexical = lexical_search_query(query, category_filter) if use_lexical else None
+    depth = max(top_k, SEARCH_FUSION_DEPTH) if lexical else top_k
+
+    async def vector_leg():
+        query_vec, matched_tags = await prepare()
+        if ann is not None:
+            rows = await _aann_search(async_engine, ann, query, query_vec, matched_tags, depth,
+                                      category_filter, candidate_k, use_chunks)
+            if rows is not None:
+                return query_vec, matched_tags, rows
+            ann.fallbacks += 1
+        async with async_engine.begin() as conn:
+            rows = await asmart_search(conn, query, query_vec, matched_tags, depth, category_filter,
+                                       candidate_k=candidate_k, ef_search=ef_search, use_chunks=use_chunks)
+        return query_vec, matched_tags, rows
+
+    async def lexical_leg():
+        if lexical is None:
+            return []
+        async with async_engine.connect() as conn:
+            return (await conn.execute(*lexical)).scalars().all()
+
+    (query_vec, matched_tags, rows), lexical_ids = await asyncio.gather(vector_leg(), lexical_leg())
+    if not lexical_ids:
+        return rows[:top_k]
+
+    order = rrf_fuse([[r.id for r in rows], lexical_ids])[:top_k]
+    by_id = {r.id: r for r in rows}
+    missing = [doc_id for doc_id in order if doc_id not in by_id]
+    if missing:
+        async with async_engine.connect() as conn:
+            extra = (await conn.execute(*by_ids_query(query, query_vec, matched_tags, missing))).fetchall()
+        by_id.update((r.id, r) for r in extra)
+    return [by_id[doc_id] for doc_id in order if doc_id in by_id]
+
+
+def refresh_tag_names(conn, doc_ids: List[int]):
+    """重新計算文件的 tag_names (小寫標籤陣列)，標籤關聯異動後都要呼叫"""
+    if not doc_ids:
+        return
+    conn.execute(text("""
+        UPDATE documents d
+        SET tag_names = COALESCE((
+            SELECT ARRAY_AGG(DISTINCT LOWER(t.name))
+            FROM document_tags dt JOIN tags t ON dt.tag_id = t.id
+            WHERE dt.document_id = d.id
+        ), '{}')
+        WHERE d.id = ANY(:ids)
+    """), {"ids": list(doc_ids)})
+
+
+def row_to_result(row) -> dict:
+    return {
+        "id": row.id,
+        "title": row.title,
+        "category": row.category,
+        "outline": row.outline,
+        "content": row.content,
+        "score": round(row.score, 4),
+        "helpful_count": row.helpful_count,
+        "unhelpful_count": row.unhelpful_count or 0,
+        "tags": row.tags,
+    }
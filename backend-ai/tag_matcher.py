@@ -0,0 +1,107 @@
+# backend-ai/tag_matcher.py
+# ==========================================
+# 標籤比對器 (Aho-Corasick)
+# ==========================================
+# 舊的標籤加分是在 SQL 裡對每一篇文件跑 `:clean_query ILIKE '%' || LOWER(tag) || '%'`，
+# 沒辦法用索引。改成每個請求只在記憶體中掃一次查詢字串，找出「被查詢包含的標籤」，
+# 再交給 SQL 用 documents.tag_names && :matched_tags (GIN 索引) 判斷。
+import os
+import threading
+import time
+from collections import deque
+from typing import Iterable, List
+
+from sqlalchemy import text
+
+TAG_MATCHER_TTL_SECONDS = float(os.getenv("TAG_MATCHER_TTL_SECONDS", "30"))
+
+
+class AhoCorasick:
+    """多字串比對自動機：一次掃描找出文字中出現的所有 pattern"""
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto = [{}]    # 每個節點的轉移表
+        self._fail = [0]     # 失敗指標
+        self._output = [[]]  # 在此節點結束的 pattern
+        self.patterns = sorted({p for p in patterns if p})
+        for pattern in self.patterns:
+            self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append(pattern)
+
+    def _build(self):
+        q = deque(self._goto[0].values())
+        while q:
+            node = q.popleft()
+            for ch, nxt in self._goto[node].items():
+                q.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+
+    def find_all(self, haystack: str) -> List[str]:
+        found = set()
+        node = 0
+        for ch in haystack:
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            if self._output[node]:
+                found.update(self._output[node])
+        return sorted(found)
+
+
+class TagMatcher:
+    """所有標籤名稱 (小寫) 的比對器，標籤異動時失效，並定期重新載入以同步其他 worker"""
+
+    def __init__(self, engine, ttl_seconds: float = TAG_MATCHER_TTL_SECONDS):
+        self.engine = engine
+        self.ttl = ttl_seconds
+        self._automaton = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.reloads = 0
+
+    def invalidate(self):
+        self._generation += 1
+        self._automaton = None
+
+    def _load(self) -> AhoCorasick:
+        with self.engine.connect() as conn:
+            names = conn.execute(text("SELECT DISTINCT LOWER(name) FROM tags")).scalars().all()
+        self.reloads += 1
+        return AhoCorasick(names)
+
+    def automaton(self) -> AhoCorasick:
+        automaton = self._automaton
+        if automaton is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                # 鎖內重新檢查：別的執行緒可能已重新載入，也可能剛被 invalidate() 清掉
+                automaton = self._automaton
+                if automaton is None or time.monotonic() - self._loaded_at > self.ttl:
+                    generation = self._generation
+                    automaton = self._load()
+                    # 載入期間又被 invalidate() 的話，這份可能是舊資料：這次照用，但不留下來
+                    if generation == self._generation:
+                        self._automaton = automaton
+                        self._loaded_at = time.monotonic()
+        return automaton
+
+    def match(self, clean_query: str) -> List[str]:
+        """回傳被查詢字串包含的所有標籤 (小寫)"""
+        return self.automaton().find_all(clean_query)
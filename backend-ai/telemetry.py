@@ -0,0 +1,247 @@
+# backend-ai/telemetry.py
+# ==========================================
+# 熱路徑計時 + Prometheus /metrics + 慢請求取樣 profiler
+# ==========================================
+# - 各階段 (搜尋的正規化 / encode / SQL / 序列化、預測的模型載入 / 建立日期 / predict、
+#   銷售上傳的解析 / 寫入) 以 `with stage("search", "encode"):` 計時，記錄在分桶直方圖
+# - GET /metrics 輸出 Prometheus 文字格式：階段耗時、各路由請求耗時、連線池狀態與等待時間
+#   (不依賴 prometheus_client；每個 worker 各自計數，目前以單一 uvicorn 行程執行)
+# - 取樣 profiler (選用：PROFILE_SLOW_MS > 0)：背景執行緒每 PROFILE_INTERVAL_MS 取一次所有執行緒的 stack，
+#   請求超過門檻時把該請求期間的樣本寫成 folded stacks (flamegraph.pl / speedscope 可直接開)。
+#   樣本包含同時間其他請求的執行緒；未啟用時不會啟動執行緒，每個請求只多一次計時與直方圖更新。
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "0"))  # 0 = 關閉
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_WINDOW_SECONDS = float(os.getenv("PROFILE_WINDOW_SECONDS", "60"))  # 樣本最多保留多久
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+
+# 秒；大於最後一個值算在 +Inf
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Iterable[str], values: Iterable, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_le(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series: Dict[tuple, list] = {}  # labels -> [各桶計數..., +Inf 計數, 總和]
+
+    def observe(self, labels: tuple, seconds: float):
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += seconds
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for labels, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += n
+                le = f'le="{_format_le(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {counts[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("retail_stage_duration_seconds", "Duration of hot-path stages inside a request.",
+                          ("route", "stage"))
+REQUEST_SECONDS = Histogram("retail_http_request_duration_seconds", "HTTP request duration by route template.",
+                            ("method", "route", "status"))
+
+
+@contextmanager
+def stage(route: str, name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe((route, name), time.perf_counter() - started)
+
+
+def observe_stage(route: str, name: str, seconds: float):
+    """階段不在同一段程式碼內 (例如 threadpool 裡量到的時間) 時直接記錄"""
+    STAGE_SECONDS.observe((route, name), seconds)
+
+
+# ==========================================
+# 連線池 (db.pool_stats) -> gauge + 等待時間直方圖
+# ==========================================
+def render_pool_stats(pools: Dict[str, dict]) -> List[str]:
+    from db import WAIT_BUCKETS_MS
+
+    gauges = (("pool_size", "Configured pool size."),
+              ("checked_out", "Connections currently in use."),
+              ("checked_in", "Idle connections in the pool."),
+              ("overflow", "Connections opened beyond pool_size."),
+              ("timeouts", "Checkouts that timed out waiting for a connection."))
+    lines = []
+    for key, doc in gauges:
+        name = f"retail_db_pool_{key}" + ("_total" if key == "timeouts" else "")
+        lines += [f"# HELP {name} {doc}", f"# TYPE {name} {'counter' if key == 'timeouts' else 'gauge'}"]
+        lines += [f'{name}{{pool="{pool}"}} {stats.get(key, 0)}' for pool, stats in pools.items()]
+
+    name = "retail_db_pool_wait_seconds"
+    lines += [f"# HELP {name} Time spent waiting to check out a connection.", f"# TYPE {name} histogram"]
+    bounds = [b / 1000 for b in WAIT_BUCKETS_MS] + [float("inf")]
+    for pool, stats in pools.items():
+        if "histogram" not in stats:
+            continue
+        cumulative = 0
+        for bound, n in zip(bounds, stats["histogram"].values()):
+            cumulative += n
+            lines.append(f'{name}_bucket{{pool="{pool}",le="{_format_le(bound)}"}} {cumulative}')
+        lines.append(f'{name}_sum{{pool="{pool}"}} {stats["total_wait_seconds"]}')
+        lines.append(f'{name}_count{{pool="{pool}"}} {cumulative}')
+    return lines
+
+
+def render(extra: Iterable[str] = ()) -> str:
+    lines = STAGE_SECONDS.render() + REQUEST_SECONDS.render() + list(extra)
+    return "\n".join(lines) + "\n"
+
+
+# ==========================================
+# 取樣 profiler
+# ==========================================
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py", "base_events.py")
+
+
+class SamplingProfiler:
+    def __init__(self, interval_ms: float = PROFILE_INTERVAL_MS, window_seconds: float = PROFILE_WINDOW_SECONDS,
+                 out_dir: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.interval = interval_ms / 1000.0
+        self.out_dir = out_dir
+        self.max_files = max_files
+        self._samples = deque(maxlen=max(1, int(window_seconds / self.interval)))  # (時間, [folded stack])
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.dumps = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        self._stopping.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join(timeout)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = []
+            for ident, frame in sys._current_frames().items():
+                if ident == me or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue  # 自己與閒置 (等待中) 的執行緒
+                funcs = []
+                while frame is not None:
+                    code = frame.f_code
+                    funcs.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                funcs.append(names.get(ident, str(ident)))
+                stacks.append(";".join(reversed(funcs)))
+            self._samples.append((time.perf_counter(), stacks))
+
+    def dump(self, started: float, finished: float, label: str) -> Optional[str]:
+        """把 [started, finished] 期間的樣本寫成 folded stacks，回傳檔案路徑"""
+        folded = Counter(s for t, stacks in list(self._samples) if started <= t <= finished for s in stacks)
+        if not folded:
+            return None
+        now = time.time()
+        name = (f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}{int(now * 1000) % 1000:03d}-"
+                f"{re.sub(r'[^0-9A-Za-z]+', '_', label).strip('_')}.folded")
+        path = os.path.join(self.out_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in folded.most_common():
+                f.write(f"{stack} {n}\n")
+        self.dumps += 1
+        # 只保留最新的 max_files 個
+        files = sorted(os.listdir(self.out_dir))
+        for old in files[:max(0, len(files) - self.max_files)]:
+            os.remove(os.path.join(self.out_dir, old))
+        return path
+
+
+def install(app, profiler: Optional[SamplingProfiler] = None, slow_ms: float = PROFILE_SLOW_MS,
+            exclude: Tuple[str, ...] = ("/metrics",)):
+    """請求耗時 middleware；profiler 不為 None 時，超過 slow_ms 的請求輸出 flamegraph 樣本"""
+    from fastapi.concurrency import run_in_threadpool
+
+    @app.middleware("http")
+    async def time_requests(request, call_next):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            finished = time.perf_counter()
+            route = request.scope.get("route")
+            path = getattr(route, "path", "unmatched")  # 路由樣板，避免 /documents/{id} 每個 id 一條序列
+            if path not in exclude:
+                REQUEST_SECONDS.observe((request.method, path, str(status)), finished - started)
+                if profiler is not None and (finished - started) * 1000 >= slow_ms:
+                    label = f"{request.method} {path} {int((finished - started) * 1000)}ms"
+                    dumped = await run_in_threadpool(profiler.dump, started, finished, label)
+                    if dumped:
+                        print(f"🐢 慢請求 {label}，取樣已寫入 {dumped}")
+
+    return time_requests
+
+
+def create_profiler(slow_ms: float = PROFILE_SLOW_MS) -> Optional[SamplingProfiler]:
+    return SamplingProfiler() if slow_ms > 0 else None
+
+
+def timed(route: str, name: str) -> Callable:
+    """裝飾器版本的 stage()，例如包住 ModelRegistry 的 loader"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(route, name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
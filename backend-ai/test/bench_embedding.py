@@ -0,0 +1,64 @@
+# backend-ai/test/bench_embedding.py
+# 比較「每個請求各自 encode」與「微批次 EmbeddingBatcher」在並發下的 QPS 與延遲
+#
+# 用法: python test/bench_embedding.py --requests 2000 --concurrency 32
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_service import EmbeddingBatcher  # noqa: E402
+
+QUERIES = ["ubereats", "linepay", "出單機", "網路設定", "ocard 會員點數", "發票機卡紙",
+           "掃碼點餐沒有反應", "退貨政策", "營業時間", "運費說明"]
+
+
+def run(label, encode_fn, n_requests, concurrency):
+    latencies = []
+
+    def one(i):
+        started = time.perf_counter()
+        encode_fn(f"{QUERIES[i % len(QUERIES)]} {i}")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(n_requests)))
+    elapsed = time.perf_counter() - started
+
+    lat_ms = np.array(latencies) * 1000.0
+    print(f"{label:<12} QPS={n_requests / elapsed:8.1f}  "
+          f"p50={np.percentile(lat_ms, 50):7.2f}ms  p99={np.percentile(lat_ms, 99):7.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print("🛠 正在載入模型...")
+    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+    model.encode("warm up", normalize_embeddings=True)
+
+    run("per-request", lambda t: model.encode(t, normalize_embeddings=True),
+        args.requests, args.concurrency)
+
+    batcher = EmbeddingBatcher(model, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms)
+    batcher.start()
+    run("batched", batcher.encode, args.requests, args.concurrency)
+    batcher.stop()
+
+    stats = batcher.stats()
+    print(f"平均 batch 大小: {stats['avg_batch_size']}，最大佇列深度: {stats['max_queue_depth']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# backend-ai/test/bench_embedding_backends.py
+# 比較各 Embedding 後端的冷啟動時間、記憶體 (RSS) 與吞吐量，以及 ONNX 向量與 torch 的誤差
+# 每個後端在獨立的子程序中量測，import 與模型載入的成本不會互相影響
+#
+# 先匯出 ONNX: python embedding_backend.py export
+# 用法: python test/bench_embedding_backends.py --backends lazy torch onnx --sentences 512
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+QUERIES = ["ubereats", "linepay", "出單機", "網路設定", "ocard 會員點數", "發票機卡紙",
+           "掃碼點餐沒有反應", "退貨政策", "營業時間", "運費說明",
+           "營業日結帳報表在哪裡下載？需要店長權限才能看到每日的銷售明細與支付方式統計。"]
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def child(backend: str, n_sentences: int, out_path: str):
+    """子程序：量測單一後端，結果寫成 JSON，向量寫成 .npy"""
+    started = time.perf_counter()
+    from embedding_backend import create_embedding_model
+
+    if backend == "lazy":
+        # 只建立 wrapper，不載入模型：代表不需要搜尋功能的 worker 的啟動成本
+        model = create_embedding_model(load="lazy")
+        result = {"startup_seconds": time.perf_counter() - started, "rss_mb": rss_mb(),
+                  "loaded": model.loaded}
+    else:
+        model = create_embedding_model(backend, load="eager")
+        loaded_at = time.perf_counter()
+        model.encode([QUERIES[0]], normalize_embeddings=True)
+        first_at = time.perf_counter()
+
+        sentences = [f"{QUERIES[i % len(QUERIES)]} {i}" for i in range(n_sentences)]
+        vectors = model.encode(sentences, batch_size=64, normalize_embeddings=True, show_progress_bar=False)
+        elapsed = time.perf_counter() - first_at
+        np.save(out_path + ".npy", np.asarray(vectors, dtype=np.float32))
+        result = {
+            "startup_seconds": loaded_at - started,
+            "first_encode_ms": (first_at - loaded_at) * 1000,
+            "rss_mb": rss_mb(),
+            "sentences_per_sec": n_sentences / elapsed,
+        }
+    with open(out_path, "w") as f:
+        json.dump(result, f)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["lazy", "torch", "onnx"])
+    parser.add_argument("--sentences", type=int, default=512)
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--out", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.sentences, args.out)
+        return
+
+    from embedding_backend import cosine_rows
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in args.backends:
+            out = os.path.join(tmp, backend)
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", backend,
+                                   "--sentences", str(args.sentences), "--out", out], cwd=BACKEND_DIR)
+            if proc.returncode != 0:
+                print(f"❌ {backend} 量測失敗 (exit {proc.returncode})")
+                continue
+            with open(out) as f:
+                results[backend] = json.load(f)
+            if os.path.exists(out + ".npy"):
+                results[backend]["vectors"] = np.load(out + ".npy")
+
+    print(f"\n{'backend':<8} {'startup':>9} {'first':>9} {'RSS':>9} {'sent/s':>9}")
+    for backend, r in results.items():
+        first = f"{r['first_encode_ms']:.0f}ms" if "first_encode_ms" in r else "-"
+        speed = f"{r['sentences_per_sec']:.0f}" if "sentences_per_sec" in r else "-"
+        print(f"{backend:<8} {r['startup_seconds']:>8.2f}s {first:>9} {r['rss_mb']:>7.0f}MB {speed:>9}")
+
+    if "vectors" in results.get("torch", {}):
+        for backend, r in results.items():
+            if backend != "torch" and "vectors" in r:
+                cos = cosine_rows(results["torch"]["vectors"], r["vectors"])
+                print(f"{backend} vs torch: cosine 平均 {cos.mean():.5f}，最低 {cos.min():.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# backend-ai/test/bench_forecast.py
+# 完整 Prophet vs fast-path (NumPy 向量化) 的準確度與延遲比較
+#
+# 以 sales_mock.csv 為底，產生多個商品 (縮放 + 雜訊)，保留最後 N 天當驗證集。
+# 用法: python test/bench_forecast.py --csv ../sales_mock.csv --skus 20 --holdout 28
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from prophet import Prophet
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fast_forecast import FastForecaster, extract  # noqa: E402
+
+
+def make_skus(csv_path, n_skus, rng):
+    base = pd.read_csv(csv_path, parse_dates=['transaction_date'])
+    base = base.groupby('transaction_date', as_index=False)['quantity'].sum()
+    skus = {}
+    for i in range(n_skus):
+        scale = rng.uniform(0.2, 3.0)
+        noise = rng.normal(0, 5 * scale, len(base))
+        y = np.maximum(0, base['quantity'].to_numpy() * scale + noise)
+        skus[f"sku_{i:04d}"] = pd.DataFrame({'ds': base['transaction_date'], 'y': y})
+    return skus
+
+
+def errors(pred, actual):
+    mae = np.mean(np.abs(pred - actual))
+    mape = np.mean(np.abs(pred - actual) / np.maximum(actual, 1)) * 100
+    return mae, mape
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--csv", default=os.path.join(os.path.dirname(__file__), "..", "..", "sales_mock.csv"))
+    parser.add_argument("--skus", type=int, default=20)
+    parser.add_argument("--holdout", type=int, default=28)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    skus = make_skus(args.csv, args.skus, rng)
+
+    print(f"🔄 訓練 {len(skus)} 個 Prophet 模型...")
+    models, holdouts = {}, {}
+    for pid, df in skus.items():
+        train, test = df.iloc[:-args.holdout], df.iloc[-args.holdout:]
+        m = Prophet(daily_seasonality=True)
+        m.add_country_holidays(country_name='TW')
+        m.fit(train)
+        models[pid], holdouts[pid] = m, test
+
+    # ---- 完整 Prophet ----
+    prophet_pred, started = {}, time.perf_counter()
+    for pid, m in models.items():
+        prophet_pred[pid] = m.predict(holdouts[pid][['ds']])['yhat'].to_numpy()
+    prophet_seconds = time.perf_counter() - started
+
+    # ---- fast path：先抽參數 (一次性)，再一次向量化預測全部商品 ----
+    started = time.perf_counter()
+    compact = [(pid, extract(m)) for pid, m in models.items()]
+    extract_seconds = time.perf_counter() - started
+
+    start_date = next(iter(holdouts.values()))['ds'].iloc[0]
+    started = time.perf_counter()
+    fast = FastForecaster().forecast(compact, args.holdout, today=start_date)
+    fast_seconds = time.perf_counter() - started
+
+    rows = []
+    for pid, test in holdouts.items():
+        actual = test['y'].to_numpy()
+        p_mae, p_mape = errors(prophet_pred[pid], actual)
+        f_mae, f_mape = errors(fast[pid]['yhat'].to_numpy(), actual)
+        diff = np.max(np.abs(fast[pid]['yhat'].to_numpy() - prophet_pred[pid]))
+        rows.append((p_mae, p_mape, f_mae, f_mape, diff))
+    r = np.array(rows)
+
+    n = len(models)
+    print("\n============ 準確度 (驗證集) ============")
+    print(f"Prophet   MAE={r[:, 0].mean():8.3f}  MAPE={r[:, 1].mean():6.2f}%")
+    print(f"fast-path MAE={r[:, 2].mean():8.3f}  MAPE={r[:, 3].mean():6.2f}%")
+    print(f"fast 與 Prophet yhat 最大差異: {r[:, 4].max():.6f}")
+    print("\n============ 延遲 ============")
+    print(f"Prophet   {prophet_seconds * 1000 / n:9.2f} ms/SKU (共 {prophet_seconds:.2f}s)")
+    print(f"fast-path {fast_seconds * 1000 / n:9.3f} ms/SKU (共 {fast_seconds * 1000:.1f}ms，一次批次)")
+    print(f"參數抽取  {extract_seconds * 1000 / n:9.2f} ms/SKU (每個模型版本只做一次)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+# backend-ai/test/load_test.py
+# API 壓力測試：固定並發數持續打 /search、/config/all、feedback，統計吞吐量與延遲分佈。
+# 結束時一併抓 /metrics/db (連線池等待時間)，可存成 JSON 與另一次結果比較 (例如改版前後)。
+# 需要 httpx (pip install httpx)。
+#
+# 用法:
+#   uvicorn main:app --workers 1            (另一個終端機，連本機 Postgres)
+#   python test/load_test.py --url http://localhost:8000 --concurrency 64 --duration 30 --out after.json
+#   python test/load_test.py ... --baseline before.json
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+QUERIES = ["掃碼點餐", "Uber Eats 設定", "發票 列印", "會員 點數", "外送 平台", "支付 設定", "退款", "印表機 斷線"]
+
+
+def make_requests(doc_ids):
+    """(名稱, 權重, 產生 request 參數的函式)"""
+    plan = [
+        ("search", 6, lambda: ("POST", "/search", {"query": random.choice(QUERIES), "top_k": 5})),
+        ("config", 3, lambda: ("GET", "/config/all", None)),
+    ]
+    if doc_ids:
+        plan.append(("feedback", 1, lambda: ("POST", f"/documents/{random.choice(doc_ids)}/feedback",
+                                             {"action": random.choice(["helpful", "unhelpful"])})))
+    return plan
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def worker(client, plan, deadline, latencies, errors):
+    names = [p[0] for p in plan]
+    weights = [p[1] for p in plan]
+    builders = {p[0]: p[2] for p in plan}
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        method, path, body = builders[name]()
+        started = time.perf_counter()
+        try:
+            resp = await client.request(method, path, json=body)
+            if resp.status_code >= 400:
+                errors[name] += 1
+                continue
+        except httpx.HTTPError:
+            errors[name] += 1
+            continue
+        latencies[name].append((time.perf_counter() - started) * 1000)
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        doc_ids = []
+        if not args.no_feedback:
+            resp = await client.post("/search", json={"query": "", "search_type": "exact", "top_k": 50})
+            doc_ids = [r["id"] for r in resp.json().get("results", [])]
+        plan = make_requests(doc_ids)
+
+        # 暖機 (模型、快取、連線池)
+        warm_deadline = time.perf_counter() + args.warmup
+        await asyncio.gather(*[worker(client, plan, warm_deadline, defaultdict(list), defaultdict(int))
+                               for _ in range(min(4, args.concurrency))])
+
+        latencies, errors = defaultdict(list), defaultdict(int)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        await asyncio.gather(*[worker(client, plan, deadline, latencies, errors) for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+
+        try:
+            db_metrics = (await client.get("/metrics/db")).json()
+        except (httpx.HTTPError, ValueError):
+            db_metrics = None
+
+    total = sum(len(v) for v in latencies.values())
+    report = {
+        "url": args.url,
+        "concurrency": args.concurrency,
+        "duration_seconds": round(elapsed, 2),
+        "requests": total,
+        "errors": sum(errors.values()),
+        "throughput_rps": round(total / elapsed, 1),
+        "endpoints": {
+            name: {
+                "requests": len(vals),
+                "errors": errors[name],
+                "rps": round(len(vals) / elapsed, 1),
+                "p50_ms": round(percentile(vals, 0.50), 2),
+                "p95_ms": round(percentile(vals, 0.95), 2),
+                "p99_ms": round(percentile(vals, 0.99), 2),
+            }
+            for name, vals in sorted(latencies.items())
+        },
+        "db": db_metrics,
+    }
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"\n============ 壓測結果 (並發 {report['concurrency']}, {report['duration_seconds']}s) ============")
+    line = f"總吞吐量: {report['throughput_rps']} req/s  (請求 {report['requests']}, 錯誤 {report['errors']})"
+    if baseline:
+        ratio = report['throughput_rps'] / baseline['throughput_rps'] if baseline['throughput_rps'] else 0
+        line += f"  | 基準 {baseline['throughput_rps']} req/s -> x{ratio:.2f}"
+    print(line)
+    for name, ep in report["endpoints"].items():
+        row = f"  {name:9s} {ep['rps']:8.1f} req/s  p50={ep['p50_ms']:7.2f}ms  p95={ep['p95_ms']:7.2f}ms  p99={ep['p99_ms']:7.2f}ms"
+        base = (baseline or {}).get("endpoints", {}).get(name)
+        if base:
+            row += f"  | 基準 p95={base['p95_ms']:.2f}ms"
+        print(row)
+    if report.get("db"):
+        for kind, stats in report["db"].items():
+            print(f"  連線池[{kind}] 取得連線 avg={stats.get('avg_wait_ms')}ms p99<={stats.get('p99_wait_ms')}ms "
+                  f"max={stats.get('max_wait_ms')}ms timeouts={stats.get('timeouts')}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--no-feedback", action="store_true", help="不送 feedback (避免改動計數)")
+    parser.add_argument("--out", help="結果存成 JSON")
+    parser.add_argument("--baseline", help="與先前存下的 JSON 比較")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 已寫入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# backend-ai/test/test_ann_index.py
+# 行程內向量索引的快照建立 (不需要資料庫：以假的 engine 取代 Postgres)
+# 執行方式: python -m pytest backend-ai/test/test_ann_index.py
+import os
+import sys
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ann_index  # noqa: E402
+
+
+class FakeResult:
+    def __init__(self, value=None):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def scalars(self):
+        return SimpleNamespace(all=lambda: [])
+
+
+class FakeConn:
+    def execution_options(self, **_):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @contextmanager
+    def begin(self):
+        yield self
+
+    def execute(self, *_args, **_kwargs):
+        return FakeResult(0)
+
+
+class FakeEngine:
+    def connect(self):
+        return FakeConn()
+
+    @contextmanager
+    def begin(self):
+        yield FakeConn()
+
+
+def _row(row_id, group_id, category, seed):
+    vec = np.random.default_rng(seed).standard_normal(ann_index.VECTOR_DIM).astype(np.float32)
+    return SimpleNamespace(id=row_id, group_id=group_id, category=category, vec=vec.tolist())
+
+
+def _build(tmp_path, monkeypatch, rows_by_table):
+    monkeypatch.setattr(ann_index, "_fetch_rows", lambda conn, source, ids=None: iter(rows_by_table[source.table]))
+    meta = ann_index.build_snapshot(FakeEngine(), str(tmp_path))
+    path = os.path.join(str(tmp_path), meta["version"])
+    return meta, {table: ann_index.MirrorIndex(ann_index.SourceSnapshot(os.path.join(path, table)))
+                  for table in rows_by_table}
+
+
+def test_build_snapshot_with_empty_sources(tmp_path, monkeypatch):
+    meta, indexes = _build(tmp_path, monkeypatch, {"documents": [], "document_chunks": []})
+
+    assert meta["sources"]["documents"] == {"count": 0, "nlist": 1}
+    assert ann_index.current_snapshot(str(tmp_path)) == meta["version"]
+    index = indexes["documents"]
+    assert len(index.snapshot) == 0
+    assert index.snapshot.centroids.shape == (1, ann_index.VECTOR_DIM)
+    ids, groups, sims = index.search(np.ones(ann_index.VECTOR_DIM, np.float32), k=5)
+    assert len(ids) == len(groups) == len(sims) == 0
+
+
+def test_empty_snapshot_accepts_delta_rows(tmp_path, monkeypatch):
+    _, indexes = _build(tmp_path, monkeypatch, {"documents": [], "document_chunks": []})
+    index = indexes["documents"]
+    row = _row(7, 7, "支付設定", seed=1)
+    index.apply([7], {7: (row.group_id, row.category, row.vec)})
+
+    ids, groups, _ = index.search(np.asarray(row.vec, np.float32), k=5)
+    assert ids.tolist() == [7] and groups.tolist() == [7]
+    assert index.search(np.asarray(row.vec, np.float32), k=5, category="其他")[0].tolist() == []
+
+
+def test_build_snapshot_with_only_one_source_backfilled(tmp_path, monkeypatch):
+    docs = [_row(i, i, "其他", seed=i) for i in range(1, 6)]
+    meta, indexes = _build(tmp_path, monkeypatch, {"documents": docs, "document_chunks": []})
+
+    assert meta["sources"]["documents"]["count"] == 5
+    assert meta["sources"]["document_chunks"]["count"] == 0
+    ids, _, sims = indexes["documents"].search(np.asarray(docs[2].vec, np.float32), k=1)
+    assert ids.tolist() == [3]
+    assert sims[0] > 0.99
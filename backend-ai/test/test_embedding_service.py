@@ -0,0 +1,68 @@
+# backend-ai/test/test_embedding_service.py
+# 微批次 Embedding 服務的過載處理 (以假的模型取代 SentenceTransformer)
+# 執行方式: python -m pytest backend-ai/test/test_embedding_service.py
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embedding_service import EmbeddingBatcher, EmbeddingOverloadedError  # noqa: E402
+
+
+class BlockedModel:
+    """encode 會卡住直到 release 被 set，用來把佇列塞滿"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+
+    def encode(self, texts, **_):
+        self.started.set()
+        self.release.wait(5)
+        return [np.ones(3, np.float32) for _ in texts]
+
+
+@pytest.fixture
+def full_batcher():
+    model = BlockedModel()
+    batcher = EmbeddingBatcher(model, max_batch_size=1, max_wait_ms=0, max_queue_size=1, submit_timeout_ms=20)
+    first = batcher.submit("in flight")
+    model.started.wait(5)
+    queued = batcher.submit("queued")
+    yield batcher, model
+    model.release.set()
+    first.result(5)
+    queued.result(5)
+    batcher.stop()
+
+
+def test_sync_submit_gives_up_after_timeout(full_batcher):
+    batcher, _ = full_batcher
+    started = time.perf_counter()
+    with pytest.raises(EmbeddingOverloadedError):
+        batcher.encode("overflow")
+    assert time.perf_counter() - started < 1
+    assert batcher.stats()["rejected"] == 1
+
+
+def test_async_encode_does_not_wait(full_batcher):
+    batcher, _ = full_batcher
+    with pytest.raises(EmbeddingOverloadedError):
+        asyncio.run(batcher.aencode("overflow"))
+
+
+def test_encode_many_cancels_already_queued_items():
+    model = BlockedModel()
+    batcher = EmbeddingBatcher(model, max_batch_size=1, max_wait_ms=0, max_queue_size=1, submit_timeout_ms=20)
+    batcher.submit("in flight")
+    model.started.wait(5)
+    with pytest.raises(EmbeddingOverloadedError):
+        batcher.encode_many(["a", "b"])
+    model.release.set()
+    batcher.stop()
+    assert batcher.stats()["items"] == 1
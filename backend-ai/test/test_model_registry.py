@@ -0,0 +1,49 @@
+# backend-ai/test/test_model_registry.py
+# 模型註冊表的記憶體估算與載入去重 (以假的 loader 取代 Prophet 模型檔)
+# 執行方式: python -m pytest backend-ai/test/test_model_registry.py
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import model_registry  # noqa: E402
+from model_registry import ModelRegistry  # noqa: E402
+
+
+def make_registry(tmp_path, product_ids, loader=None, budget_mb=1024):
+    for pid in product_ids:
+        (tmp_path / f"{pid}.cmodel").write_bytes(b"x" * 1000)
+    return ModelRegistry(model_dir=str(tmp_path), memory_budget_mb=budget_mb,
+                         loader=loader or (lambda path: object()),
+                         path_for=lambda pid, d: os.path.join(d, f"{pid}.cmodel"))
+
+
+def test_reloading_a_resident_model_does_not_double_count(tmp_path):
+    registry = make_registry(tmp_path, ["A01"])
+    registry.get("A01")
+    resident = registry._resident
+    registry._load("A01")
+    registry._load("A01")
+    assert registry._resident == resident == int(1000 * model_registry.MODEL_MEMORY_FACTOR)
+    assert len(registry._entries) == 1
+
+
+def test_warm_up_and_get_load_each_model_once(tmp_path):
+    loads = []
+
+    def slow_loader(path):
+        loads.append(path)
+        time.sleep(0.05)
+        return object()
+
+    registry = make_registry(tmp_path, ["A01", "A02"], loader=slow_loader)
+    warm = threading.Thread(target=registry.warm_up, kwargs={"default_ids": ["A01", "A02"]})
+    warm.start()
+    time.sleep(0.01)
+    registry.get("A01")
+    registry.get("A02")
+    warm.join()
+
+    assert sorted(os.path.basename(p) for p in loads) == ["A01.cmodel", "A02.cmodel"]
+    assert registry._resident == 2 * int(1000 * model_registry.MODEL_MEMORY_FACTOR)
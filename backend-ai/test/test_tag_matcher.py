@@ -0,0 +1,100 @@
+# backend-ai/test/test_tag_matcher.py
+# 標籤比對器 (Aho-Corasick + 快取失效)，不需要資料庫
+# 執行方式: python -m pytest backend-ai/test/test_tag_matcher.py
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tag_matcher import AhoCorasick, TagMatcher  # noqa: E402
+
+
+def naive(patterns, haystack):
+    return sorted({p for p in patterns if p and p in haystack})
+
+
+def test_finds_overlapping_and_nested_patterns():
+    patterns = ["he", "she", "his", "hers"]
+    assert AhoCorasick(patterns).find_all("ushers") == ["he", "hers", "she"]
+
+
+def test_cjk_and_mixed_patterns():
+    patterns = ["linepay", "出單機", "網路設定", "出單", "ocard"]
+    query = "linepay 出單機 網路設定失敗"
+    assert AhoCorasick(patterns).find_all(query) == naive(patterns, query)
+
+
+def test_matches_naive_search_after_failure_transitions():
+    patterns = ["abcd", "bcx", "cde", "aab", "b", "ab"]
+    for query in ["aabcde", "abcx", "xyz", "bbbb", "aaabcdex", ""]:
+        assert AhoCorasick(patterns).find_all(query) == naive(patterns, query), query
+
+
+def test_empty_patterns_are_ignored():
+    assert AhoCorasick(["", "ab"]).find_all("xab") == ["ab"]
+    assert AhoCorasick([]).find_all("anything") == []
+
+
+class FakeEngine:
+    def __init__(self, names):
+        self.names = names
+        self.on_load = None
+
+    def connect(self):
+        engine = self
+
+        class Conn:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, *_):
+                if engine.on_load:
+                    engine.on_load()
+                return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: list(engine.names)))
+        return Conn()
+
+
+def test_matcher_reloads_after_invalidate():
+    engine = FakeEngine(["ocard"])
+    matcher = TagMatcher(engine, ttl_seconds=3600)
+    assert matcher.match("ocard 集點") == ["ocard"]
+    assert matcher.match("ubereats") == []
+    engine.names.append("ubereats")
+    matcher.invalidate()
+    assert matcher.match("ubereats") == ["ubereats"]
+    assert matcher.reloads == 2
+
+
+def test_invalidate_while_stale_never_returns_none():
+    engine = FakeEngine(["ocard"])
+    matcher = TagMatcher(engine, ttl_seconds=3600)
+    matcher.match("x")
+    matcher._loaded_at = float("-inf")  # 已過期
+
+    class InvalidateOnAcquire:
+        """模擬：讀到過期的自動機之後、拿到鎖之前，LISTEN 通知觸發 invalidate()"""
+        def __init__(self, lock):
+            self.lock = lock
+
+        def __enter__(self):
+            matcher.invalidate()
+            return self.lock.__enter__()
+
+        def __exit__(self, *exc):
+            return self.lock.__exit__(*exc)
+
+    matcher._lock = InvalidateOnAcquire(matcher._lock)
+    assert matcher.match("ocard") == ["ocard"]
+
+
+def test_invalidate_during_load_is_not_cached():
+    engine = FakeEngine(["ocard"])
+    matcher = TagMatcher(engine, ttl_seconds=3600)
+    engine.on_load = matcher.invalidate
+    assert matcher.match("ocard") == ["ocard"]
+    engine.on_load = None
+    engine.names.append("linepay")
+    assert matcher.match("linepay") == ["linepay"]
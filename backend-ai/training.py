@@ -0,0 +1,299 @@
+# backend-ai/training.py
+# ==========================================
+# Prophet 批次訓練排程器 (Training Scheduler)
+# ==========================================
+# - 一條 SQL 撈出銷售資料 (每日彙總表 sales_daily；只訓練指定商品時只撈這些商品)，在記憶體中依商品分組 (不再每個商品各查一次)
+# - 用 ProcessPoolExecutor 平行訓練，worker 數可設定
+# - 記錄每個商品資料的 hash，資料沒變就跳過
+# - 記錄每個商品的訓練耗時 (train_state.json 每 TRAIN_STATE_SAVE_EVERY 個商品與結束時合併寫入，
+#   以檔案鎖序列化，同時執行的訓練工作不會互相覆蓋)
+# - 模型預設存成精簡模型檔 models/{product_id}.cmodel (model_format.py)；MODEL_FORMAT=pickle 維持舊的 .pkl
+# CLI (train.py) 與 API (/sales/train) 共用這個模組。
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+
+import joblib
+import pandas as pd
+from sqlalchemy import text
+
+try:
+    import fcntl
+except ImportError:  # Windows：不加鎖
+    fcntl = None
+
+from model_format import EXTENSIONS, save_compact, to_compact
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+MODEL_FORMAT = os.getenv("MODEL_FORMAT", "compact")  # compact | pickle
+STATE_FILE = "train_state.json"
+GLOBAL_MODEL_ID = "sales_model"   # 全商品合併模型 (/sales/predict 未指定商品時使用)；保留字，不可作為商品 id
+MIN_TRAIN_ROWS = 14               # 資料太少 Prophet 會報錯或不準
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+TRAIN_STATE_SAVE_EVERY = int(os.getenv("TRAIN_STATE_SAVE_EVERY", "50"))
+
+# 模型設定有變時要讓 hash 失效，否則會被誤判為「資料沒變」而跳過
+MODEL_CONFIGS = {
+    GLOBAL_MODEL_ID: {"daily_seasonality": "auto"},
+    "product": {"daily_seasonality": True},
+}
+
+
+# 商品 id 會直接組成檔名：只允許英數、底線、連字號與點 (不可以點開頭)，避免 ../ 寫到 MODEL_DIR 之外
+PRODUCT_ID_PATTERN = re.compile(r"[A-Za-z0-9_-][A-Za-z0-9_.-]{0,49}")
+
+
+class InvalidProductIdError(ValueError):
+    pass
+
+
+def validate_product_id(product_id: str, allow_global: bool = False) -> str:
+    """allow_global=True 用於模型檔 / 註冊表等內部路徑 (全商品模型與商品模型共用同一套檔名規則)"""
+    if not isinstance(product_id, str) or not PRODUCT_ID_PATTERN.fullmatch(product_id):
+        raise InvalidProductIdError(f"商品 id 不合法 (只允許英數字、_ - .，最多 50 字，不可以 . 開頭): {product_id!r}")
+    if product_id == GLOBAL_MODEL_ID and not allow_global:
+        raise InvalidProductIdError(f"商品 id {product_id!r} 保留給全商品合併模型，請改用其他 id")
+    return product_id
+
+
+def model_path(product_id: str, model_dir: str = MODEL_DIR, fmt: Optional[str] = None) -> str:
+    validate_product_id(product_id, allow_global=True)
+    return os.path.join(model_dir, f"{product_id}{EXTENSIONS[fmt or MODEL_FORMAT]}")
+
+
+def find_model(product_id: str, model_dir: str = MODEL_DIR) -> str:
+    """實際存在的模型檔：優先 .cmodel，其次舊的 .pkl；都沒有時回傳預設格式的路徑"""
+    for fmt in ("compact", "pickle"):
+        path = model_path(product_id, model_dir, fmt)
+        if os.path.exists(path):
+            return path
+    return model_path(product_id, model_dir)
+
+
+def list_models(model_dir: str = MODEL_DIR) -> Dict[str, str]:
+    """{product_id: 模型檔路徑}；同一商品兩種格式都有時以 .cmodel 為準"""
+    models = {}
+    for fmt in ("pickle", "compact"):
+        suffix = EXTENSIONS[fmt]
+        for path in sorted(glob.glob(os.path.join(model_dir, f"*{suffix}"))):
+            models[os.path.basename(path)[:-len(suffix)]] = path
+    return dict(sorted(models.items()))
+
+
+def load_sales(engine, product_ids: Optional[Iterable[str]] = None) -> pd.DataFrame:
+    """一次撈出商品的每日銷量 (同商品同日已在 sales_daily 彙總成一筆)；指定 product_ids 時只撈這些商品"""
+    where, params = "", {}
+    if product_ids is not None:
+        where, params = "WHERE product_id = ANY(:ids)", {"ids": list(product_ids)}
+    sql = text(f"""
+        SELECT product_id, transaction_date AS ds, quantity AS y
+        FROM sales_daily
+        {where}
+        ORDER BY product_id, transaction_date
+    """)
+    df = pd.read_sql(sql, engine, params=params)
+    df['ds'] = pd.to_datetime(df['ds'])
+    return df
+
+
+def data_hash(df: pd.DataFrame, config: dict) -> str:
+    h = hashlib.sha1(json.dumps(config, sort_keys=True).encode())
+    h.update(pd.util.hash_pandas_object(df[['ds', 'y']], index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def fit_and_save(product_id: str, df: pd.DataFrame, config: dict, model_dir: str = MODEL_DIR) -> dict:
+    """在子行程中執行：訓練單一模型並存檔 (必須是 top-level 函式才能被 pickle)"""
+    from prophet import Prophet
+
+    started = time.perf_counter()
+    model = Prophet(**config)
+    model.add_country_holidays(country_name='TW')  # 加入台灣的假日資訊，讓模型更準確
+    model.fit(df)
+
+    os.makedirs(model_dir, exist_ok=True)
+    fmt = MODEL_FORMAT
+    path = model_path(product_id, model_dir, fmt)
+    if fmt == "compact":
+        header = save_compact(to_compact(model), path, meta={
+            "product_id": product_id,
+            "history_rows": int(len(df)),
+            "config": config,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        })
+    else:
+        tmp_path = f"{path}.tmp"
+        joblib.dump(model, tmp_path)
+        os.replace(tmp_path, path)  # 原子替換，預測端不會讀到寫一半的檔案
+        header = None
+    # 另一種格式的舊檔要移除，否則 find_model 可能繼續讀到舊模型
+    for fmt in EXTENSIONS:
+        other = model_path(product_id, model_dir, fmt)
+        if other != path and os.path.exists(other):
+            os.remove(other)
+    return {"fit_seconds": round(time.perf_counter() - started, 3),
+            "content_sha256": header["content_sha256"] if header else None}
+
+
+class TrainingScheduler:
+    def __init__(self, engine, workers: int = TRAIN_WORKERS, model_dir: str = MODEL_DIR,
+                 force: bool = False, isolate: bool = False):
+        """isolate=True: 即使只有一個工作也在子行程訓練 (API 內使用，避免 fit 佔住 GIL)"""
+        self.engine = engine
+        self.workers = max(1, workers)
+        self.model_dir = model_dir
+        self.force = force
+        self.isolate = isolate
+        self.state_path = os.path.join(model_dir, STATE_FILE)
+
+    # ---------- 訓練狀態 (hash / 耗時) ----------
+    def load_state(self) -> Dict[str, dict]:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @contextmanager
+    def _state_lock(self):
+        os.makedirs(self.model_dir, exist_ok=True)
+        with open(f"{self.state_path}.lock", "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save_state(self, updates: Dict[str, dict]):
+        """鎖住後重新讀取最新狀態，只覆蓋這次更新的商品 (其他訓練工作寫入的結果不會被蓋掉)"""
+        if not updates:
+            return
+        with self._state_lock():
+            state = self.load_state()
+            state.update(updates)
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.state_path)
+
+    # ---------- 排程 ----------
+    def plan(self, sales: pd.DataFrame, product_ids: Optional[Iterable[str]], include_global: bool):
+        """回傳 (待訓練 [(id, df, config, hash)], 跳過清單 {id: 原因})"""
+        state = self.load_state()
+        tasks, skipped = [], {}
+
+        groups = []
+        if include_global:
+            # 全商品模型：每天一筆總銷量 (不再把各商品的資料列當成同一天的重複觀測值)
+            total = sales.groupby('ds', as_index=False, sort=True)['y'].sum()
+            groups.append((GLOBAL_MODEL_ID, total, MODEL_CONFIGS[GLOBAL_MODEL_ID]))
+        wanted = set(product_ids) if product_ids is not None else None
+        for pid, df in sales.groupby('product_id', sort=True):
+            if pid == GLOBAL_MODEL_ID:
+                continue  # 保留給全商品合併模型 (上傳時已拒絕，這裡只防舊資料)
+            if wanted is None or pid in wanted:
+                groups.append((pid, df[['ds', 'y']].reset_index(drop=True), MODEL_CONFIGS["product"]))
+        if wanted is not None:
+            for pid in wanted - set(sales['product_id'].unique()):
+                skipped[pid] = "查無銷售資料"
+            if GLOBAL_MODEL_ID in wanted:
+                skipped[GLOBAL_MODEL_ID] = "商品 id 保留給全商品合併模型，不另外訓練"
+
+        for pid, df, config in groups:
+            if not PRODUCT_ID_PATTERN.fullmatch(pid):
+                skipped[pid] = "商品 id 含不允許的字元，無法作為模型檔名"
+                continue
+            if len(df) < MIN_TRAIN_ROWS:
+                skipped[pid] = f"資料不足 ({len(df)} 筆)"
+                continue
+            digest = data_hash(df, config)
+            prev = state.get(pid, {})
+            if not self.force and prev.get("data_hash") == digest and os.path.exists(find_model(pid, self.model_dir)):
+                skipped[pid] = "資料未變更"
+                continue
+            tasks.append((pid, df, config, digest))
+        return tasks, skipped
+
+    def run(self, product_ids: Optional[Iterable[str]] = None, include_global: bool = False,
+            on_progress: Optional[Callable[[int, int], None]] = None) -> dict:
+        started = time.perf_counter()
+        if product_ids is not None:
+            product_ids = list(product_ids)
+        # 全商品模型需要所有商品的資料，其餘情況只撈指定的商品
+        sales = load_sales(self.engine, None if include_global else product_ids)
+        tasks, skipped = self.plan(sales, product_ids, include_global)
+
+        updates: Dict[str, dict] = {}
+        trained, failed = {}, {}
+
+        def flush_state():
+            try:
+                self.save_state(updates)
+                updates.clear()
+            except OSError as e:
+                print(f"⚠️ 無法寫入訓練狀態，稍後重試: {e}")
+
+        def record(pid, digest, rows, result):
+            trained[pid] = result["fit_seconds"]
+            updates[pid] = {
+                "data_hash": digest,
+                "rows": rows,
+                "fit_seconds": result["fit_seconds"],
+                "content_sha256": result.get("content_sha256"),
+                "trained_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            if len(updates) >= TRAIN_STATE_SAVE_EVERY:
+                flush_state()
+
+        try:
+            self._execute(tasks, record, failed, on_progress)
+        finally:
+            flush_state()
+        if updates:
+            self.save_state(updates)  # 最後一次仍失敗就讓錯誤往外拋 (訓練本身出錯時不在這裡重試，以免蓋掉原本的例外)
+
+        return {
+            "trained": trained,
+            "skipped": skipped,
+            "failed": failed,
+            "workers": self.workers,
+            "elapsed_seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def _execute(self, tasks, record, failed: Dict[str, str], on_progress: Optional[Callable[[int, int], None]]):
+        total = len(tasks)
+        if total and not self.isolate and (self.workers == 1 or total == 1):
+            # 只有一個工作就不必開子行程
+            for done, (pid, df, config, digest) in enumerate(tasks, start=1):
+                try:
+                    record(pid, digest, len(df), fit_and_save(pid, df, config, self.model_dir))
+                except Exception as e:
+                    failed[pid] = str(e)
+                if on_progress:
+                    on_progress(done, total)
+        elif total:
+            # spawn：不要把 API 行程裡的模型/執行緒 fork 到子行程
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(self.workers, total), mp_context=ctx) as pool:
+                futures = {
+                    pool.submit(fit_and_save, pid, df, config, self.model_dir): (pid, digest, len(df))
+                    for pid, df, config, digest in tasks
+                }
+                for done, fut in enumerate(as_completed(futures), start=1):
+                    pid, digest, rows = futures[fut]
+                    try:
+                        record(pid, digest, rows, fut.result())
+                    except Exception as e:
+                        failed[pid] = str(e)
+                    if on_progress:
+                        on_progress(done, total)
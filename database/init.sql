@@ -19,6 +19,57 @@ CREATE TABLE IF NOT EXISTS sales_data (
 );
 CREATE INDEX IF NOT EXISTS idx_sales_date ON sales_data(transaction_date);
 CREATE INDEX IF NOT EXISTS idx_sales_product ON sales_data(product_id);
+-- 上傳時依 (商品, 日期) 重新彙總日銷量用
+CREATE INDEX IF NOT EXISTS idx_sales_product_date ON sales_data(product_id, transaction_date);
+
+-- [2.1] 每日銷量彙總表 (Sales_Daily)
+-- POS 同一商品同一天可能有多筆交易；訓練與分析一律讀這張表 (每個商品每天一筆)
+-- 由 /sales/upload 在同一個 transaction 中增量更新 (sales_upload.refresh_daily_rollup)
+CREATE TABLE IF NOT EXISTS sales_daily (
+    product_id VARCHAR(50) NOT NULL,
+    transaction_date DATE NOT NULL,
+    quantity BIGINT NOT NULL,
+    txn_count INT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (product_id, transaction_date)  -- 單一商品的歷史是 range scan
+);
+
+-- [2.2] 背景工作表 (Training_Jobs)
+-- /sales/train 只排入工作，由背景 worker 領取執行；API 重啟後工作仍在
+CREATE TABLE IF NOT EXISTS training_jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(20) NOT NULL DEFAULT 'train',
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',  -- queued / running / succeeded / failed
+    params JSONB,
+    progress_done INT DEFAULT 0,
+    progress_total INT DEFAULT 0,
+    result JSONB,
+    error TEXT,
+    attempts INT DEFAULT 0,
+    worker TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    heartbeat_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_training_jobs_status ON training_jobs(kind, status, id);
+
+-- [2.3] 預先算好的預測結果 (Sales_Forecasts)
+-- 每晚 (或訓練後) 由 forecast_store.py 對所有模型平行預測未來 N 天，以 COPY 整批寫入；
+-- /sales/predict 在「今天產生 + 模型版本相同」時直接查表，不必載入模型跑 Prophet
+CREATE TABLE IF NOT EXISTS sales_forecasts (
+    product_id VARCHAR(50) NOT NULL,
+    forecast_date DATE NOT NULL,
+    yhat DOUBLE PRECISION NOT NULL,
+    yhat_lower DOUBLE PRECISION,
+    yhat_upper DOUBLE PRECISION,
+    model_version TEXT NOT NULL,   -- 模型檔 mtime_ns-size，重新訓練後自動視為過期
+    generated_on DATE NOT NULL,    -- 以哪一天為「今天」計算
+    generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (product_id, forecast_date)
+);
+-- 預測端先確認「今天有沒有物化資料」，沒有就不查表
+CREATE INDEX IF NOT EXISTS idx_sales_forecasts_generated_on ON sales_forecasts (generated_on);
 
 -- =====================================================
 -- 3. RAG 知識庫系統架構 (核心功能)
@@ -55,6 +106,12 @@ CREATE TABLE IF NOT EXISTS documents (
     helpful_count INT DEFAULT 0,       -- 有幫助次數
     unhelpful_count INT DEFAULT 0,     -- 沒幫助次數
     view_count INT DEFAULT 0,          -- 瀏覽次數
+
+    -- 反正規化的小寫標籤陣列 (由 API 在標籤異動時同步，搜尋加分用 && 比對)
+    tag_names TEXT[] NOT NULL DEFAULT '{}',
+
+    -- 關鍵字檢索用的 bigram tsvector (標題 A / 大綱 B / 內文 C 權重，由 backend-ai/lexical.py 產生)
+    lexical tsvector,
     
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
@@ -78,6 +135,29 @@ CREATE TABLE IF NOT EXISTS feedback_logs (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- [3.6] 查詢向量快取表 (Query_Embedding_Cache)
+-- 讓多個 API worker / 重啟後共用已算好的查詢向量 (float32 原始位元組)
+CREATE TABLE IF NOT EXISTS query_embedding_cache (
+    model_name TEXT NOT NULL,
+    query TEXT NOT NULL,
+    embedding BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (model_name, query)
+);
+
+-- [3.7] 文件內文區塊表 (Document_Chunks)
+-- content 依 Markdown 標題 + token 上限切塊，每塊各自一個向量 (backend-ai/chunking.py)
+-- text_hash 用來在更新文件時判斷哪些區塊不必重新 encode
+CREATE TABLE IF NOT EXISTS document_chunks (
+    id SERIAL PRIMARY KEY,
+    document_id INT NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    chunk_index INT NOT NULL,
+    heading TEXT,
+    content TEXT NOT NULL,
+    text_hash CHAR(40) NOT NULL,
+    embedding vector(384) NOT NULL
+);
+
 -- =====================================================
 -- 4. 索引優化 (效能關鍵)
 -- =====================================================
@@ -85,12 +165,26 @@ CREATE TABLE IF NOT EXISTS feedback_logs (
 -- [4.1] HNSW 向量索引 (大幅加速語義搜尋)
 -- vector_cosine_ops 適用於餘弦相似度搜尋 (<=>)
 -- 這裡假設資料量會變大，HNSW 是目前最快的向量索引演算法
-CREATE INDEX ON documents USING hnsw (embedding vector_cosine_ops);
+-- 舊版建立的是未命名索引 (Postgres 自動命名為 documents_embedding_idx)，先改名避免重跑時再建一份
+ALTER INDEX IF EXISTS documents_embedding_idx RENAME TO idx_documents_embedding;
+-- 內文區塊 (document_chunks) 也建同樣的索引 (搜尋時取命中區塊，再依文件 pooling)
+-- 若已遷移到壓縮索引 (見 [6.4])，就不再建回 float32 索引
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE tablename = 'documents'
+                   AND indexname IN ('idx_documents_embedding_halfvec', 'idx_documents_embedding_binary')) THEN
+        CREATE INDEX IF NOT EXISTS idx_documents_embedding ON documents USING hnsw (embedding vector_cosine_ops);
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE tablename = 'document_chunks'
+                   AND indexname IN ('idx_document_chunks_embedding_halfvec', 'idx_document_chunks_embedding_binary')) THEN
+        CREATE INDEX IF NOT EXISTS idx_document_chunks_embedding ON document_chunks USING hnsw (embedding vector_cosine_ops);
+    END IF;
+END $$;
 
 -- [4.2] 一般欄位索引
 CREATE INDEX IF NOT EXISTS idx_documents_category ON documents(category);
 CREATE INDEX IF NOT EXISTS idx_tags_name ON tags(name);
-CREATE INDEX IF NOT EXISTS idx_documents_title ON documents USING gin(to_tsvector('english', title)); -- 簡單的關鍵字搜尋索引
+CREATE INDEX IF NOT EXISTS idx_document_chunks_document ON document_chunks(document_id, chunk_index);
 
 -- =====================================================
 -- 5. 預設資料初始化 (Seed Data)
@@ -112,4 +206,43 @@ INSERT INTO tags (name, usage_count) VALUES
     ('UberEats', 0), 
     ('出單機', 0), 
     ('網路設定', 0)
-ON CONFLICT (name) DO NOTHING;
\ No newline at end of file
+ON CONFLICT (name) DO NOTHING;
+
+-- =====================================================
+-- 6. 既有資料庫升級 (可重複執行)
+-- =====================================================
+-- 舊版 volume 不會重跑 init.sql，可手動執行: psql -f database/init.sql
+
+-- [6.1] documents.tag_names 反正規化標籤陣列
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS tag_names TEXT[] NOT NULL DEFAULT '{}';
+CREATE INDEX IF NOT EXISTS idx_documents_tag_names ON documents USING gin(tag_names);
+UPDATE documents d
+SET tag_names = COALESCE((
+    SELECT ARRAY_AGG(DISTINCT LOWER(t.name))
+    FROM document_tags dt JOIN tags t ON dt.tag_id = t.id
+    WHERE dt.document_id = d.id
+), '{}')
+WHERE d.tag_names = '{}';
+
+-- [6.2] sales_daily 回填 (只補缺少的日期，不覆蓋已存在的彙總)
+INSERT INTO sales_daily (product_id, transaction_date, quantity, txn_count)
+SELECT product_id, transaction_date, SUM(quantity), COUNT(*)
+FROM sales_data
+GROUP BY product_id, transaction_date
+ON CONFLICT (product_id, transaction_date) DO NOTHING;
+
+-- [6.3] document_chunks 表與索引已在上方以 IF NOT EXISTS 建立；
+-- 既有文件的區塊向量需另外執行: python backend-ai/chunking.py
+
+-- [6.4] 壓縮向量索引 (halfvec / binary，需 pgvector >= 0.7.0) 以 CONCURRENTLY 建立，不在這裡執行：
+-- python backend-ai/vector_storage.py migrate --mode halfvec，再設定 VECTOR_STORAGE=halfvec
+-- 已有壓縮索引的表，重跑本檔時 [4.1] 不會再建 float32 索引；要回復 float32 請執行 migrate --mode full
+
+-- [6.5] 關鍵字檢索欄位 (混合檢索的 lexical leg)；舊的 english 標題索引從未被查詢，移除以減少寫入成本
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS lexical tsvector;
+CREATE INDEX IF NOT EXISTS idx_documents_lexical ON documents USING gin(lexical);
+DROP INDEX IF EXISTS idx_documents_title;
+-- 既有文件需另外執行: python backend-ai/lexical.py
+
+-- [6.6] 行程內向量索引 (選用，ANN_INDEX=1) 的異動紀錄 trigger 只在啟用時建立，不在這裡執行：
+-- python backend-ai/ann_index.py install && python backend-ai/ann_index.py build
@@ -37,15 +37,25 @@ export function SalesPage() {
     }
   };
 
-  // Step 2: 訓練模型
+  // Step 2: 訓練模型 (排入背景工作後輪詢進度)
+  const waitForJob = async (jobId) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, 1500));
+      const res = await axios.get(`${API_URL}/sales/jobs/${jobId}`);
+      if (res.data.status === 'succeeded') return res.data;
+      if (res.data.status === 'failed') throw new Error(res.data.error || '訓練失敗');
+    }
+  };
+
   const handleTrain = async () => {
     setLoading(true);
     try {
-      await axios.post(`${API_URL}/sales/train`);
+      const res = await axios.post(`${API_URL}/sales/train`);
+      await waitForJob(res.data.job_id);
       alert("🎉 模型訓練完成！");
       setActiveStep(2); // 前進下一步
     } catch (err) {
-      alert("訓練失敗：" + err.message);
+      alert("訓練失敗：" + (err.response?.data?.detail || err.message));
     } finally {
       setLoading(false);
     }
@@ -0,0 +1,17 @@
+# scripts/benchmark
+# ==========================================
+# 可重現的效能基準測試 (RAG 搜尋 + 銷量預測)
+# ==========================================
+# 以固定亂數種子產生放大規模的合成資料 (延續 generate_fake_data.py / generate_mock_sales.py 的資料形狀)：
+#   - N 篇知識庫文件 (分類、標籤、含小標題的 Markdown 內文)
+#   - M 個商品 x D 天的銷售 CSV (趨勢 + 週末 / 台灣節假日加成 + 雜訊)
+# 透過 HTTP 以指定並發數打 API：/documents/bulk (灌資料)、/documents/create、/search (exact / smart)、
+# /sales/upload、/sales/train (輪詢工作直到完成)、/sales/predict。
+# 每個階段輸出吞吐量、p50/p95/p99 延遲與 API 行程的峰值 RSS (JSON)，並可與存下的基準比較，退步時 exit code 1。
+#
+# 用法 (API 連到專用的 Postgres + pgvector，例如 DATABASE_URL=.../retail_bench)：
+#   python -m scripts.benchmark --docs 5000 --skus 20 --days 365 --concurrency 16 \
+#       --server-pid $(pgrep -f "uvicorn main:app" | head -1) --out bench.json
+#   python -m scripts.benchmark ... --baseline scripts/benchmark/baseline.json   # 比較
+#   python -m scripts.benchmark ... --save-baseline scripts/benchmark/baseline.json
+# 需要 httpx (pip install httpx)。
@@ -0,0 +1,196 @@
+# scripts/benchmark/__main__.py
+# python -m scripts.benchmark --help
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from .compare import compare, print_comparison
+from .runner import RssSampler, drive
+from .workloads import (CATEGORIES, documents_jsonl, generate_documents, generate_queries, generate_sales,
+                        sales_csv, sku_ids)
+
+PHASES = ("seed", "create", "search_exact", "search_smart", "sales_upload", "train", "predict")
+RESET_TABLES = ("document_chunks", "document_tags", "feedback_logs", "documents", "tags",
+                "query_embedding_cache", "sales_daily", "sales_data", "sales_forecasts", "training_jobs")
+
+
+def reset_database(database_url: str, force: bool):
+    """清空知識庫與銷售資料，確保每次從相同狀態開始；資料庫名稱需含 bench (或 --force-reset)"""
+    from sqlalchemy import create_engine, text
+    from sqlalchemy.engine import make_url
+
+    name = make_url(database_url).database or ""
+    if "bench" not in name and not force:
+        sys.exit(f"❌ 資料庫 {name} 名稱不含 bench，拒絕清空 (確定要清空請加 --force-reset)")
+    with create_engine(database_url).begin() as conn:
+        conn.execute(text(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY CASCADE"))
+    print(f"🧹 已清空 {name}")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def wait_for_job(client, job_id: int, timeout: float) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = (await client.get(f"/sales/jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed"):
+            return job
+        await asyncio.sleep(0.5)
+    raise TimeoutError(f"訓練工作 {job_id} 超過 {timeout}s 仍未完成")
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    docs = generate_documents(args.docs, args.seed)
+    create_n = min(args.create, args.docs)
+    queries = generate_queries(200, args.seed)
+    skus = sku_ids(args.skus)
+    phases = {}
+    rss = RssSampler(args.server_pid)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=args.timeout) as client:
+        def report(name, result):
+            phases[name] = result
+            print(f"  {name:<14} {result.get('throughput_rps', 0):>9.2f} req/s  p50={result.get('p50_ms', 0):>8.1f}ms "
+                  f"p95={result.get('p95_ms', 0):>8.1f}ms  p99={result.get('p99_ms', 0):>8.1f}ms  "
+                  f"errors={result.get('errors', 0)}")
+
+        if "seed" in args.phases:
+            for name in CATEGORIES:
+                await client.post("/config/categories", json={"name": name})  # 已存在時回 400，忽略
+            payload = documents_jsonl(docs[create_n:])
+            result = await drive(lambda i: client.post(
+                "/documents/bulk", files={"file": ("bench.jsonl", payload, "application/x-ndjson")},
+                params={"create_categories": "true"}), 1, 1, rss)
+            result["docs_per_sec"] = round((args.docs - create_n) / result["elapsed_seconds"], 1)
+            report("seed", result)
+
+        if "create" in args.phases and create_n:
+            report("create", await drive(lambda i: client.post("/documents/create", json=docs[i]),
+                                         create_n, args.concurrency, rss))
+
+        for mode in ("exact", "smart"):
+            if f"search_{mode}" not in args.phases:
+                continue
+
+            def search(i, mode=mode):
+                return client.post("/search", json={"query": queries[i % len(queries)], "search_type": mode,
+                                                    "top_k": args.top_k})
+            await drive(search, min(20, args.search_requests), args.concurrency, RssSampler(None))  # 暖機
+            report(f"search_{mode}", await drive(search, args.search_requests, args.concurrency, rss))
+
+        if "sales_upload" in args.phases:
+            payload = sales_csv(generate_sales(args.skus, args.days, args.seed))
+            # replace 模式會先清空，同時上傳會互相覆蓋，所以一次一個
+            result = await drive(lambda i: client.post(
+                "/sales/upload", files={"file": ("bench.csv", payload, "text/csv")}, params={"mode": "replace"}),
+                args.upload_repeats, 1, rss)
+            result["rows_per_sec"] = round(args.skus * args.days * args.upload_repeats
+                                           / result["elapsed_seconds"], 1)
+            report("sales_upload", result)
+
+        if "train" in args.phases:
+            with rss:
+                started = time.perf_counter()
+                resp = await client.post("/sales/train", json={"all_products": True, "force": True})
+                resp.raise_for_status()
+                job = await wait_for_job(client, resp.json()["job_id"], args.train_timeout)
+                elapsed = time.perf_counter() - started
+            phases["train"] = {"elapsed_seconds": round(elapsed, 2), "status": job["status"],
+                               "models": args.skus + 1, "errors": int(job["status"] != "succeeded"),
+                               **rss.result()}
+            print(f"  {'train':<14} {elapsed:>9.1f}s  status={job['status']}")
+
+        if "predict" in args.phases:
+            for engine in args.predict_engines:
+                def predict(i, engine=engine):
+                    return client.post("/sales/predict", json={"product_id": rng.choice(skus), "days": args.horizon,
+                                                               "engine": engine})
+                await drive(predict, min(20, args.predict_requests), args.concurrency, RssSampler(None))
+                report(f"predict_{engine}", await drive(predict, args.predict_requests, args.concurrency, rss))
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "url": args.url,
+            "params": {k: getattr(args, k) for k in ("seed", "docs", "create", "skus", "days", "concurrency",
+                                                     "search_requests", "predict_requests", "top_k", "horizon")},
+        },
+        "phases": phases,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG 搜尋 + 銷量預測 效能基準測試")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--docs", type=int, default=2000, help="知識庫文件數 N")
+    parser.add_argument("--create", type=int, default=200, help="其中多少篇逐篇走 /documents/create (其餘批次匯入)")
+    parser.add_argument("--skus", type=int, default=20, help="商品數 M")
+    parser.add_argument("--days", type=int, default=365, help="每個商品的天數 D")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--search-requests", type=int, default=2000)
+    parser.add_argument("--predict-requests", type=int, default=500)
+    parser.add_argument("--predict-engines", nargs="+", default=["prophet", "fast"])
+    parser.add_argument("--upload-repeats", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--horizon", type=int, default=30, help="預測天數")
+    parser.add_argument("--phases", nargs="+", default=list(PHASES), choices=PHASES)
+    parser.add_argument("--server-pid", type=int, help="API 行程 pid (量測峰值 RSS，含子行程)")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--train-timeout", type=float, default=3600)
+    parser.add_argument("--reset", action="store_true", help="開始前清空資料 (需 --database-url)")
+    parser.add_argument("--force-reset", action="store_true")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--out", help="結果存成 JSON")
+    parser.add_argument("--baseline", help="與基準 JSON 比較，退步時 exit code 1")
+    parser.add_argument("--save-baseline", help="把這次結果存成基準")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="吞吐量 / 延遲容許的退步比例")
+    parser.add_argument("--rss-tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.reset:
+        if not args.database_url:
+            sys.exit("❌ --reset 需要 --database-url 或 DATABASE_URL")
+        reset_database(args.database_url, args.force_reset)
+
+    print(f"🏁 基準測試 {args.url} (docs={args.docs}, skus={args.skus}x{args.days}天, 並發 {args.concurrency})")
+    result = asyncio.run(run(args))
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"💾 已寫入 {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            rows = compare(result, json.load(f), args.tolerance, args.rss_tolerance)
+        print_comparison(rows)
+        regressions = [r for r in rows if r["regression"]]
+        if regressions:
+            print(f"\n❌ {len(regressions)} 項指標退步超過容許值")
+            sys.exit(1)
+        print("\n✅ 沒有超過容許值的退步")
+
+
+if __name__ == "__main__":
+    main()
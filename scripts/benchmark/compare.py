@@ -0,0 +1,44 @@
+# scripts/benchmark/compare.py
+# 與基準 JSON 比較：吞吐量下降、延遲 (p95/p99) 上升、峰值 RSS 上升超過容許值即視為退步
+from typing import List
+
+# 延遲差距小於這個毫秒數時不算退步 (避免極短請求的雜訊)
+MIN_LATENCY_DELTA_MS = 2.0
+
+
+def compare(current: dict, baseline: dict, tolerance: float = 0.15, rss_tolerance: float = 0.2) -> List[dict]:
+    """回傳每一項比較結果；regression=True 的項目代表退步"""
+    rows = []
+
+    def add(phase, metric, base, now, regression):
+        change = (now - base) / base if base else 0.0
+        rows.append({"phase": phase, "metric": metric, "baseline": base, "current": now,
+                     "change": round(change, 4), "regression": bool(regression)})
+
+    for phase, base in baseline.get("phases", {}).items():
+        now = current.get("phases", {}).get(phase)
+        if now is None:
+            continue
+        if base.get("throughput_rps"):
+            add(phase, "throughput_rps", base["throughput_rps"], now.get("throughput_rps", 0.0),
+                now.get("throughput_rps", 0.0) < base["throughput_rps"] * (1 - tolerance))
+        for metric in ("p95_ms", "p99_ms", "elapsed_seconds"):
+            if metric not in base or (metric == "elapsed_seconds" and "throughput_rps" in base):
+                continue
+            b, n = base[metric], now.get(metric, 0.0)
+            delta_ms = (n - b) * (1000 if metric == "elapsed_seconds" else 1)
+            add(phase, metric, b, n, n > b * (1 + tolerance) and delta_ms > MIN_LATENCY_DELTA_MS)
+        for metric in ("server_peak_rss_mb", "client_peak_rss_mb"):
+            if metric in base and metric in now:
+                add(phase, metric, base[metric], now[metric], now[metric] > base[metric] * (1 + rss_tolerance))
+        if "errors" in base:
+            add(phase, "errors", base["errors"], now.get("errors", 0), now.get("errors", 0) > base["errors"])
+    return rows
+
+
+def print_comparison(rows: List[dict]):
+    print(f"\n{'phase':<16} {'metric':<20} {'baseline':>12} {'current':>12} {'change':>8}")
+    for r in rows:
+        flag = "  ❌ 退步" if r["regression"] else ""
+        print(f"{r['phase']:<16} {r['metric']:<20} {r['baseline']:>12} {r['current']:>12} "
+              f"{r['change'] * 100:>+7.1f}%{flag}")
@@ -0,0 +1,136 @@
+# scripts/benchmark/runner.py
+# 以固定並發數執行請求、統計延遲分佈，並在背景取樣 API 行程的 RSS
+import asyncio
+import os
+import resource
+import threading
+import time
+from typing import Awaitable, Callable, List, Optional
+
+import httpx
+import numpy as np
+
+
+def latency_summary(latencies_ms: List[float]) -> dict:
+    if not latencies_ms:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    values = np.asarray(latencies_ms)
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+# ==========================================
+# RSS 取樣 (/proc，Linux)
+# ==========================================
+def _status_kb(pid: int, field: str) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def _children(pid: int) -> List[int]:
+    kids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                kids.extend(int(c) for c in f.read().split())
+    except OSError:
+        pass
+    return kids
+
+
+def tree_rss_mb(pid: int) -> float:
+    """行程 + 所有子行程 (訓練子行程、uvicorn workers) 的 RSS 總和"""
+    total, stack = 0, [pid]
+    while stack:
+        p = stack.pop()
+        try:
+            total += _status_kb(p, "VmRSS")
+        except OSError:
+            continue
+        stack.extend(_children(p))
+    return total / 1024
+
+
+class RssSampler:
+    """pid 為 None 時只回報 benchmark 本身的峰值 (ru_maxrss)"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self.peak_mb = 0.0
+        if self.pid is not None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            self.peak_mb = max(self.peak_mb, tree_rss_mb(self.pid))
+            if self._stopping.wait(self.interval):
+                return
+
+    def result(self) -> dict:
+        if self.pid is None:
+            return {"client_peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+        return {"server_peak_rss_mb": round(self.peak_mb, 1)}
+
+
+# ==========================================
+# 並發執行
+# ==========================================
+async def drive(send: Callable[[int], Awaitable[httpx.Response]], total: int, concurrency: int,
+                rss: RssSampler) -> dict:
+    """
+    send(i) 送出第 i 個請求；共 total 個，最多 concurrency 個同時進行。
+    回傳吞吐量、延遲分佈、錯誤數與這段期間的峰值 RSS。
+    """
+    latencies, errors = [], []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                resp = await send(i)
+                if resp.status_code >= 400:
+                    errors.append(f"{resp.status_code}: {resp.text[:200]}")
+                    continue
+            except httpx.HTTPError as e:
+                errors.append(repr(e))
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    with rss:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(max(1, min(concurrency, total)))])
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        **latency_summary(latencies),
+        **rss.result(),
+    }
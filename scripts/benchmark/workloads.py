@@ -0,0 +1,89 @@
+# scripts/benchmark/workloads.py
+# 合成資料產生器：同一個 seed 產生完全相同的文件、查詢與銷售資料
+import io
+import json
+from datetime import date
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+CATEGORIES = ["POS 操作", "電子發票", "金流支付", "外送平台", "硬體設備", "會員行銷", "報表", "其他"]
+VOCAB = ["掃碼點餐", "電子發票", "信用卡", "會員點數", "出單機", "網路設定", "外送平台", "菜單", "退款",
+         "日結報表", "庫存", "優惠券", "桌號", "廚房顯示", "藍牙", "印表機", "收銀機", "訂位", "營業時間",
+         "稅率", "折扣", "套餐", "加購", "統一編號", "載具", "行動支付", "現金", "找零", "交班", "權限",
+         "門市", "品項", "售完", "備註", "發票作廢", "列印", "重開機", "更新", "同步", "設定"]
+TAGS = ["UberEats", "Foodpanda", "LINE Pay", "街口支付", "Apple Pay", "悠遊卡", "Sunmi", "Epson",
+        "iPad", "Android", "雲端發票", "會員", "KDS", "外帶", "內用", "多門市"]
+
+
+def generate_documents(n: int, seed: int = 0) -> List[dict]:
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n):
+        words = rng.choice(VOCAB, size=3, replace=False)
+        sections = []
+        for h in range(int(rng.integers(1, 4))):
+            body = "，".join(rng.choice(VOCAB, size=int(rng.integers(20, 80))))
+            sections.append(f"## 步驟 {h + 1}：{rng.choice(VOCAB)}\n{body}。")
+        docs.append({
+            "title": f"{''.join(words)} 設定教學 #{i + 1}",
+            "category": str(rng.choice(CATEGORIES)),
+            "outline": f"說明{words[0]}與{words[1]}的操作方式",
+            "content": "\n\n".join(sections),
+            "tags": [str(t) for t in rng.choice(TAGS, size=int(rng.integers(0, 4)), replace=False)],
+        })
+    return docs
+
+
+def documents_jsonl(docs: List[dict]) -> bytes:
+    return "\n".join(json.dumps(d, ensure_ascii=False) for d in docs).encode("utf-8")
+
+
+def generate_queries(n: int, seed: int = 0) -> List[str]:
+    """1~2 個領域詞，偶爾帶標籤名稱 (觸發標籤加分)"""
+    rng = np.random.default_rng(seed + 1)
+    queries = []
+    for _ in range(n):
+        words = list(rng.choice(VOCAB, size=int(rng.integers(1, 3)), replace=False))
+        if rng.random() < 0.3:
+            words.append(str(rng.choice(TAGS)))
+        queries.append(" ".join(words))
+    return queries
+
+
+def sku_ids(m: int) -> List[str]:
+    return [f"sku_{i + 1:05d}" for i in range(m)]
+
+
+def generate_sales(m: int, days: int, seed: int = 0, end: date = None) -> pd.DataFrame:
+    """
+    與 generate_mock_sales.py 相同的形狀 (基礎量 + 每日成長 + 節假日 x1.5 / 週末 x1.2 + 雜訊)，
+    每個商品的基礎量與成長率不同；以 numpy 一次產生全部 M x D 筆。
+    結束日預設固定為 2025-12-31，結果不隨執行日期改變。
+    """
+    import holidays
+
+    rng = np.random.default_rng(seed + 2)
+    end = end or date(2025, 12, 31)
+    dates = pd.date_range(end=pd.Timestamp(end), periods=days, freq="D")
+    tw_holidays = holidays.TW(years=sorted(set(dates.year)))
+    multiplier = np.where([d in tw_holidays for d in dates.date], 1.5,
+                          np.where(dates.weekday >= 4, 1.2, 1.0))
+
+    base = rng.uniform(20, 200, size=(m, 1))
+    growth = rng.uniform(-0.02, 0.15, size=(m, 1))
+    qty = (base + growth * np.arange(days)) * multiplier + rng.integers(-15, 31, size=(m, days))
+    qty = np.clip(qty, 0, None).astype(int)
+
+    return pd.DataFrame({
+        "product_id": np.repeat(sku_ids(m), days),
+        "transaction_date": np.tile(dates.strftime("%Y-%m-%d"), m),
+        "quantity": qty.ravel(),
+    })
+
+
+def sales_csv(df: pd.DataFrame) -> bytes:
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    return buf.getvalue().encode("utf-8")
@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from datetime import datetime, timedelta
 
 # 1. 設定資料庫連線 (連到剛剛 Docker 起來的 DB)
@@ -47,6 +47,16 @@ if __name__ == "__main__":
     # 2. 寫入資料庫
     try:
         combined_df.to_sql('sales_data', engine, if_exists='append', index=False)
+        # 同步更新每日彙總表 (訓練讀的是 sales_daily)
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO sales_daily (product_id, transaction_date, quantity, txn_count)
+                SELECT product_id, transaction_date, SUM(quantity), COUNT(*)
+                FROM sales_data
+                GROUP BY product_id, transaction_date
+                ON CONFLICT (product_id, transaction_date) DO UPDATE
+                SET quantity = EXCLUDED.quantity, txn_count = EXCLUDED.txn_count, updated_at = CURRENT_TIMESTAMP
+            """))
         print("✅ 成功將數據寫入 PostgreSQL Docker 容器！")
     except Exception as e:
         print(f"❌ 寫入失敗: {e}")
\ No newline at end of file